@@ -1,10 +1,15 @@
 import os
 import json
 import random
+import toml
 from dotenv import load_dotenv
 # load_dotenv()
 
 from src import world_generation, role_play, load_summary
+from src.world_generation import WorldCandidatePool
+from src.world_library import world_library
+from src.telemetry import telemetry
+from src.character_generator import CharacterPrefetcher, DEFAULT_CHARACTER_PROMPTS
 from rich.console import Console
 from rich.panel import Panel
 from rich.text import Text
@@ -119,21 +124,45 @@ class WGARPApp:
         if not background:
             background = "地理、历史、文化、魔法体系"
         
-        # 生成并确认世界观
+        # 生成并确认世界观；world_candidates > 1 时并行生成多个候选供选择
+        game_config = toml.load('config.toml')['game']
+        world_candidates = game_config.get('world_candidates', 1)
+        character_prefetch = game_config.get('character_prefetch', 2)  # 查看世界观时在后台预生成的角色数
+        pool = None
+        candidate = None
+        offer_library = True  # 新背景时先询问是否复用世界观库中相同背景的世界观
         while True:
-            os.system('cls')
-            self.console.print(Panel("🔮 正在生成世界观...", border_style="cyan"))
-            world_desc = world_generation.generate_world(background)
-            
-            if not world_desc:
-                self.console.print("[red]❌ 世界观生成失败，请重试[/red]")
-                input("按回车键继续...")
-                continue
+            from_library = False
+            if offer_library:
+                offer_library = False
+                world_desc = self._choose_library_world(background)
+                from_library = world_desc is not None
+            if from_library:
+                os.system('cls')
+            elif world_candidates > 1:
+                if pool is None:
+                    pool = WorldCandidatePool(background, world_candidates)
+                candidate = self._select_world_candidate(pool)
+                if candidate is None:
+                    pool.close()
+                    return False
+                world_desc = candidate["world"]
+                os.system('cls')
+            else:
+                os.system('cls')
+                world_desc = self._generate_world_streaming(background)
+
+                if not world_desc:
+                    self.console.print("[red]❌ 世界观生成失败，请重试[/red]")
+                    input("按回车键继续...")
+                    continue
             
             # 显示生成的世界观
             self.console.print("\n" + "="*60)
             self.console.print(Panel(world_desc, title="[bold magenta]🌍 生成的世界观[/bold magenta]", border_style="magenta"))
             self.console.print("="*60)
+            # 玩家阅读世界观的同时在后台预生成角色候选，放弃该世界观时取消
+            prefetcher = CharacterPrefetcher(world_desc, DEFAULT_CHARACTER_PROMPTS[:character_prefetch])
             
             # 用户确认
             while True:
@@ -148,21 +177,136 @@ class WGARPApp:
                 choice = Prompt.ask("[bold yellow]请输入选项[/bold yellow]", console=self.console)
                 
                 if choice == "1":
+                    if pool:
+                        # 其余候选存入世界观库，供之后相同背景的新游戏复用
+                        pool.accept(candidate)
+                        pool.close()
+                    elif not from_library:
+                        world_library.add(background, world_desc, used=True)
                     os.system('cls')
                     self.console.print("[bold green]🎮 正在进入游戏...[/bold green]")
-                    role_play.start_role_play(world_desc, None, None, None)
+                    role_play.start_role_play(world_desc, None, None, None, character_prefetcher=prefetcher)
                     return True
                 elif choice == "2":
+                    prefetcher.cancel()
+                    if pool:
+                        pool.discard(candidate)  # 回到候选列表，其余候选通常已生成完毕
+                    elif not from_library:
+                        world_library.add(background, world_desc)
                     break  # 重新生成
                 elif choice == "3":
+                    prefetcher.cancel()
+                    if not pool and not from_library:
+                        world_library.add(background, world_desc)
+                    offer_library = True
                     background = Prompt.ask("[bold cyan]请输入新的背景设定[/bold cyan]", console=self.console, default="").strip()
                     if not background:
                         background = "地理、历史、文化、魔法体系"
+                    if pool:
+                        pool.discard(candidate, replace=False)
+                        pool.close()
+                        pool = None
                     break  # 重新生成
                 elif choice == "4":
+                    prefetcher.cancel()
+                    if pool:
+                        pool.discard(candidate, replace=False)
+                        pool.close()
+                    elif not from_library:
+                        world_library.add(background, world_desc)
                     return False
                 else:
                     self.console.print("[red]❌ 无效选择，请重新输入[/red]")
+
+    def _choose_library_world(self, background):
+        """世界观库中有相同背景（且模型配置相同）的世界观时，让玩家选择复用或重新生成；返回复用的世界观，重新生成时返回None"""
+        from rich.table import Table
+        from datetime import datetime
+
+        entries = world_library.entries(background, limit=9)
+        if not entries:
+            return None
+        table = Table(title=f"📚 世界观库（{background}）", border_style="magenta")
+        table.add_column("编号", style="bold green", justify="right")
+        table.add_column("标题", style="white", overflow="ellipsis", no_wrap=True, max_width=40)
+        table.add_column("生成时间", style="dim")
+        table.add_column("状态", style="cyan")
+        for idx, entry in enumerate(entries, 1):
+            generated = datetime.fromtimestamp(entry["ts"]).strftime("%Y-%m-%d %H:%M")
+            table.add_row(str(idx), entry["title"], generated, "玩过" if entry["used"] else "未使用")
+        self.console.print(table)
+        choice = Prompt.ask(
+            "[bold yellow]输入编号复用之前生成的世界观（直接回车生成新的世界观）[/bold yellow]",
+            console=self.console, default="", show_default=False
+        ).strip()
+        if choice.isdigit() and 1 <= int(choice) <= len(entries):
+            telemetry.increment("世界观库复用")
+            return world_library.use(entries[int(choice) - 1]["id"])
+        return None
+
+    def _generate_world_streaming(self, background):
+        """流式生成世界观，边生成边在实时面板中显示"""
+        from rich.live import Live
+
+        waiting = Panel("🔮 正在生成世界观...", border_style="cyan")
+        with Live(waiting, console=self.console, refresh_per_second=8, transient=True) as live:
+            return world_generation.generate_world(
+                background,
+                on_delta=lambda text: live.update(Panel(
+                    text, title="[bold magenta]🌍 正在生成世界观...[/bold magenta]", border_style="cyan"
+                ))
+            )
+
+    def _candidate_table(self, ready, pending):
+        """候选世界观列表"""
+        from rich.table import Table
+
+        table = Table(title="🌍 世界观候选", border_style="magenta", show_lines=False)
+        table.add_column("编号", style="bold green", justify="right")
+        table.add_column("来源", style="cyan")
+        table.add_column("预览", style="white", overflow="ellipsis", no_wrap=True, max_width=48)
+        table.add_column("字数", style="dim", justify="right")
+        for idx, candidate in enumerate(ready, 1):
+            record = candidate["record"]
+            if candidate["source"] == "library":
+                source = "世界观库"
+            else:
+                source = f"新生成 t={candidate['temperature']:.2f}"
+            table.add_row(str(idx), source, record.title, str(len(record.text)))
+        if pending:
+            table.caption = f"⏳ 还有 {pending} 个候选正在生成..."
+        return table
+
+    def _select_world_candidate(self, pool):
+        """候选世界观选择界面：候选生成完成后逐个加入列表，返回选中的候选（返回主菜单时为None）"""
+        from rich.live import Live
+
+        while True:
+            os.system('cls')
+            ready, pending = pool.snapshot()
+            if not ready and pending:
+                # 等待第一个候选完成，期间实时刷新列表
+                with Live(self._candidate_table(ready, pending), console=self.console,
+                          refresh_per_second=4, transient=True) as live:
+                    while not ready and pending:
+                        pool.wait(0.25)
+                        ready, pending = pool.snapshot()
+                        live.update(self._candidate_table(ready, pending))
+            if not ready:
+                self.console.print("[red]❌ 世界观生成失败，请重试[/red]")
+                input("按回车键继续...")
+                pool.refill()
+                continue
+
+            self.console.print(self._candidate_table(ready, pending))
+            choice = Prompt.ask(
+                "[bold yellow]输入编号查看候选（直接回车刷新列表，0 返回主菜单）[/bold yellow]",
+                console=self.console, default="", show_default=False
+            ).strip()
+            if choice == "0":
+                return None
+            if choice.isdigit() and 1 <= int(choice) <= len(ready):
+                return ready[int(choice) - 1]
     
     def run(self):
         """运行主程序"""
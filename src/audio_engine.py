@@ -0,0 +1,216 @@
+import time
+import queue
+import logging
+import threading
+from collections import OrderedDict
+from src.telemetry import telemetry
+
+
+class AudioEngine:
+    """音频引擎：所有 pygame.mixer 调用都在单个后台线程中执行，游戏主线程只向命令队列提交命令
+
+    播放使用两个声道交替：新音乐在一个声道淡入，旧音乐在另一个声道淡出，实现基调之间的交叉淡入淡出。
+    命令队列空闲时，按本局基调切换的历史预测下一个可能的基调，提前解码其中一首，切换时无需等待解码。
+    解码后的音乐（Sound）全部载入内存（5分钟的音乐约 25MB），缓存按解码后的大小限制在 cache_mb 以内，
+    超出时先释放最久未使用的（刚解码的一首总是保留）。
+    """
+
+    def __init__(self, library, mixer, volume=0.3, crossfade=2.0, preload=1, cache_mb=64, idle_interval=0.5):
+        self.library = library
+        self.mixer = mixer
+        self.volume = volume
+        self.crossfade_ms = int(crossfade * 1000)
+        self.preload = preload
+        self.cache_bytes = int(cache_mb * 1024 * 1024)
+        self.idle_interval = idle_interval
+        self.state = "音乐系统未初始化"
+        self.current = None  # 正在播放的 Track
+        self._commands = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._play_seq = 0  # 最新一条播放/停止命令的序号，较早的播放命令直接跳过
+        self._channels = None
+        self._active = 0
+        self._paused = False
+        self._playing = {}  # 声道序号 -> Sound，淡出结束前保持引用
+        self._sounds = OrderedDict()  # 路径 -> (已解码的 Sound, 解码后字节数)
+        self._cached_bytes = 0
+        self._next = {}  # 基调 -> 预先解码的 Track
+        self._transitions = {}  # 基调 -> {下一个基调: 次数}
+
+    # ---- 主线程调用的命令：立即返回 ----
+
+    def _submit(self, command, *args):
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, daemon=True)
+                self._worker.start()
+            if command in ("play", "stop"):
+                self._play_seq += 1
+                args = args + (self._play_seq,)
+        self._commands.put((command, args))
+
+    def play_mood(self, mood):
+        """切换到指定基调的音乐（交叉淡入淡出）"""
+        self._submit("play", mood)
+
+    def stop(self):
+        self._submit("stop")
+
+    def pause(self):
+        self._submit("pause")
+
+    def resume(self):
+        self._submit("resume")
+
+    def set_volume(self, volume):
+        self._submit("volume", max(0.0, min(1.0, volume)))
+
+    def status(self):
+        """当前状态（不访问 pygame）"""
+        with self._lock:
+            return self.state
+
+    def join(self):
+        """等待已提交的命令全部执行完毕"""
+        self._commands.join()
+
+    # ---- 以下均在音频线程中执行 ----
+
+    def _set_state(self, state):
+        with self._lock:
+            self.state = state
+
+    def _run(self):
+        while True:
+            try:
+                command, args = self._commands.get(timeout=self.idle_interval)
+            except queue.Empty:
+                self._preload_next()
+                continue
+            try:
+                self._ensure_mixer()
+                getattr(self, f"_do_{command}")(*args)
+            except Exception as e:
+                # 音乐失败不影响游戏
+                logging.warning(f"音频命令 {command} 执行失败: {e}")
+                self._set_state(f"音乐播放失败: {e}")
+            finally:
+                self._commands.task_done()
+
+    def _ensure_mixer(self):
+        if not self.mixer.get_init():
+            self.mixer.init(frequency=22050, size=-16, channels=2, buffer=512)
+        if self._channels is None:
+            self._channels = (self.mixer.Channel(0), self.mixer.Channel(1))
+
+    def _sound_bytes(self, sound):
+        """解码后占用的内存：时长 × 采样率 × 声道数 × 每个采样的字节数"""
+        frequency, size, channels = self.mixer.get_init()
+        return int(sound.get_length() * frequency * channels * abs(size) // 8)
+
+    def _load(self, track):
+        """解码一首音乐（已缓存时直接返回）；解码失败的文件标记为无法播放"""
+        cached = self._sounds.get(track.path)
+        if cached is not None:
+            self._sounds.move_to_end(track.path)
+            return cached[0]
+        start = time.perf_counter()
+        try:
+            sound = self.mixer.Sound(track.path)
+        except Exception as e:
+            track.error = f"解码失败: {e}"
+            raise
+        telemetry.record_timing("音乐解码耗时", time.perf_counter() - start)
+        size = self._sound_bytes(sound)
+        self._sounds[track.path] = (sound, size)
+        self._cached_bytes += size
+        while self._cached_bytes > self.cache_bytes and len(self._sounds) > 1:
+            _, (_, evicted) = self._sounds.popitem(last=False)
+            self._cached_bytes -= evicted
+        return sound
+
+    def _do_play(self, mood, seq):
+        if seq != self._play_seq:
+            return  # 之后又提交了新的播放或停止命令
+        track = self._next.pop(mood, None)
+        if track is not None and track.playable:
+            telemetry.increment("音乐预加载命中")
+            sound = self._load(track)
+        else:
+            # 解码失败的文件已被标记为无法播放，换一首重试
+            for attempt in range(3):
+                track = self.library.pick(mood)
+                if track is None:
+                    self._set_state(f"音乐文件夹中没有可播放的音乐: {self.library.folder}")
+                    return
+                try:
+                    sound = self._load(track)
+                    break
+                except Exception:
+                    if attempt == 2:
+                        raise
+        if self._paused:
+            self.mixer.unpause()
+            self._paused = False
+        previous = self.current
+        if previous is not None:
+            counts = self._transitions.setdefault(previous.mood, {})
+            counts[track.mood] = counts.get(track.mood, 0) + 1
+            self._channels[self._active].fadeout(self.crossfade_ms)
+        self._active = 1 - self._active
+        channel = self._channels[self._active]
+        channel.set_volume(self.volume)
+        channel.play(sound, loops=-1, fade_ms=self.crossfade_ms if previous is not None else 0)
+        self._playing[self._active] = sound
+        self.current = track
+        self._set_state(f"正在播放: {track.mood}/{track.name}")
+
+    def _do_stop(self, seq):
+        if self._channels:
+            for channel in self._channels:
+                channel.fadeout(300)
+        self.current = None
+        self._set_state("已停止")
+
+    def _do_pause(self):
+        if self.current is not None:
+            self.mixer.pause()
+            self._paused = True
+            self._set_state("已暂停")
+
+    def _do_resume(self):
+        if self.current is not None:
+            self.mixer.unpause()
+            self._paused = False
+            self._set_state(f"正在播放: {self.current.mood}/{self.current.name}")
+
+    def _do_volume(self, volume):
+        self.volume = volume
+        if self._channels:
+            self._channels[self._active].set_volume(volume)
+
+    def _predict(self):
+        """按本局的基调切换次数预测接下来可能切换到的基调，没有历史时按基调列表顺序"""
+        current = self.current.mood
+        counts = self._transitions.get(current, {})
+        moods = [mood for mood in self.library.moods() if mood != current]
+        return sorted(moods, key=lambda mood: -counts.get(mood, 0))[:self.preload]
+
+    def _preload_next(self):
+        """空闲时提前解码下一个可能的基调中的一首音乐"""
+        if self.current is None or self._channels is None:
+            return
+        for mood in self._predict():
+            if mood in self._next:
+                continue
+            track = self.library.pick(mood)
+            if track is None:
+                continue
+            try:
+                self._load(track)
+            except Exception as e:
+                logging.warning(f"预加载音乐失败: {e}")
+                continue
+            self._next[mood] = track
+            return  # 每次空闲只解码一首，及时响应新命令
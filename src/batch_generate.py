@@ -0,0 +1,240 @@
+"""
+批量内容生成命令行工具
+
+用法（在项目根目录下运行）：
+    python -m src.batch_generate manifest.json output.jsonl [--workers 4] [--rpm 60] [--restart] [--library]
+
+清单文件（JSON）：
+    {
+        "backgrounds": ["魔法学院", "赛博朋克"],
+        "character_prompts": ["一个年轻法师", "一个神秘商人"],
+        "worlds_per_background": 2,
+        "characters_per_world": 3
+    }
+
+每个背景生成 worlds_per_background 个世界观，每个世界观按 character_prompts 轮流生成 characters_per_world 个角色。
+结果逐行追加写入 JSONL；中断后重新运行同一命令会跳过已完成的条目，从断点继续。
+使用 --library 时同时存入世界观库与角色库，新游戏选择相同背景时可直接复用。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from src.llm_core import llm_core
+from src.telemetry import telemetry
+from src.records import Character, World
+from src.world_digest import world_hash
+from src.world_library import world_library, character_library
+
+MODEL_TYPES = ("world_generation", "character_generation")
+
+
+def load_manifest(path):
+    """读取并校验清单文件"""
+    with open(path, "r", encoding="utf-8") as f:
+        manifest = json.load(f)
+    backgrounds = [bg.strip() for bg in manifest.get("backgrounds", []) if bg and bg.strip()]
+    if not backgrounds:
+        raise ValueError("清单中没有任何世界观背景（backgrounds）")
+    characters_per_world = int(manifest.get("characters_per_world", 0))
+    prompts = [prompt.strip() for prompt in manifest.get("character_prompts", []) if prompt and prompt.strip()]
+    if characters_per_world and not prompts:
+        raise ValueError("characters_per_world 大于0时需要提供角色提示词（character_prompts）")
+    return {
+        "backgrounds": backgrounds,
+        "character_prompts": prompts,
+        "worlds_per_background": max(1, int(manifest.get("worlds_per_background", 1))),
+        "characters_per_world": max(0, characters_per_world),
+    }
+
+
+def _read_progress(output):
+    """读取已有输出：返回 (已完成的条目编号, 世界观编号 -> 世界观全文)
+
+    末尾写入中断的残行会被截掉，避免与之后追加的记录连在一起；无法解析或格式不符的行被跳过。
+    """
+    done, worlds = set(), {}
+    if not os.path.exists(output):
+        return done, worlds
+    with open(output, "rb+") as f:
+        offset = 0
+        for line in f:
+            if not line.endswith(b"\n"):
+                f.truncate(offset)
+                break
+            offset += len(line)
+            try:
+                record = json.loads(line)
+                record_id, record_type = record["id"], record["type"]
+                if record_type == "world":
+                    worlds[record_id] = record["world"]
+            except (ValueError, TypeError, KeyError):
+                continue
+            done.add(record_id)
+    return done, worlds
+
+
+def _generate_world(task):
+    background = task["background"]
+    world = llm_core.generate_world(background)
+    if not world:
+        raise RuntimeError("世界观生成失败")
+    record = World(world)
+    return {"id": task["id"], "type": "world", "background": background, "world": record.text,
+            "title": record.title, "hash": record.hash}
+
+
+def _generate_character(task):
+    text = llm_core.generate_character(task["world"], task["prompt"])
+    if not text:
+        raise RuntimeError("角色生成失败")
+    character = Character.parse(text)
+    if not character.is_valid():
+        raise RuntimeError("角色设定格式不完整")
+    return {"id": task["id"], "type": "character", "world_id": task["world_id"], "prompt": task["prompt"],
+            "character": character.text, "fields": character.to_dict()}
+
+
+def _add_to_library(record, task):
+    """将生成结果存入世界观库或角色库"""
+    if record["type"] == "world":
+        world_library.add(record["background"], record["world"])
+    else:
+        character_library.add(record["prompt"], record["character"], world_hash(task["world"].strip()))
+
+
+def _character_tasks(manifest, world_id, world, done):
+    """某个世界观下尚未完成的角色任务"""
+    prompts = manifest["character_prompts"]
+    tasks = []
+    for m in range(manifest["characters_per_world"]):
+        task_id = f"{world_id}:c{m}"
+        if task_id not in done:
+            tasks.append({"id": task_id, "world_id": world_id, "world": world, "prompt": prompts[m % len(prompts)]})
+    return tasks
+
+
+def run_batch(manifest, output, workers=4, rpm=None, restart=False, library=False):
+    """按清单批量生成世界观与角色，结果追加写入 JSONL（library 为真时同时存入内容库），返回统计信息"""
+    lock_path = f"{output}.lock"
+    try:
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        print(f"❌ 另一个批量任务正在写入该输出（如确认没有，请删除 {lock_path}）")
+        return None
+
+    try:
+        if restart and os.path.exists(output):
+            os.remove(output)
+        if rpm:
+            for model_type in MODEL_TYPES:
+                provider = llm_core.config_manager.get_model_config(model_type)['provider']
+                llm_core.rate_limiter.limits[provider] = rpm
+        done, worlds = _read_progress(output)
+        world_tasks = [
+            {"id": f"w{b}:{k}", "background": background}
+            for b, background in enumerate(manifest["backgrounds"])
+            for k in range(manifest["worlds_per_background"])
+            if f"w{b}:{k}" not in done
+        ]
+        # 断点续跑：已完成世界观下未完成的角色直接排队
+        character_tasks = [task for world_id, world in worlds.items()
+                           for task in _character_tasks(manifest, world_id, world, done)]
+        print(f"🔍 已完成 {len(done)} 条，待生成世界观 {len(world_tasks)} 个、角色 {len(character_tasks)} 个（已知）")
+
+        usage_before = {model_type: dict(telemetry.llm_usage.get(model_type, {})) for model_type in MODEL_TYPES}
+        counts = {"world": 0, "character": 0, "failed": 0}
+        errors = {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor, open(output, "a", encoding="utf-8") as out:
+            futures = {executor.submit(_generate_world, task): task for task in world_tasks}
+            futures.update({executor.submit(_generate_character, task): task for task in character_tasks})
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    task = futures.pop(future)
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        counts["failed"] += 1
+                        reason = str(e) or type(e).__name__
+                        errors[reason] = errors.get(reason, 0) + 1
+                        continue
+                    out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n")
+                    out.flush()
+                    counts[record["type"]] += 1
+                    if library:
+                        _add_to_library(record, task)
+                    if record["type"] == "world":
+                        for character_task in _character_tasks(manifest, record["id"], record["world"], done):
+                            futures[executor.submit(_generate_character, character_task)] = character_task
+                    finished_count = counts["world"] + counts["character"]
+                    if finished_count % 10 == 0:
+                        elapsed = time.perf_counter() - start
+                        print(f"  ... 已生成 {finished_count} 条，{finished_count / elapsed * 60:.1f} 条/分钟")
+        elapsed = time.perf_counter() - start
+
+        usage = {}
+        for model_type in MODEL_TYPES:
+            after = telemetry.llm_usage.get(model_type, {})
+            before = usage_before[model_type]
+            usage[model_type] = {key: after.get(key, 0) - before.get(key, 0)
+                                 for key in ("calls", "prompt_tokens", "completion_tokens")}
+        generated = counts["world"] + counts["character"]
+        attempted = generated + counts["failed"]
+        stats = {
+            **counts,
+            "elapsed": elapsed,
+            "items_per_min": generated / elapsed * 60 if elapsed > 0 else 0.0,
+            "error_rate": counts["failed"] / attempted if attempted else 0.0,
+            "errors": errors,
+            "usage": usage,
+        }
+        _print_stats(stats, output)
+        return stats
+    finally:
+        os.close(lock_fd)
+        os.remove(lock_path)
+
+
+def _print_stats(stats, output):
+    """打印批量生成结果、吞吐、错误率与token用量"""
+    print("=" * 60)
+    print(f"🏭 批量生成完成，结果已写入 {output}")
+    print("=" * 60)
+    print(f"🌍 世界观: {stats['world']}")
+    print(f"👤 角色:   {stats['character']}")
+    print(f"❌ 失败:   {stats['failed']}（错误率 {stats['error_rate']:.1%}，重新运行同一命令可重试）")
+    for reason, count in sorted(stats["errors"].items(), key=lambda item: -item[1]):
+        print(f"     - {reason}: {count}")
+    for model_type, usage in stats["usage"].items():
+        print(f"🔢 {model_type}: {usage['calls']}次调用，输入{usage['prompt_tokens']} / 输出{usage['completion_tokens']} tokens")
+    print(f"⏱️  耗时 {stats['elapsed']:.1f}s，{stats['items_per_min']:.1f} 条/分钟")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.batch_generate", description="WGARP 批量内容生成工具")
+    parser.add_argument("manifest", help="清单文件（JSON）")
+    parser.add_argument("output", help="输出文件（JSONL，已存在时从断点继续）")
+    parser.add_argument("--workers", type=int, default=4, help="并发请求数（默认4）")
+    parser.add_argument("--rpm", type=int, default=None,
+                        help="每分钟最多请求数（默认使用 config.toml 的 [rate_limits]）")
+    parser.add_argument("--restart", action="store_true", help="清空已有输出，重新生成")
+    parser.add_argument("--library", action="store_true", help="同时存入世界观库与角色库，供新游戏复用")
+    args = parser.parse_args(argv)
+
+    try:
+        manifest = load_manifest(args.manifest)
+    except (OSError, ValueError) as e:
+        print(f"❌ 清单文件无效: {e}")
+        return 1
+    stats = run_batch(manifest, args.output, max(1, args.workers), args.rpm, args.restart, args.library)
+    if stats is None:
+        return 1
+    return 0 if not stats["failed"] else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1037 @@
+"""
+性能基准测试
+
+用法（在项目根目录下运行，不会调用任何大模型接口）：
+    python -m src.benchmark            # 运行全部基准
+    python -m src.benchmark save_archive
+"""
+import os
+import sys
+import time
+import random
+import json
+import tempfile
+from types import SimpleNamespace
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+BENCHMARKS = {}
+
+
+def benchmark(func):
+    """注册基准测试函数"""
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def _report(name, count, elapsed, unit="个"):
+    """打印单项吞吐结果"""
+    rate = count / elapsed if elapsed > 0 else float("inf")
+    print(f"  {name:<28} {count:>7}{unit}  {elapsed * 1000:>9.1f}ms  {rate:>10.0f}{unit}/秒")
+
+
+class _FakeClient:
+    """离线模拟的大模型客户端：按请求内容返回固定格式的回复，并给出估算的usage"""
+
+    def __init__(self, responder):
+        self.responder = responder
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, model, messages, **kwargs):
+        from src.telemetry import estimate_tokens
+        if kwargs.get("stream"):
+            return self._stream(self.responder(messages, kwargs))
+        contents = [self.responder(messages, kwargs) for _ in range(kwargs.get("n", 1))]
+        usage = SimpleNamespace(
+            prompt_tokens=sum(estimate_tokens(m.get("content", "")) for m in messages),
+            completion_tokens=sum(estimate_tokens(content) for content in contents),
+        )
+        choices = [SimpleNamespace(message=SimpleNamespace(content=content)) for content in contents]
+        return SimpleNamespace(choices=choices, usage=usage)
+
+    def _stream(self, content, piece=16):
+        """流式输出：按固定长度分段返回，不附带usage"""
+        for i in range(0, len(content), piece):
+            delta = SimpleNamespace(content=content[i:i + piece])
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], usage=None)
+
+
+@contextmanager
+def _offline_llm(responder):
+    """将 llm_core 的所有提供商替换为离线模拟客户端"""
+    from src.llm_core import llm_core
+    for provider in llm_core.config_manager.get_all_providers():
+        os.environ.setdefault(f"{provider.upper()}_API_URL", "http://127.0.0.1:9")
+    original = llm_core._get_client
+    fake = _FakeClient(responder)
+    llm_core._get_client = lambda provider: fake
+    try:
+        yield llm_core
+    finally:
+        llm_core._get_client = original
+
+
+def _default_responder(messages, kwargs):
+    """模拟回复：结构化存档请求返回JSON，其余返回一段摘要文本"""
+    if any("只输出一个JSON对象" in msg["content"] for msg in messages):
+        return json.dumps({"summary": "主角在雾林中击退魔狼，获得古老护符并前往王都。" * 4, "save_name": "雾林护符",
+                           "state": {"location": "王都", "status": "轻伤", "inventory": "护符", "characters": ["老猎人"]}},
+                          ensure_ascii=False)
+    return "主角在雾林中击退魔狼，获得古老护符并前往王都，途中结识老猎人。" * 3
+
+
+def _make_transcript(turns):
+    """生成合成的角色扮演对话"""
+    messages = [{"role": "system", "content": "角色扮演系统提示"}, {"role": "user", "content": "我扮演以下角色：艾琳"}]
+    places = ["雾林", "王都", "港口", "遗迹", "魔法学院", "矿坑"]
+    for i in range(turns):
+        place = places[i % len(places)]
+        messages.append({"role": "user", "content": f"我的行动：前往{place}寻找线索"})
+        messages.append({"role": "assistant", "content": (
+            f"用户身份：艾琳\n时间: 第{i}日黄昏\n地点: {place}\n"
+            f"情景: 你来到{place}，老猎人说道前方有危险。你在战斗中击退了魔狼，获得银色钥匙。\n"
+            "===============\n用户状态: 生命值80，魔法值60\n===============\n"
+            "用户物品栏: 魔法短杖，旅行斗篷，银色钥匙\n===============\n"
+            "用户接下来的选择(使用数字标记):\n1. 继续探索 2. 返回营地 3. 询问老猎人"
+        )})
+    return messages
+
+
+def _make_save_fixture(save_manager, count):
+    """生成 count 个合成存档"""
+    rng = random.Random(42)
+    base_time = datetime(2025, 1, 1)
+    for i in range(count):
+        recent = []
+        for turn in range(5):
+            recent.append({"r": "u", "c": f"探索第{turn}个遗迹"})
+            recent.append({"r": "a", "c": f"用户身份：旅人\n时间: 第{turn}日\n地点: 遗迹{i}\n情景: " + "风声呼啸" * 30})
+        data = {
+            "summary": f"存档{i}：在{rng.choice(['魔法学院', '雾林', '王都', '港口'])}的冒险" + "剧情" * 40,
+            "world": "世界观设定" * 200,
+            "role": "姓名: 艾琳\n职业: 魔法师",
+            "recent_context": recent,
+            "last_updated": (base_time + timedelta(minutes=i)).isoformat(),
+            "version": "2.0",
+        }
+        save_manager.write_save_file(f"{save_manager.data_dir}/存档{i}_{1700000000 + i}.json", data)
+
+
+@benchmark
+def save_archive(count=10000):
+    """存档批量导出/导入吞吐（10k 存档）"""
+    from src.summary import SaveManager
+
+    with tempfile.TemporaryDirectory() as tmp:
+        source = SaveManager(os.path.join(tmp, "source"))
+        _make_save_fixture(source, count)
+
+        for suffix in (".ndjson", ".ndjson.gz", ".tar", ".tar.gz"):
+            archive = os.path.join(tmp, f"saves{suffix}")
+            start = time.perf_counter()
+            exported = source.export_saves(archive)
+            _report(f"export {suffix}", exported, time.perf_counter() - start)
+            size_mb = os.path.getsize(archive) / 1024 / 1024
+            print(f"  {'':<28} 归档大小 {size_mb:.1f}MB")
+
+            target = SaveManager(os.path.join(tmp, f"target{suffix}"))
+            start = time.perf_counter()
+            counts = target.import_saves(archive)
+            _report(f"import {suffix}", counts["imported"], time.perf_counter() - start)
+
+        start = time.perf_counter()
+        exported = source.export_saves(os.path.join(tmp, "filtered.ndjson"), search="王都")
+        _report("export (search filter)", exported, time.perf_counter() - start)
+
+        # 归档中混入一条截断的记录：计为失败，其余存档照常导入
+        broken = os.path.join(tmp, "broken.ndjson")
+        with open(os.path.join(tmp, "saves.ndjson"), "r", encoding="utf-8") as src, \
+                open(broken, "w", encoding="utf-8") as dst:
+            lines = [next(src) for _ in range(100)]
+            lines[50] = lines[50][:40] + "\n"
+            dst.writelines(lines)
+        counts = SaveManager(os.path.join(tmp, "target_broken")).import_saves(broken)
+        assert counts["imported"] == 99 and counts["failed"] == 1, counts
+        print(f"  {'import (1 malformed record)':<28} 导入 {counts['imported']}，失败 {counts['failed']}")
+
+
+@benchmark
+def checkpoint_calls(checkpoints=20):
+    """每个存档检查点的模型调用次数与token（legacy 分步 vs unified 单次结构化 vs extractive 本地抽取）"""
+    from src.summary import SaveManager
+    from src.telemetry import telemetry
+
+    messages = _make_transcript(30)
+    with tempfile.TemporaryDirectory() as tmp, _offline_llm(_default_responder) as llm_core:
+        manager = SaveManager(tmp)
+        session_context = "世界观：魔法大陆，角色：艾琳"
+        for mode in ("legacy", "unified", "extractive"):
+            summary = ""
+            start = time.perf_counter()
+            with telemetry.track_calls() as usage:
+                for i in range(checkpoints):
+                    if mode == "legacy":
+                        new_summary = llm_core.generate_leaf_summary(messages, summary, session_context)
+                        name = llm_core.generate_compact_save_name(new_summary, f"第{i}轮")
+                        summary, _ = manager.save_game_state(messages, "魔法大陆", name, "艾琳", summary)
+                    else:
+                        if mode == "unified":
+                            result = llm_core.generate_checkpoint(messages, summary, session_context, f"第{i}轮")
+                        else:
+                            result = llm_core.generate_extractive_checkpoint(messages)
+                        summary, _ = manager.save_game_state(messages, "魔法大陆", result["save_name"], "艾琳",
+                                                             summary, summary=result["summary"])
+            elapsed = time.perf_counter() - start
+            tokens = usage["prompt_tokens"] + usage["completion_tokens"]
+            print(f"  {mode:<10} 每检查点 {usage['calls'] / checkpoints:.1f} 次调用，"
+                  f"{tokens / checkpoints:.0f} tokens（输入{usage['prompt_tokens'] // checkpoints} / "
+                  f"输出{usage['completion_tokens'] // checkpoints}），本地耗时 {elapsed / checkpoints * 1000:.1f}ms")
+
+
+@benchmark
+def memory_retrieval(turns=10000, queries=200):
+    """回合记忆 BM25 索引构建与检索延迟（10k 回合）"""
+    from src.retrieval import TurnMemory
+
+    rng = random.Random(7)
+    npcs = ["老猎人", "铁匠格林", "女祭司", "盗贼莉拉", "国王", "商人"]
+    places = ["雾林", "王都", "港口", "遗迹", "魔法学院", "矿坑", "沼泽", "雪山"]
+    items = ["银色钥匙", "古老护符", "火焰之剑", "治疗药水", "星图", "龙鳞"]
+    with tempfile.TemporaryDirectory() as tmp:
+        memory = TurnMemory("bench", memory_dir=tmp)
+        start = time.perf_counter()
+        for turn in range(turns):
+            npc, place, item = rng.choice(npcs), rng.choice(places), rng.choice(items)
+            reply = (f"用户身份：艾琳\n时间: 第{turn}日\n地点: {place}\n"
+                     f"情景: {npc}答应在{place}等你，并交给你{item}。你们约定在月圆之夜再会。\n"
+                     "===============\n用户状态: 良好\n===============\n用户物品栏: {item}\n"
+                     "===============\n用户接下来的选择(使用数字标记):\n1. 出发 2. 休息")
+            memory.add_turn(turn, f"向{npc}询问{item}的来历", reply)
+        _report("incremental add", turns, time.perf_counter() - start, "回合")
+
+        start = time.perf_counter()
+        reloaded = TurnMemory("bench", memory_dir=tmp)
+        _report("load + rebuild", len(reloaded.passages), time.perf_counter() - start, "回合")
+
+        start = time.perf_counter()
+        for _ in range(queries):
+            reloaded.recall(f"我想找{rng.choice(npcs)}问问{rng.choice(items)}的事")
+        elapsed = time.perf_counter() - start
+        _report("recall (top3)", queries, elapsed, "次")
+        print(f"  {'':<28} 平均每次检索 {elapsed / queries * 1000:.2f}ms")
+
+
+@benchmark
+def turn_history(turns=1000, fork_at=437):
+    """回合历史：记录吞吐、文件大小与重建延迟，及从中间回合分支后读档的状态一致性"""
+    from src.turn_history import TurnHistory, extract_block
+    from src.summary import SaveManager
+    from src.summary_tree import SummaryTree
+    from src.game_state import GameState
+    from src.records import Character, World
+    from src.load_summary import SaveLoader
+
+    transcript = _make_transcript(turns)
+    for i, msg in enumerate(transcript):
+        if msg["role"] == "assistant":
+            msg["content"] = msg["content"].replace("银色钥匙\n", f"银色钥匙，金币{i}\n")
+    with tempfile.TemporaryDirectory() as tmp:
+        history = TurnHistory(history_dir=tmp)
+        tree = SummaryTree()
+        trees = {}
+        start = time.perf_counter()
+        for turn in range(1, turns + 1):
+            if turn % 5 == 0:
+                tree.add_leaf(f"第{turn}回合：艾琳在{turn % 7}号遗迹找到新的线索")
+            trees[turn] = tree.to_dict()
+            reply = transcript[2 * turn + 1]["content"]
+            history.record_turn(turn, transcript[:2 * turn + 2], extract_block(reply, ["用户状态"]),
+                                extract_block(reply, ["用户物品栏"]), tree.render(), trees[turn])
+        _report("record_turn", turns, time.perf_counter() - start, "回合")
+        print(f"  {'':<28} 历史文件 {os.path.getsize(history.file_path) / 1024:.0f}KB")
+
+        start = time.perf_counter()
+        reloaded = TurnHistory(history.history_id, history_dir=tmp)
+        state = reloaded.reconstruct(fork_at)
+        print(f"  {'load + reconstruct':<28} {(time.perf_counter() - start) * 1000:.1f}ms")
+        assert state["messages"] == transcript[1:2 * fork_at + 2]
+
+        # 从中间回合分出分支存档：读档后的状态应与原存档在该回合时一致
+        saves = SaveManager(os.path.join(tmp, "saves"))
+        character = Character.parse("姓名: 艾琳\n职业: 魔法师").to_dict()
+        world_record = World.parse(_make_world()).to_dict()
+        _, save_name = saves.save_game_state(
+            transcript, "魔法大陆", save_name="艾琳_1700000000", role="姓名: 艾琳", summary=tree.render(),
+            extra={"history_id": history.history_id, "history_turn": turns, "summary_tree": tree.to_dict(),
+                   "character": character, "world_record": world_record})
+        loader = SaveLoader()
+        loader.save_manager = saves
+        start = time.perf_counter()
+        branch_name = loader._fork_save(save_name, saves.read_save(save_name), reloaded, fork_at)
+        print(f"  {'fork save':<28} {(time.perf_counter() - start) * 1000:.1f}ms")
+
+        loaded = saves.read_save(branch_name)
+        resumed = TurnHistory.resume(loaded["history_id"], loaded["history_turn"], history_dir=tmp)
+        assert resumed.reconstruct(resumed.latest_turn())["messages"] == transcript[1:2 * fork_at + 2]
+        assert f"金币{2 * fork_at + 1}" in GameState.from_dict(loaded["game_state"]).inventory
+        assert SummaryTree.from_dict(loaded["summary_tree"]).to_dict() == trees[fork_at]
+        assert loaded["character"] == character and loaded["world_record"] == world_record
+        print(f"  {'fork + load':<28} 第{fork_at}回合的对话、状态、摘要树与角色/世界观记录一致")
+
+
+@benchmark
+def summary_extractors(turns=5000):
+    """摘要提取器吞吐：关键词自动机单次扫描 vs 逐行逐关键词匹配"""
+    from src.llm_core import llm_core, _KEYWORDS
+
+    messages = _make_transcript(turns)
+    total_chars = sum(len(msg["content"]) for msg in messages)
+
+    # 参照实现：与改造前相同的逐行 any(keyword in line) 循环
+    keyword_sets = {
+        "system": ["正在播放", "摘要生成", "存档", "加载", "音乐", "保存"],
+        "result": ['发现', '获得', '遇到', '到达', '死亡', '成功', '失败'],
+        "stat": ['生命', '魔法', '经验', '金币', '物品'],
+        "plot": ['战斗', '对话', '探索', '解谜', '交易', '学习'],
+        "scenario": ['情景', '地点', '状态', '物品', '选择'],
+    }
+    start = time.perf_counter()
+    for msg in messages:
+        for line in msg["content"].split('\n'):
+            {group for group, keywords in keyword_sets.items() if any(k in line for k in keywords)}
+    naive = time.perf_counter() - start
+    _report("per-line any() scan", len(messages), naive, "条")
+
+    start = time.perf_counter()
+    _KEYWORDS.groups_by_line("\n".join(msg["content"] for msg in messages))
+    compiled = time.perf_counter() - start
+    _report("automaton single pass", len(messages), compiled, "条")
+    print(f"  {'':<28} 关键词扫描提速 {naive / compiled:.1f}x（{total_chars / compiled / 1024 / 1024:.1f}M字符/秒）")
+
+    for name in ("extract_batch", "_extract_story_elements", "_extract_key_content"):
+        start = time.perf_counter()
+        getattr(llm_core, name)(messages)
+        _report(name, len(messages), time.perf_counter() - start, "条")
+
+
+@benchmark
+def checkpoint_policy(turns=60):
+    """检查点触发次数：固定间隔 vs 自适应（前半程平静回合，后半程频繁事件）"""
+    from src.checkpoint_policy import FixedIntervalPolicy, AdaptivePolicy
+
+    places = ["雾林", "王都", "港口", "遗迹", "魔法学院", "矿坑", "沼泽", "雪山"]
+    items = ["银色钥匙", "古老护符", "火焰之剑", "治疗药水", "星图", "龙鳞"]
+
+    def make_reply(turn):
+        if turn < turns // 2:
+            return (f"用户身份：艾琳\n时间: 第{turn}日\n地点: 旅店\n情景: 你在旅店休息，窗外下着雨。\n"
+                    "===============\n用户状态: 良好\n===============\n用户物品栏: 斗篷\n"
+                    "===============\n用户接下来的选择(使用数字标记):\n1. 继续休息 2. 出门")
+        place, item = places[turn % len(places)], items[turn % len(items)]
+        return (f"用户身份：艾琳\n时间: 第{turn}日\n地点: {place}{turn}\n"
+                f"情景: 你来到{place}{turn}，在激战中击败守卫，获得{item}{turn}。同伴不幸死亡。\n"
+                "===============\n用户状态: 重伤\n===============\n用户物品栏: 斗篷\n"
+                "===============\n用户接下来的选择(使用数字标记):\n1. 追击 2. 撤退")
+
+    for policy in (FixedIntervalPolicy(3), AdaptivePolicy()):
+        quiet = eventful = 0
+        start = time.perf_counter()
+        for turn in range(turns):
+            policy.observe("我的行动：继续", make_reply(turn))
+            if policy.should_checkpoint():
+                policy.mark_checkpoint()
+                if turn < turns // 2:
+                    quiet += 1
+                else:
+                    eventful += 1
+        elapsed = time.perf_counter() - start
+        print(f"  {policy.name:<10} 检查点 {quiet + eventful:>3} 次（平静段 {quiet} / 事件段 {eventful}），"
+              f"策略耗时 {elapsed / turns * 1000:.2f}ms/回合")
+
+
+@benchmark
+def history_sanitizer(turns=30):
+    """发送给模型的提示词token：原始对话历史 vs 净化后（移除界面提示、压缩较早回合）"""
+    from src.history_sanitizer import sanitize_history
+    from src.telemetry import estimate_tokens
+
+    transcript = _make_transcript(turns)
+    for i, msg in enumerate(transcript):
+        if msg["role"] == "assistant" and i % 3 == 0:
+            msg["content"] += "\n\n✅ 智能存档已完成: 雾林护符\n🔍 已优化对话内容并生成高质量摘要"
+    raw_total = sanitized_total = 0
+    start = time.perf_counter()
+    for end in range(4, len(transcript) + 1, 2):
+        # 逐回合模拟每次请求时发送的对话历史
+        history = transcript[:end]
+        raw_total += sum(estimate_tokens(msg["content"]) for msg in history)
+        sanitized_total += sum(estimate_tokens(msg["content"]) for msg in sanitize_history(history))
+    elapsed = time.perf_counter() - start
+    _report("sanitize per request", turns, elapsed, "次")
+    last_raw = sum(estimate_tokens(msg["content"]) for msg in transcript)
+    last_sanitized = sum(estimate_tokens(msg["content"]) for msg in sanitize_history(transcript))
+    print(f"  {'':<28} 第{turns}回合提示词 {last_raw} → {last_sanitized} tokens（-{1 - last_sanitized / last_raw:.0%}）")
+    print(f"  {'':<28} {turns}回合累计 {raw_total} → {sanitized_total} tokens"
+          f"，平均每回合节省 {(raw_total - sanitized_total) / turns:.0f} tokens")
+
+
+@benchmark
+def state_protocol(turns=40):
+    """每回合输出token：完整状态与物品栏（full） vs 只输出变化（delta，本地合并展开）"""
+    from src.game_state import GameState
+    from src.telemetry import estimate_tokens
+
+    rng = random.Random(11)
+    pool = ["钥匙", "护符", "之剑", "药水", "星图", "龙鳞", "长弓", "矿石", "卷轴", "宝石"]
+    adjectives = ["银色", "古老", "火焰", "治疗", "精灵", "秘银", "传送", "月光", "暗影", "黄金"]
+    status = ["精神饱满", "生命值100/100", "魔法值60/60"]
+    inventory = ["魔法短杖", "旅行斗篷", "干粮"]
+    head = "用户身份：艾琳\n时间: 黄昏\n地点: 雾林\n情景: 你继续在雾林中前进，四周一片寂静。\n===============\n"
+    tail = "===============\n用户接下来的选择(使用数字标记):\n1. 前进 2. 后退"
+    state = GameState()
+    state.apply_reply(f"用户状态: {'，'.join(status)}\n用户物品栏: {'，'.join(inventory)}")
+    full_tokens = delta_tokens = mismatches = 0
+    start = time.perf_counter()
+    for turn in range(turns):
+        status_delta, inventory_delta = [], []
+        if rng.random() < 0.4:
+            hp = f"生命值{rng.randint(20, 100)}/100"
+            status[1] = hp
+            status_delta.append(f"+{hp}")
+        item = f"{rng.choice(adjectives)}{rng.choice(pool)}"
+        if rng.random() < 0.5 and item not in inventory:
+            inventory.append(item)
+            inventory_delta.append(f"+{item}")
+        if len(inventory) > 4 and rng.random() < 0.3:
+            removed = inventory.pop(3)
+            inventory_delta.append(f"-{removed}")
+        full_reply = f"{head}用户状态: {'，'.join(status)}\n===============\n用户物品栏: {'，'.join(inventory)}\n{tail}"
+        delta_reply = (f"{head}用户状态变化: {'，'.join(status_delta) or '无'}\n===============\n"
+                       f"用户物品栏变化: {'，'.join(inventory_delta) or '无'}\n{tail}")
+        full_tokens += estimate_tokens(full_reply)
+        delta_tokens += estimate_tokens(delta_reply)
+        mismatches += state.apply_reply(delta_reply) != full_reply
+    elapsed = time.perf_counter() - start
+    _report("apply + expand", turns, elapsed, "回合")
+    print(f"  {'':<28} 每回合输出 full {full_tokens / turns:.0f} / delta {delta_tokens / turns:.0f} tokens"
+          f"（-{1 - delta_tokens / full_tokens:.0%}），展开结果不一致 {mismatches} 次")
+
+
+@benchmark
+def prompt_prefix_reuse(turns=30, checkpoint_every=3):
+    """相邻请求的可复用前缀比例：改造前的提示词布局 vs 按稳定性排序的组装器"""
+    from src.prompt_assembler import PromptAssembler
+    from src.history_sanitizer import sanitize_history
+
+    world = "魔法大陆艾瑟兰：七大王国、古老魔法体系与失落的龙族。" * 40
+    role = "姓名: 艾琳\n职业: 魔法师\n能力: 精通火系魔法"
+    instructions = "你是一个角色扮演大师。请严格按照固定格式输出每一轮内容。" * 20
+    transcript = _make_transcript(turns)[2:]
+    session_context = f"世界观：{world[:200]}，角色：{role[:100]}"
+
+    def measure(name, requests):
+        assembler = PromptAssembler()
+        ratios = [assembler.record(name, messages) for messages in requests][1:]
+        print(f"  {name:<28} 平均可复用前缀 {sum(ratios) / len(ratios):.0%}（最低 {min(ratios):.0%}）")
+
+    # 角色扮演：旧布局摘要追加在系统提示末尾、角色在首条用户消息；新布局为 格式 → 世界观 → 角色 → 摘要 → 历史
+    legacy, assembled, summary = [], [], ""
+    for turn in range(turns):
+        if turn and turn % checkpoint_every == 0:
+            summary = f"第{turn}轮前的剧情摘要：艾琳在各地追寻线索。" * 3
+        history = sanitize_history(transcript[:turn * 2 + 1])
+        legacy.append([{"role": "system", "content": f"{instructions}\n{world}\n剧情摘要：{summary}"},
+                       {"role": "user", "content": f"我扮演以下角色：\n{role}\n请开始角色扮演游戏。"}] + history)
+        assembled.append(PromptAssembler().build(instructions, world=world, role=role, summary=summary,
+                                                 history=[{"role": "user", "content": "请开始角色扮演游戏。"}] + history))
+    measure("role_play legacy", legacy)
+    measure("role_play assembled", assembled)
+
+    # 存档检查点：旧提示词把会话背景、摘要、新增事件放在固定的JSON格式说明之前
+    captured = []
+
+    def responder(messages, kwargs):
+        captured.append(messages)
+        return _default_responder(messages, kwargs)
+
+    legacy, summary = [], ""
+    with _offline_llm(responder) as llm_core:
+        for turn in range(checkpoint_every, turns + 1, checkpoint_every):
+            messages = transcript[:turn * 2]
+            latest = messages[-1]["content"]
+            legacy.append([{"role": "user", "content": (
+                "作为故事摘要专家，请根据以下信息更新冒险存档，只输出一个JSON对象，不要输出任何其他内容：\n"
+                f"【会话背景】{session_context}\n"
+                f"【当前摘要】{summary}\n【新增事件】{llm_core._extract_recent_key_events(messages[-8:])}\n"
+                f"【最新场景】{llm_core._extract_scenario_info(latest)}\n"
+                f"【存档信息】第{turn}轮\n\n"
+                "JSON格式：\n"
+                '{"summary": "300字以内的故事摘要，保持连贯，保留关键角色、地点、物品", '
+                '"save_name": "4-6字的存档标题", '
+                '"state": {"location": "当前地点", "status": "用户状态", "inventory": "用户物品栏", "characters": ["重要角色"]}}'
+            )}])
+            summary = llm_core.generate_checkpoint(messages, summary, session_context, f"第{turn}轮")["summary"]
+    measure("checkpoint legacy", legacy)
+    measure("checkpoint assembled", captured)
+
+
+@benchmark
+def reply_validator(replies=2000):
+    """回复格式校验：常见格式偏差的本地修复率与耗时"""
+    from src.reply_validator import repair_reply, is_valid, parse_reply
+
+    good = ("用户身份：艾琳\n时间: 黄昏\n地点: 雾林\n情景: 你走进雾林，四周弥漫着雾气。\n===============\n"
+            "用户状态: 疲惫\n===============\n用户物品栏: 短杖，斗篷\n===============\n"
+            "用户接下来的选择(使用数字标记):\n1. 前进 2. 后退 3. 休息")
+    deviations = {
+        "half-width colon": lambda r: r.replace("用户身份：", "用户身份:"),
+        "full-width colons": lambda r: r.replace(": ", "："),
+        "markdown labels": lambda r: r.replace("时间:", "**时间**:").replace("地点:", "**地点**:"),
+        "missing separators": lambda r: r.replace("===============\n", ""),
+        "dash separators": lambda r: r.replace("===============", "-----"),
+        "inline choices": lambda r: r.replace("(使用数字标记):\n", "：").replace(". ", "、"),
+        "lead-in choices": lambda r: r.replace("===============\n用户接下来的选择(使用数字标记):\n", "接下来你可以："),
+        "unlabeled scene": lambda r: r.replace("情景: ", ""),
+        "missing status": lambda r: r.replace("用户状态: 疲惫\n===============\n", ""),
+        "missing choices": lambda r: r.split("===============\n用户接下来")[0],
+    }
+    rng = random.Random(5)
+    previous = good.replace("雾林", "林边")
+    state = {"status": ["疲惫"], "inventory": ["短杖", "斗篷"]}
+    counts = {"valid": 0, "repaired": 0, "needs_model": 0}
+    start = time.perf_counter()
+    for _ in range(replies):
+        reply = good
+        for name in rng.sample(list(deviations), rng.randint(0, 3)):
+            reply = deviations[name](reply)
+        repaired, changed, missing = repair_reply(reply, previous, state)
+        if missing:
+            counts["needs_model"] += 1
+        elif changed:
+            counts["repaired"] += 1
+            assert is_valid(repaired)
+        else:
+            counts["valid"] += 1
+    _report("validate + repair", replies, time.perf_counter() - start, "条")
+    # 引导语与选项写在同一行
+    _, narrative, choices = parse_reply("情景: 你来到城下。\n守卫拦住了你……\n你可以：1. 进入城门 2. 离开")
+    assert narrative == ["守卫拦住了你……"] and choices == [("1", "进入城门"), ("2", "离开")], (narrative, choices)
+    print(f"  {'':<28} 合格 {counts['valid']} / 本地修复 {counts['repaired']} / 需模型补全或重新生成 {counts['needs_model']}")
+
+
+@benchmark
+def reply_candidates(turns=10, latency=0.2):
+    """重新生成本回合的等待时间与额外token：单候选 vs 多候选缓存（模拟每次请求 200ms 延迟）"""
+    from src.telemetry import telemetry
+
+    class SlowClient(_FakeClient):
+        def __init__(self, responder, supports_n):
+            super().__init__(responder)
+            self.supports_n = supports_n
+
+        def _create(self, model, messages, **kwargs):
+            time.sleep(latency)
+            if not self.supports_n:
+                kwargs.pop("n", None)
+            return super()._create(model, messages, **kwargs)
+
+    reply = _make_transcript(1)[-1]["content"]
+    request = [{"role": "system", "content": "角色扮演"}, {"role": "user", "content": "我的行动：前进"}]
+    with _offline_llm(_default_responder) as llm_core:
+        original = llm_core._get_client
+        for n, supports_n in ((1, True), (3, True), (3, False)):
+            llm_core._get_client = lambda provider, client=SlowClient(lambda m, k: reply, supports_n): client
+            llm_core._n_unsupported.clear()
+            waits = []
+            # 并行请求在工作线程中发起，因此按全局用量的差值统计
+            before = dict(telemetry.llm_usage.get("role_play", {"calls": 0, "completion_tokens": 0}))
+            for _ in range(turns):
+                start = time.perf_counter()
+                cache = llm_core.role_play_candidates(request, n)[1:]
+                turn_wait = time.perf_counter() - start
+                start = time.perf_counter()
+                if not cache:
+                    llm_core.role_play_response(request)
+                waits.append(time.perf_counter() - start)
+            usage = {key: telemetry.llm_usage["role_play"][key] - before[key] for key in ("calls", "completion_tokens")}
+            label = f"n={n}" + ("" if supports_n else "（并行请求）")
+            print(f"  {label:<16} 回合 {turn_wait * 1000:.0f}ms，重新生成等待 {sum(waits) / turns * 1000:.0f}ms，"
+                  f"每回合 {usage['calls'] / turns:.1f} 次调用 / 输出 {usage['completion_tokens'] // turns} tokens")
+        llm_core._get_client = original
+
+
+def _write_wav(path, seconds, rate=8000):
+    """写入一个静音的单声道 16 位 WAV 文件"""
+    import wave
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(rate)
+        f.writeframes(b"\0\0" * rate * seconds)
+
+
+@benchmark
+def music_first_paint(turns=9, latency=0.2):
+    """回复到首屏的耗时：同步音乐评估 vs 后台音乐评估（模拟每次音乐请求 200ms 延迟）"""
+    import src.music_director as music_director
+    from src.music_library import MusicLibrary
+
+    class SlowClient(_FakeClient):
+        def _create(self, model, messages, **kwargs):
+            time.sleep(latency)
+            return super()._create(model, messages, **kwargs)
+
+    def responder(messages, kwargs):
+        return "是" if "只输出'是'或'否'" in messages[0]["content"] else "紧张"
+
+    played = []
+    reply = _make_transcript(1)[-1]["content"]
+    with tempfile.TemporaryDirectory() as folder, _offline_llm(responder) as llm_core:
+        for mood in ("紧张", "欢快", "悲伤"):
+            os.makedirs(os.path.join(folder, mood))
+            _write_wav(os.path.join(folder, mood, "track.wav"), 1)
+        library = MusicLibrary(folder, os.path.join(folder, "index.json"))
+        player = SimpleNamespace(play_music_by_mood=lambda mood: played.append(mood), library=library)
+        original = llm_core._get_client
+        llm_core._get_client = lambda provider, client=SlowClient(responder): client
+        try:
+            for label, background in (("同步（原流程）", False), ("后台任务", True)):
+                director = music_director.MusicDirector(player)
+                paints = []
+                for turn in range(turns):
+                    arrived = time.perf_counter()
+                    if background:
+                        director.submit(reply, turn)
+                    elif turn == 0 or turn % 3 == 0:
+                        director._evaluate(reply, turn)
+                    paints.append(time.perf_counter() - arrived)  # 此处输出回复
+                director._tasks.join()
+                print(f"  {label:<16} 平均 {sum(paints) / turns * 1000:.0f}ms，最大 {max(paints) * 1000:.0f}ms")
+        finally:
+            llm_core._get_client = original
+
+
+@benchmark
+def music_library(moods=5, per_mood=400, broken=20, turns=200):
+    """音乐库（2k 首）：每回合 os.listdir 扫描 vs 启动时建立索引；冷启动解析、带缓存启动与每回合选曲的耗时"""
+    from src.music_library import MusicLibrary
+
+    with tempfile.TemporaryDirectory() as tmp:
+        folder = os.path.join(tmp, "game_music")
+        for m in range(moods):
+            os.makedirs(os.path.join(folder, f"基调{m}"))
+            for t in range(per_mood):
+                _write_wav(os.path.join(folder, f"基调{m}", f"曲目{t}.wav"), 1, rate=800)
+        for b in range(broken):
+            with open(os.path.join(folder, f"基调{b % moods}", f"损坏{b}.mp3"), "wb") as f:
+                f.write(b"not an audio file" * 100)
+
+        start = time.perf_counter()
+        for _ in range(turns):
+            # 原流程：每次播放列出基调文件夹，再列出该基调下的文件
+            available = [name for name in os.listdir(folder) if os.path.isdir(os.path.join(folder, name))]
+            mood_folder = os.path.join(folder, random.choice(available))
+            random.choice([f for f in os.listdir(mood_folder) if f.endswith((".mp3", ".wav", ".ogg"))])
+        listdir = time.perf_counter() - start
+
+        index_path = os.path.join(tmp, "music_index.json")
+        start = time.perf_counter()
+        library = MusicLibrary(folder, index_path)
+        library.refresh()
+        cold = time.perf_counter() - start
+        start = time.perf_counter()
+        warm = MusicLibrary(folder, index_path)
+        warm.refresh()
+        print(f"  建立索引 冷启动 {cold * 1000:.0f}ms，带缓存启动 {(time.perf_counter() - start) * 1000:.0f}ms，"
+              f"标记无法播放 {len(warm.invalid())} 个")
+
+        start = time.perf_counter()
+        for _ in range(turns):
+            warm.pick(random.choice(warm.moods()))
+        indexed = time.perf_counter() - start
+        print(f"  每回合选曲 os.listdir {listdir / turns * 1e6:.0f}µs，索引 {indexed / turns * 1e6:.0f}µs")
+
+        # 新增一首后，文件夹修改时间变化，只重新扫描该基调
+        _write_wav(os.path.join(folder, "基调0", "新曲目.wav"), 1, rate=800)
+        start = time.perf_counter()
+        changed = warm.refresh(force=True)
+        print(f"  目录变化后增量刷新 {(time.perf_counter() - start) * 1000:.1f}ms（有变化: {changed}），"
+              f"基调0 共 {len(warm.tracks('基调0'))} 首")
+
+
+@benchmark
+def audio_engine(switches=6, decode=0.3, idle=1.0):
+    """切换基调时主线程的阻塞时间：主线程同步解码 vs 音频线程；及空闲预加载后切换到可听见的延迟（模拟解码 300ms）"""
+    from src.audio_engine import AudioEngine
+    from src.music_library import MusicLibrary
+
+    played = []
+
+    class FakeChannel:
+        def play(self, sound, loops=0, fade_ms=0):
+            played.append(time.perf_counter())
+
+        def fadeout(self, ms):
+            pass
+
+        def set_volume(self, volume):
+            pass
+
+    def load(path):
+        time.sleep(decode)
+        return SimpleNamespace(path=path, get_length=lambda: 1.0)
+
+    mixer = SimpleNamespace(get_init=lambda: (22050, -16, 2), init=lambda **kwargs: None, Channel=lambda idx: FakeChannel(),
+                            Sound=load, pause=lambda: None, unpause=lambda: None)
+    with tempfile.TemporaryDirectory() as folder:
+        for mood in ("紧张", "平静"):
+            os.makedirs(os.path.join(folder, mood))
+            _write_wav(os.path.join(folder, mood, "track.wav"), 1)
+        library = MusicLibrary(folder, os.path.join(folder, "index.json"))
+        moods = ["紧张", "平静"] * (switches // 2)
+
+        start = time.perf_counter()
+        for mood in moods:
+            FakeChannel().play(load(library.pick(mood).path))  # 原流程：主线程加载并播放
+        print(f"  {'主线程同步解码':<16} 每次切换阻塞 {(time.perf_counter() - start) / switches * 1000:.0f}ms")
+
+        for label, idle_interval in (("音频线程", 60.0), ("音频线程+预加载", 0.2)):
+            engine = AudioEngine(library, mixer, idle_interval=idle_interval, cache_mb=0)
+            blocked, audible = [], []
+            for mood in moods:
+                played.clear()
+                start = time.perf_counter()
+                engine.play_mood(mood)
+                blocked.append(time.perf_counter() - start)
+                engine.join()
+                audible.append(played[0] - start)
+                time.sleep(idle)  # 玩家阅读回复，音频线程空闲
+            print(f"  {label:<16} 每次切换阻塞 {sum(blocked) / switches * 1e6:.0f}µs，"
+                  f"切换后 {sum(audible[1:]) / (switches - 1) * 1000:.0f}ms 开始播放")
+
+
+@benchmark
+def world_candidates(rejections=3, latency=0.2):
+    """新游戏世界观：首个候选与每次重新生成的等待时间，逐个生成 vs 并行候选（模拟每次请求 200ms 延迟）"""
+    from src.world_generation import WorldCandidatePool
+    from src.world_library import ContentLibrary
+
+    class SlowClient(_FakeClient):
+        def _create(self, model, messages, **kwargs):
+            time.sleep(latency)
+            return super()._create(model, messages, **kwargs)
+
+    def responder(messages, kwargs):
+        return f"艾尔德兰大陆（温度{kwargs.get('temperature')}）\n" + "地理、历史、文化与魔法体系。" * 50
+
+    with tempfile.TemporaryDirectory() as folder, _offline_llm(responder) as llm_core:
+        original = llm_core._get_client
+        llm_core._get_client = lambda provider, client=SlowClient(responder): client
+        try:
+            waits = []
+            for _ in range(rejections + 1):
+                start = time.perf_counter()
+                llm_core.generate_world("魔法学院")
+                waits.append(time.perf_counter() - start)
+            print(f"  {'逐个生成':<16} 首个 {waits[0] * 1000:.0f}ms，重新生成平均 {sum(waits[1:]) / rejections * 1000:.0f}ms")
+
+            library = ContentLibrary(os.path.join(folder, "worlds.jsonl"), "world_generation")
+            pool = WorldCandidatePool("魔法学院", size=3, library=library)
+            waits = []
+            for _ in range(rejections + 1):
+                start = time.perf_counter()
+                ready, pending = pool.snapshot()
+                while not ready and pending:
+                    pool.wait(0.05)
+                    ready, pending = pool.snapshot()
+                waits.append(time.perf_counter() - start)
+                pool.discard(ready[0])
+            pool.close()
+            while pool.snapshot()[1]:
+                pool.wait(0.05)
+            print(f"  {'并行候选 n=3':<16} 首个 {waits[0] * 1000:.0f}ms，重新生成平均 {sum(waits[1:]) / rejections * 1000:.0f}ms，"
+                  f"存入世界观库 {library.count('魔法学院')} 个")
+            start = time.perf_counter()
+            WorldCandidatePool("魔法学院", size=3, library=library).close()
+            print(f"  {'复用世界观库':<16} 首个 {(time.perf_counter() - start) * 1000:.0f}ms")
+        finally:
+            llm_core._get_client = original
+
+
+@benchmark
+def world_streaming(chars=1200, first_token=0.2, chunk_delay=0.008):
+    """世界观生成：开始显示内容前的等待时间，普通请求 vs 流式输出（模拟首token 200ms、每段 8ms）"""
+    from src.telemetry import telemetry
+
+    world = "艾尔德兰大陆的地理、历史、文化与魔法体系。" * (chars // 20)
+
+    class SlowClient(_FakeClient):
+        def _create(self, model, messages, **kwargs):
+            time.sleep(first_token)
+            if not kwargs.get("stream"):
+                time.sleep(chunk_delay * (len(world) // 16))
+            return super()._create(model, messages, **kwargs)
+
+        def _stream(self, content, piece=16):
+            for chunk in super()._stream(content, piece):
+                time.sleep(chunk_delay)
+                yield chunk
+
+    with _offline_llm(lambda messages, kwargs: world) as llm_core:
+        original = llm_core._get_client
+        llm_core._get_client = lambda provider, client=SlowClient(lambda messages, kwargs: world): client
+        try:
+            for label, streaming in (("普通请求", False), ("流式输出", True)):
+                shown = []
+                start = time.perf_counter()
+                on_delta = (lambda text: shown or shown.append(time.perf_counter() - start)) if streaming else None
+                result = llm_core.generate_world("魔法学院", on_delta=on_delta)
+                total = time.perf_counter() - start
+                visible = shown[0] if shown else total
+                assert result == world
+                print(f"  {label:<16} 开始显示 {visible * 1000:.0f}ms，全部完成 {total * 1000:.0f}ms")
+        finally:
+            llm_core._get_client = original
+    timings = {name: telemetry.timings[name] for name in ("世界观首token延迟", "世界观生成总耗时") if name in telemetry.timings}
+    print("  遥测: " + "，".join(f"{name} 平均{total / count * 1000:.0f}ms" for name, (count, total, _) in timings.items()))
+
+
+def _make_world(regions=12):
+    """生成合成的长篇世界观（Markdown 标题 + 段落）"""
+    names = ["艾尔德兰", "霜歌港", "赤岩要塞", "星陨湖", "迷雾森林", "黄金平原", "龙脊山脉", "银月城",
+             "灰烬荒原", "潮汐群岛", "翡翠谷", "永夜深渊", "晨曦神殿", "铁炉堡", "风语高地", "白骨沙漠"]
+    lines = ["# 艾尔德兰大陆世界观", "", "## 地理"]
+    for i in range(regions):
+        name = names[i % len(names)]
+        lines.append(f"### {name}")
+        lines.append(f"{name}位于大陆的第{i + 1}区域，气候多变，居民以农耕与贸易为生。"
+                     f"这里流传着关于{names[(i + 3) % len(names)]}的古老传说，守护者每隔百年苏醒一次。"
+                     f"当地的魔法师擅长元素魔法，与{names[(i + 5) % len(names)]}的学派长期竞争。")
+        lines.append("")
+    lines += ["## 历史", "大陆经历了三次大战，第一次魔潮战争摧毁了古代帝国，第二次战争确立了七国同盟。" * 3, "",
+              "## 魔法体系", "魔法源自星辰之力，分为元素、咒印、召唤三系，施法需要消耗精神力与魔晶。" * 3]
+    return "\n".join(lines)
+
+
+@benchmark
+def world_digest(turns=20):
+    """每回合提示词中的世界观：全文 vs 缓存的世界观要点（含按需检索原文）"""
+    from src.world_digest import WorldDigest
+    from src.prompt_assembler import PromptAssembler
+    from src.telemetry import estimate_tokens
+
+    world = _make_world()
+    assembler = PromptAssembler()
+    history = _make_transcript(3)[2:]
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        digest = WorldDigest.load(world, cache_dir=folder)
+        built = time.perf_counter() - start
+        start = time.perf_counter()
+        WorldDigest.load(world, cache_dir=folder)
+        cached = time.perf_counter() - start
+    print(f"  世界观 {estimate_tokens(world)} tokens -> 要点 {estimate_tokens(digest.digest)} tokens，"
+          f"首次抽取 {built * 1000:.1f}ms，读取缓存 {cached * 1000:.1f}ms")
+    actions = ["前往银月城寻找魔法师", "向守护者询问传说", "调查灰烬荒原的古老遗迹", "继续前进", "休息一下"]
+    totals = {"全文": 0, "要点 + 检索": 0}
+    lookups = 0
+    for turn in range(turns):
+        action = actions[turn % len(actions)]
+        request = {"role": "user", "content": f"我的行动：{action}"}
+        totals["全文"] += sum(estimate_tokens(m["content"]) for m in
+                            assembler.build("格式说明", world=world, history=history + [request]))
+        passages = digest.lookup(action)
+        lookups += bool(passages)
+        extra = [{"role": "system", "content": "\n".join(passages)}] if passages else []
+        totals["要点 + 检索"] += sum(estimate_tokens(m["content"]) for m in
+                                 assembler.build("格式说明", world=digest.digest, history=history + extra + [request]))
+    for label, total in totals.items():
+        print(f"  {label:<16} 每回合输入 {total // turns} tokens")
+    print(f"  {'':<16} 检索原文 {lookups}/{turns} 回合，输入减少 {1 - totals['要点 + 检索'] / totals['全文']:.0%}")
+
+
+@benchmark
+def character_prefetch(review=0.5, latency=0.2):
+    """接受世界观后等待角色的时间：接受后再生成 vs 查看世界观时后台预生成（模拟阅读 0.5s、请求 200ms），再次查看时的角色库命中，及频率限制下的预留额度"""
+    from src import character_generator
+    from src.character_generator import CharacterPrefetcher
+    from src.rate_limiter import RateLimiter
+    from src.world_library import ContentLibrary
+
+    class SlowClient(_FakeClient):
+        def _create(self, model, messages, **kwargs):
+            time.sleep(latency)
+            return super()._create(model, messages, **kwargs)
+
+    responder = lambda messages, kwargs: "姓名: 艾琳\n职业: 法师\n=====\n人物具体介绍: 雾林出身的年轻法师。"
+    with _offline_llm(responder) as llm_core, tempfile.TemporaryDirectory() as folder:
+        original_client, original_limiter = llm_core._get_client, llm_core.rate_limiter
+        original_library = character_generator.character_library
+        llm_core._get_client = lambda provider, client=SlowClient(responder): client
+        try:
+            time.sleep(review)
+            start = time.perf_counter()
+            llm_core.generate_character("魔法大陆", "一个年轻法师")
+            print(f"  {'接受后再生成':<16} 等待 {(time.perf_counter() - start) * 1000:.0f}ms")
+
+            character_generator.character_library = ContentLibrary(os.path.join(folder, "characters.jsonl"),
+                                                                   "character_generation")
+            prefetcher = CharacterPrefetcher("魔法大陆")
+            time.sleep(review)
+            start = time.perf_counter()
+            ready, pending = prefetcher.snapshot()
+            while not ready and pending:
+                prefetcher.wait(0.05)
+                ready, pending = prefetcher.snapshot()
+            print(f"  {'后台预生成':<16} 等待 {(time.perf_counter() - start) * 1000:.0f}ms，已就绪 {len(ready)} 个")
+
+            # 等待全部预生成完成后，再次查看同一世界观时直接使用角色库中的角色
+            while prefetcher.snapshot()[1]:
+                prefetcher.wait(0.05)
+            start = time.perf_counter()
+            prefetcher = CharacterPrefetcher("魔法大陆")
+            while prefetcher.snapshot()[1]:
+                prefetcher.wait(0.05)
+            print(f"  {'角色库命中':<16} 等待 {(time.perf_counter() - start) * 1000:.0f}ms，"
+                  f"已就绪 {len(prefetcher.snapshot()[0])} 个")
+
+            # 每分钟限 3 次请求、为前台预留 2 次额度：预生成只发起 1 次请求后即让出额度
+            provider = llm_core.config_manager.get_model_config('character_generation')['provider']
+            llm_core.rate_limiter = RateLimiter({provider: 3})
+            character_generator.character_library = ContentLibrary(os.path.join(folder, "limited.jsonl"),
+                                                                   "character_generation")
+            prefetcher = CharacterPrefetcher("魔法大陆")
+            time.sleep(review + latency * 2)
+            ready, pending = prefetcher.snapshot()
+            prefetcher.cancel()
+            print(f"  {'限速 3次/分钟':<16} 预生成 {len(ready)} 个，前台剩余额度 {llm_core.rate_limiter.available(provider)} 次")
+        finally:
+            llm_core._get_client, llm_core.rate_limiter = original_client, original_limiter
+            character_generator.character_library = original_library
+
+
+@benchmark
+def records(count=10000):
+    """角色与世界观记录：解析吞吐、从存档记录恢复的吞吐，及 __slots__ 记录与普通字典的内存占用"""
+    from src.records import Character, World
+
+    texts = [f"姓名: 角色{i}\n职业: 魔法师\n性别: 女\n年龄: {18 + i % 40}\n能力: 精通火系魔法\n=====\n"
+             f"人物具体介绍: 出生于雾林边境的魔法世家，性格坚毅。\n关系: 与导师关系密切。" for i in range(count)]
+    start = time.perf_counter()
+    characters = [Character.parse(text) for text in texts]
+    _report("Character.parse", count, time.perf_counter() - start)
+    saved = [character.to_dict() for character in characters]
+    start = time.perf_counter()
+    restored = [Character.from_dict(data) for data in saved]
+    _report("Character.from_dict", count, time.perf_counter() - start)
+    assert all(a.prompt_text == b.prompt_text for a, b in zip(characters, restored))
+
+    world = _make_world()
+    start = time.perf_counter()
+    record = World.parse(world)
+    parsed = time.perf_counter() - start
+    start = time.perf_counter()
+    World.from_dict(record.to_dict(), world)
+    print(f"  World.parse {parsed * 1000:.2f}ms，World.from_dict {(time.perf_counter() - start) * 1000:.2f}ms")
+
+    # 相同字段下容器本身的大小（不含字段字符串）
+    slots_size = sys.getsizeof(restored[0])
+    dict_size = sys.getsizeof({slot: getattr(restored[0], slot) for slot in Character.__slots__})
+    print(f"  每条记录容器 __slots__ {slots_size} 字节 vs 字典 {dict_size} 字节")
+
+
+@benchmark
+def content_library(count=5000, backgrounds=100, lookups=1000):
+    """内容库（5k 世界观）：写入吞吐、启动时读取索引 vs 无索引全量扫描、按背景查找与读取全文的延迟"""
+    from src.world_library import ContentLibrary
+
+    world = _make_world()
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, "worlds.jsonl")
+        library = ContentLibrary(path, "world_generation")
+        start = time.perf_counter()
+        for i in range(count):
+            library.add(f"背景{i % backgrounds}", f"世界{i}\n" + world)
+        _report("add", count, time.perf_counter() - start)
+        print(f"  {'':<28} 数据 {os.path.getsize(path) / 1024 / 1024:.1f}MB，索引 "
+              f"{os.path.getsize(library.index_path) / 1024:.0f}KB")
+
+        start = time.perf_counter()
+        library = ContentLibrary(path, "world_generation")
+        library.count("背景0")
+        indexed = time.perf_counter() - start
+        os.remove(library.index_path)
+        start = time.perf_counter()
+        rebuilt = ContentLibrary(path, "world_generation")
+        rebuilt.count("背景0")
+        print(f"  启动读取索引 {indexed * 1000:.0f}ms，无索引全量扫描并重建 {(time.perf_counter() - start) * 1000:.0f}ms")
+
+        rng = random.Random(3)
+        start = time.perf_counter()
+        for _ in range(lookups):
+            entries = library.entries(f"背景{rng.randrange(backgrounds)}", limit=9)
+        lookup = time.perf_counter() - start
+        start = time.perf_counter()
+        for _ in range(lookups):
+            library.get(entries[rng.randrange(len(entries))]["id"])
+        print(f"  按背景查找 {lookup / lookups * 1e6:.0f}µs/次，按编号读取全文 "
+              f"{(time.perf_counter() - start) / lookups * 1e6:.0f}µs/次")
+
+
+@benchmark
+def batch_generate(latency=0.05):
+    """批量生成 2背景×2世界观×3角色 的吞吐：1 个并发 vs 4 个并发（模拟请求 50ms），及中断后续跑跳过已完成条目"""
+    import io
+    import contextlib
+    from src.batch_generate import run_batch
+
+    class SlowClient(_FakeClient):
+        def _create(self, model, messages, **kwargs):
+            time.sleep(latency)
+            return super()._create(model, messages, **kwargs)
+
+    def responder(messages, kwargs):
+        if any("角色设定生成器" in msg["content"] for msg in messages):
+            return "姓名: 艾琳\n职业: 法师\n=====\n人物具体介绍: 雾林出身的年轻法师。"
+        return _make_world()
+
+    manifest = {"backgrounds": ["魔法学院", "赛博朋克"], "character_prompts": ["年轻法师", "神秘商人"],
+                "worlds_per_background": 2, "characters_per_world": 3}
+    with _offline_llm(responder) as llm_core, tempfile.TemporaryDirectory() as tmp:
+        original_client = llm_core._get_client
+        llm_core._get_client = lambda provider, client=SlowClient(responder): client
+        try:
+            for workers in (1, 4):
+                output = os.path.join(tmp, f"batch_{workers}.jsonl")
+                with contextlib.redirect_stdout(io.StringIO()):
+                    stats = run_batch(manifest, output, workers=workers)
+                print(f"  {workers} 个并发  {stats['world'] + stats['character']} 条，"
+                      f"{stats['items_per_min']:.0f} 条/分钟，错误率 {stats['error_rate']:.0%}")
+            # 模拟中断：截掉后半部分并留下一行写了一半的记录
+            with open(output, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+            with open(output, "w", encoding="utf-8") as f:
+                f.writelines(lines[:len(lines) // 2])
+                f.write(lines[-1][:20])
+            with contextlib.redirect_stdout(io.StringIO()):
+                stats = run_batch(manifest, output, workers=4)
+            print(f"  续跑  补齐 {stats['world'] + stats['character']} 条（共 {len(lines)} 条）")
+        finally:
+            llm_core._get_client = original_client
+
+
+def main(argv=None):
+    names = (argv if argv is not None else sys.argv[1:]) or list(BENCHMARKS)
+    for name in names:
+        if name not in BENCHMARKS:
+            print(f"❌ 未知的基准测试: {name}（可用: {', '.join(BENCHMARKS)}）")
+            return 1
+        func = BENCHMARKS[name]
+        print(f"⏱️  {name} - {func.__doc__}")
+        func()
+        print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,17 +1,172 @@
+import logging
+import threading
 from src.llm_core import llm_core
+from src.telemetry import telemetry
+from src.records import Character
+from src.world_digest import world_hash
+from src.world_library import character_library
 
-def generate_character(world_description):
+# 预生成角色使用的默认提示词
+DEFAULT_CHARACTER_PROMPTS = (
+    "一个符合这个世界观的普通冒险者",
+    "一个在这个世界中身怀秘密的神秘人物",
+    "一个出身于这个世界主要势力的年轻成员",
+)
+
+
+class CharacterPrefetcher:
+    """玩家查看世界观时，在后台按默认提示词逐个预生成角色候选
+
+    单个后台线程依次生成，开始每个请求前检查是否已取消；频率限制的剩余额度不多于 reserve 时等待，
+    为前台请求留出额度。取消后不再发起新请求，进行中的请求结果会被丢弃。
+    角色库中已有相同世界观与提示词的角色时直接使用，不发起请求。
+    """
+
+    def __init__(self, world_description, prompts=DEFAULT_CHARACTER_PROMPTS, reserve=2):
+        self.world_description = world_description
+        self.prompts = list(prompts)
+        self.reserve = reserve
+        self.world_hash = world_hash(world_description.strip())
+        self.ready = []  # [(提示词, Character)]
+        self.pending = len(self.prompts)
+        self._cancelled = threading.Event()
+        self._changed = threading.Condition()
+        if self.prompts:
+            threading.Thread(target=self._run, daemon=True).start()
+
+    def _run(self):
+        try:
+            provider = llm_core.config_manager.get_model_config('character_generation')['provider']
+            limit = llm_core.rate_limiter.limits.get(provider, 0)
+            # 保留额度须小于每分钟限额，否则剩余额度永远不会超过保留额度
+            reserve = min(self.reserve, limit - 1) if limit else self.reserve
+            for prompt in self.prompts:
+                if self._cancelled.is_set():
+                    break
+                try:
+                    self._prefetch(prompt, provider, reserve)
+                except Exception as e:
+                    # 单个候选失败不影响其余提示词
+                    logging.warning(f"预生成角色失败: {e}")
+                    with self._changed:
+                        self.pending -= 1
+                        self._changed.notify_all()
+        finally:
+            with self._changed:
+                self.pending = 0
+                self._changed.notify_all()
+
+    def _prefetch(self, prompt, provider, reserve):
+        """为一个提示词准备角色候选：角色库中已有时直接使用，否则在额度允许时生成"""
+        cached = character_library.entries(prompt, self.world_hash, limit=1)
+        if cached:
+            character = Character.parse(character_library.get(cached[0]["id"]))
+            with self._changed:
+                self.pending -= 1
+                self.ready.append((prompt, character))
+                self._changed.notify_all()
+            return
+        # 额度紧张时等待，期间可被取消
+        while llm_core.rate_limiter.available(provider) <= reserve:
+            if self._cancelled.wait(0.5):
+                return
+        character = Character.parse(llm_core.generate_character(self.world_description, prompt))
+        if character.is_valid():
+            character_library.add(prompt, character.text, self.world_hash)
+        with self._changed:
+            self.pending -= 1
+            # 本地校验不通过（缺少姓名）的候选直接丢弃
+            if character.is_valid() and not self._cancelled.is_set():
+                self.ready.append((prompt, character))
+                telemetry.increment("预生成角色次数")
+            self._changed.notify_all()
+
+    def snapshot(self):
+        """当前已生成的候选与仍在排队的数量"""
+        with self._changed:
+            return list(self.ready), self.pending
+
+    def wait(self, timeout=None):
+        """等待候选状态变化"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def cancel(self):
+        """取消尚未开始的预生成"""
+        self._cancelled.set()
+        with self._changed:
+            self._changed.notify_all()
+
+
+def generate_character(world_description, prefetcher=None):
 
     """
-    根据用户输入的提示词生成角色设定，并允许用户多次生成或自定义修改
+    根据用户输入的提示词生成角色设定，并允许用户多次生成或自定义修改；
+    提供预生成器时先列出后台预生成的角色候选，可直接选择或输入提示词重新生成。
+    返回解析后的 Character 记录，失败时返回None
     """
+    if prefetcher is not None:
+        character = _choose_prefetched(prefetcher)
+        if character is not False:
+            return character
     prompt = input("请输入角色提示词（如：一个来自东方的神秘法师）：")
+    return _generate_from_prompt(world_description, prompt)
+
+
+def _choose_prefetched(prefetcher):
+    """从预生成的候选中选择角色；返回角色设定，玩家输入提示词时返回其生成结果，没有候选时返回False"""
     while True:
-        character = llm_core.generate_character(world_description, prompt)
-        if character is None:
-            return None
-            
-        print(f"\n生成的角色设定：\n{character}\n")
+        ready, pending = prefetcher.snapshot()
+        if not ready and not pending:
+            prefetcher.cancel()
+            return False
+        print("\n已为你预生成的角色：")
+        for idx, (prompt, character) in enumerate(ready, 1):
+            print(f"[{idx}] {character.short}：{prompt}")
+        if pending:
+            print(f"⏳ 还有 {pending} 个角色正在后台生成...")
+        choice = input("请选择角色编号，或直接输入角色提示词生成新角色（回车刷新列表）：").strip()
+        if not choice:
+            continue
+        if choice.isdigit() and 1 <= int(choice) <= len(ready):
+            character = ready[int(choice) - 1][1]
+            print(f"\n生成的角色设定：\n{character.text}\n")
+            if input("是否接受这个角色？(1接受/2返回列表)：").strip() == "1":
+                prefetcher.cancel()
+                telemetry.increment("预生成角色命中")
+                return character
+            continue
+        prefetcher.cancel()
+        return _generate_from_prompt(prefetcher.world_description, choice)
+
+
+def _generate_from_prompt(world_description, prompt):
+    """按提示词生成角色，可多次重新生成或修改提示词；角色库中有相同世界观与提示词的角色时先展示它"""
+    context = world_hash(world_description.strip())
+    retries = 0
+    reuse = True
+    while True:
+        cached = character_library.entries(prompt, context, limit=1) if reuse else []
+        reuse = False
+        if cached:
+            character = Character.parse(character_library.get(cached[0]["id"]))
+            print("\n（角色库中有用相同提示词为这个世界观生成过的角色，选择重新生成可获得新角色）")
+            telemetry.increment("角色库复用")
+        else:
+            text = llm_core.generate_character(world_description, prompt)
+            if text is None:
+                return None
+            character = Character.parse(text)
+            if not character.is_valid() and retries < 2:
+                # 格式不符（缺少姓名）时自动重新生成，最多两次
+                retries += 1
+                telemetry.increment("角色设定格式重新生成")
+                continue
+            retries = 0
+            if character.is_valid():
+                character_library.add(prompt, character.text, context)
+
+        print(f"\n生成的角色设定：\n{character.text}\n")
         choice = input("是否接受这个角色？(1接受/2重新生成/3自定义修改)：")
         if choice == "1":
             return character
@@ -19,5 +174,6 @@ def generate_character(world_description):
             continue  # 重新生成
         elif choice == "3":
             prompt = input("请输入修改后的提示词：")
+            reuse = True
         else:
             print("无效输入，请重新选择")
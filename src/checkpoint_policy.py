@@ -0,0 +1,122 @@
+import time
+from src.llm_core import llm_core
+from src.telemetry import estimate_tokens
+from src.turn_history import extract_block
+
+
+class FixedIntervalPolicy:
+    """固定间隔策略：每 interval 轮触发一次检查点（原 summary_interval 行为）"""
+
+    name = "fixed"
+
+    def __init__(self, interval=3):
+        self.interval = max(1, interval)
+        self.turns = 0
+        self.reason = ""
+
+    def observe(self, user_input, reply):
+        """记录一个回合"""
+        self.turns += 1
+
+    def should_checkpoint(self):
+        if self.turns >= self.interval:
+            self.reason = "固定间隔"
+            return True
+        return False
+
+    def mark_checkpoint(self):
+        """检查点已触发，重新开始计数"""
+        self.turns = 0
+
+
+class AdaptivePolicy:
+    """自适应策略：按新增内容量、检测到的事件和经过时间累积分数，超过阈值时触发检查点
+
+    分数 = 新增token / token_budget + 事件数 × event_weight + 经过秒数 / time_budget，
+    未满 min_turns 轮不触发，满 max_turns 轮必定触发。
+    """
+
+    name = "adaptive"
+
+    def __init__(self, threshold=1.0, token_budget=1500, event_weight=0.25, time_budget=600,
+                 min_turns=2, max_turns=8):
+        self.threshold = threshold
+        self.token_budget = token_budget
+        self.event_weight = event_weight
+        self.time_budget = time_budget
+        self.min_turns = min_turns
+        self.max_turns = max_turns
+        # 跨检查点保留已见过的地点、物品、角色，只有首次出现才算事件
+        self.known_locations = set()
+        self.known_items = set()
+        self.known_characters = set()
+        self.last_location = None
+        self.reason = ""
+        self.mark_checkpoint()
+
+    def observe(self, user_input, reply):
+        """记录一个回合：累计新增token并检测事件"""
+        self.turns += 1
+        self.tokens += estimate_tokens(user_input) + estimate_tokens(reply)
+        self.events += self._detect_events(reply or "")
+
+    def _detect_events(self, reply):
+        """检测新地点、新物品、新角色与死亡事件"""
+        events = 0
+        location = extract_block(reply, ["地点"])
+        if location and location != self.last_location:
+            self.last_location = location
+            if location not in self.known_locations:
+                self.known_locations.add(location)
+                events += 1
+        locations, items, characters = set(), set(), set()
+        llm_core._extract_locations(reply, locations)
+        llm_core._extract_items(reply, items)
+        llm_core._extract_characters(reply, characters)
+        for found, known in ((locations, self.known_locations), (items, self.known_items),
+                             (characters, self.known_characters)):
+            new = found - known
+            known.update(new)
+            events += len(new)
+        if '死亡' in reply:
+            events += 1
+        return events
+
+    def score(self):
+        """当前累积分数"""
+        elapsed = time.monotonic() - self.started
+        return (self.tokens / self.token_budget
+                + self.events * self.event_weight
+                + elapsed / self.time_budget)
+
+    def should_checkpoint(self):
+        if self.turns >= self.max_turns:
+            self.reason = "达到最大间隔"
+            return True
+        if self.turns >= self.min_turns and self.score() >= self.threshold:
+            self.reason = "内容增长"
+            return True
+        return False
+
+    def mark_checkpoint(self):
+        """检查点已触发，清零累计量"""
+        self.turns = 0
+        self.tokens = 0
+        self.events = 0
+        self.started = time.monotonic()
+
+
+def create_policy(config):
+    """根据 config.toml 创建检查点策略；未配置 [checkpoint] 时沿用固定间隔"""
+    settings = config.get('checkpoint', {})
+    interval = config['game'].get('summary_interval', 3)
+    if settings.get('policy', 'fixed') != 'adaptive':
+        return FixedIntervalPolicy(interval)
+    return AdaptivePolicy(
+        threshold=settings.get('threshold', 1.0),
+        token_budget=settings.get('token_budget', 1500),
+        event_weight=settings.get('event_weight', 0.25),
+        time_budget=settings.get('time_budget', 600),
+        min_turns=settings.get('min_turns', 2),
+        max_turns=settings.get('max_turns', max(interval * 2, 2)),
+    )
@@ -0,0 +1,101 @@
+import re
+
+# 状态与物品栏字段名，及增量模式下模型输出的变化字段名
+STATUS_FIELD = "用户状态"
+INVENTORY_FIELD = "用户物品栏"
+DELTA_SUFFIX = "变化"
+
+_ENTRY_SPLIT = re.compile(r'[，,、；;]+')
+_DELTA_SPLIT = re.compile(r'[，,、；;]+|\s+(?=[+\-＋－])')
+# 条目末尾的数值或数量（如 生命值80、治疗药水x2），去掉后作为条目的键
+_QUANTITY_SUFFIX = re.compile(r'[\s:：×xX*]*[\d./]+\s*[%点个瓶枚把件份]?$')
+_NO_CHANGE = ("无", "无变化", "不变", "没有变化")
+
+# 增量模式追加到系统提示中的说明
+DELTA_INSTRUCTIONS = (
+    "【状态增量规则】第一轮照常输出完整的用户状态和用户物品栏；之后每一轮不要重复完整内容，"
+    f"而是把\"{STATUS_FIELD}:\"和\"{INVENTORY_FIELD}:\"两行分别替换为\"{STATUS_FIELD}{DELTA_SUFFIX}:\"和"
+    f"\"{INVENTORY_FIELD}{DELTA_SUFFIX}:\"，只列出新增（+）或移除（-）的条目，没有变化时写\"无\"。\n"
+    f"例如：{STATUS_FIELD}{DELTA_SUFFIX}: +中毒，-精神饱满，+生命值60\n"
+    f"{INVENTORY_FIELD}{DELTA_SUFFIX}: +银色钥匙，-干粮"
+)
+
+
+def _entry_key(entry):
+    """条目的键：去掉末尾数值，使 生命值80 与 生命值60 视为同一项"""
+    return _QUANTITY_SUFFIX.sub('', entry).strip() or entry
+
+
+def _split_entries(text):
+    return [entry.strip() for entry in _ENTRY_SPLIT.split(text or "") if entry.strip()]
+
+
+class GameState:
+    """本地维护的用户状态与物品栏，应用模型输出的增量并渲染为完整字段"""
+
+    def __init__(self, status=None, inventory=None):
+        self.fields = {STATUS_FIELD: list(status or []), INVENTORY_FIELD: list(inventory or [])}
+
+    @property
+    def status(self):
+        return self.fields[STATUS_FIELD]
+
+    @property
+    def inventory(self):
+        return self.fields[INVENTORY_FIELD]
+
+    def _apply_delta(self, field, text):
+        """应用一行增量：+条目 新增（同键条目原位替换），-条目 移除，无符号视为新增"""
+        entries = self.fields[field]
+        if text.strip() in _NO_CHANGE:
+            return
+        for token in _DELTA_SPLIT.split(text):
+            token = token.strip()
+            if not token:
+                continue
+            sign, name = ("-", token[1:]) if token[0] in "-－" else ("+", token.lstrip("+＋"))
+            name = name.strip()
+            if not name:
+                continue
+            key = _entry_key(name)
+            position = next((i for i, entry in enumerate(entries) if entry == name or _entry_key(entry) == key), None)
+            if sign == "-":
+                if position is not None:
+                    del entries[position]
+            elif position is not None:
+                entries[position] = name  # 同键条目原位替换，保持显示顺序
+            else:
+                entries.append(name)
+
+    def apply_reply(self, reply):
+        """根据回复更新状态并返回展开后的回复：增量行替换为合并后的完整字段，完整字段则直接覆盖本地状态"""
+        lines = []
+        for line in (reply or "").split('\n'):
+            stripped = line.strip()
+            for field in (STATUS_FIELD, INVENTORY_FIELD):
+                delta_prefix = field + DELTA_SUFFIX
+                if stripped.startswith(delta_prefix):
+                    self._apply_delta(field, stripped[len(delta_prefix):].lstrip(":："))
+                    line = f"{field}: {'，'.join(self.fields[field]) or '无'}"
+                    break
+                if stripped.startswith(f"{field}:") or stripped.startswith(f"{field}："):
+                    self.fields[field] = _split_entries(stripped[len(field) + 1:])
+                    break
+            lines.append(line)
+        return "\n".join(lines)
+
+    def restore(self, data):
+        """恢复到之前的快照（重新生成回合时撤销上一次回复的增量）"""
+        self.fields = {STATUS_FIELD: list(data.get("status", [])), INVENTORY_FIELD: list(data.get("inventory", []))}
+
+    def to_dict(self):
+        return {"status": list(self.status), "inventory": list(self.inventory)}
+
+    @classmethod
+    def from_dict(cls, data, fallback_reply=""):
+        """从存档恢复；旧存档没有本地状态时，从最近一条回复中的完整字段初始化"""
+        if data:
+            return cls(data.get("status"), data.get("inventory"))
+        state = cls()
+        state.apply_reply(fallback_reply)
+        return state
@@ -0,0 +1,51 @@
+import re
+from functools import lru_cache
+from src.telemetry import estimate_tokens
+from src.turn_history import extract_block
+
+# 仅供界面显示的提示行（音乐状态、存档完成、摘要进度等），不应发送给模型
+_UI_LINE_PATTERN = re.compile(r'^[ \t]*(?:🎵|✅|🔍|💡)[^\n]*(?:\n|$)', re.M)
+# 较早回合只保留的字段
+COMPACT_FIELDS = ("时间", "地点", "情景")
+
+
+def strip_ui_annotations(content):
+    """移除界面提示行"""
+    if not content:
+        return content
+    return _UI_LINE_PATTERN.sub('', content).rstrip()
+
+
+@lru_cache(maxsize=4096)
+def compact_reply(content):
+    """将较早回合的完整格式回复压缩为一行结构化内容（去掉状态、物品栏、选项与分隔线，结果缓存复用）"""
+    content = strip_ui_annotations(content)
+    fields = [(name, extract_block(content, [name])) for name in COMPACT_FIELDS]
+    fields = [f"{name}: {value}" for name, value in fields if value]
+    # 不符合固定格式的回复（如首轮引导语）原样保留
+    return "；".join(fields) if fields else content
+
+
+def sanitize_history(messages, verbatim_turns=1):
+    """发送给模型前净化对话历史
+
+    所有回复移除界面提示，除最近 verbatim_turns 条回复保持原文外，其余回复压缩为结构化短格式。
+    返回新列表，不修改原对话记录。
+    """
+    assistant_positions = [i for i, msg in enumerate(messages) if msg["role"] == "assistant"]
+    verbatim = set(assistant_positions[-verbatim_turns:]) if verbatim_turns > 0 else set()
+    sanitized = []
+    for i, msg in enumerate(messages):
+        if msg["role"] != "assistant":
+            sanitized.append(msg)
+        elif i in verbatim:
+            sanitized.append({"role": "assistant", "content": strip_ui_annotations(msg["content"])})
+        else:
+            sanitized.append({"role": "assistant", "content": compact_reply(msg["content"])})
+    return sanitized
+
+
+def saved_tokens(original, sanitized):
+    """估算净化节省的token数"""
+    return (sum(estimate_tokens(msg.get("content", "")) for msg in original)
+            - sum(estimate_tokens(msg.get("content", "")) for msg in sanitized))
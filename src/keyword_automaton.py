@@ -0,0 +1,78 @@
+import re
+
+
+class KeywordAutomaton:
+    """多组关键词匹配自动机（Aho-Corasick 风格）
+
+    所有关键词先构建为一棵字典树，再编译为单个带前瞻的正则状态机，匹配在C层完成，
+    一次扫描即可得到文本（或每一行）命中了哪些关键词组，结果与逐个 `keyword in text` 一致。
+    """
+
+    def __init__(self, groups):
+        """
+        :param groups: {组名: [关键词, ...]}
+        """
+        keyword_groups = {}
+        for group, keywords in groups.items():
+            for keyword in keywords:
+                keyword_groups.setdefault(keyword, set()).add(group)
+        # 每个位置只捕获最长的关键词，因此把其中包含的较短关键词的组也并入
+        self.keyword_groups = {
+            keyword: frozenset().union(*(g for other, g in keyword_groups.items() if other in keyword))
+            for keyword in keyword_groups
+        }
+        # 组名与关键词编码为位掩码，扫描时只做整数或运算
+        self._group_bits = [(1 << i, name) for i, name in enumerate(groups)]
+        bit_of = {name: bit for bit, name in self._group_bits}
+        self._keyword_masks = {
+            keyword: sum(bit_of[name] for name in names) for keyword, names in self.keyword_groups.items()
+        }
+        self._mask_cache = {}
+        trie = {}
+        for keyword in keyword_groups:
+            node = trie
+            for ch in keyword:
+                node = node.setdefault(ch, {})
+            node[""] = True
+        self.pattern = re.compile(f"(?=({self._trie_to_regex(trie)}))")
+
+    def _trie_to_regex(self, node):
+        """将字典树转换为正则表达式（公共前缀只匹配一次，可选后缀贪婪匹配以取最长关键词）"""
+        terminal = "" in node
+        branches = [re.escape(ch) + self._trie_to_regex(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if terminal:
+            return f"(?:{body})?"
+        return body
+
+    def groups_in(self, text):
+        """文本中命中的关键词组集合"""
+        mask = 0
+        for keyword in self.pattern.findall(text):
+            mask |= self._keyword_masks[keyword]
+        return self._mask_groups(mask)
+
+    def groups_by_line(self, text):
+        """一次扫描整段文本，返回按 '\\n' 分行后每一行命中的关键词组集合"""
+        masks = [0] * (text.count('\n') + 1)
+        line = 0
+        next_break = text.find('\n')
+        keyword_masks = self._keyword_masks
+        for match in self.pattern.finditer(text):
+            start = match.start()
+            # 匹配按位置递增，行号只需向前推进
+            while next_break != -1 and start > next_break:
+                line += 1
+                next_break = text.find('\n', next_break + 1)
+            masks[line] |= keyword_masks[match.group(1)]
+        return [self._mask_groups(mask) for mask in masks]
+
+    def _mask_groups(self, mask):
+        """位掩码转换为组名集合（结果缓存复用）"""
+        groups = self._mask_cache.get(mask)
+        if groups is None:
+            groups = frozenset(name for bit, name in self._group_bits if mask & bit)
+            self._mask_cache[mask] = groups
+        return groups
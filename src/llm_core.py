@@ -1,12 +1,41 @@
 import openai
 from dotenv import load_dotenv
 import os
+import re
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from src.error_handler import error_handler
 from src.config_manager import config_manager
+from src.telemetry import telemetry, estimate_tokens
+from src.keyword_automaton import KeywordAutomaton
+from src.turn_history import extract_block
+from src.prompt_assembler import prompt_assembler
+from src.rate_limiter import RateLimiter
 
 # 加载环境变量
 load_dotenv()
 
+# 摘要提取用的关键词组，导入时编译为单个匹配自动机
+_KEYWORDS = KeywordAutomaton({
+    "system": ["正在播放", "摘要生成", "存档", "加载", "音乐", "保存"],  # 系统性消息
+    "noise": ["正在播放", "摘要生成"],  # 关键内容提取时需跳过的消息
+    "result": ['发现', '获得', '遇到', '到达', '死亡', '成功', '失败'],  # 重要结果
+    "stat": ['生命', '魔法', '经验', '金币', '物品'],  # 状态变化
+    "plot": ['战斗', '对话', '探索', '解谜', '交易', '学习'],  # 情节事件
+    "scenario": ['情景', '地点', '状态', '物品', '选择'],  # 场景信息
+})
+
+# 预编译的提取正则
+_CHARACTER_PATTERN = re.compile(r'([A-Za-z\u4e00-\u9fa5]{2,4})(?=说|道|告诉|回答)')
+_LOCATION_PATTERN = re.compile(r'(?:到达|前往|来到|进入)([A-Za-z\u4e00-\u9fa5]{2,8})')
+_ITEM_PATTERN = re.compile(r'(?:获得|得到|拿到|发现)([A-Za-z\u4e00-\u9fa5]{2,8})')
+_SAVE_LOCATION_PATTERN = re.compile(r'(?:到达|前往|来到|在)([A-Za-z\u4e00-\u9fa5]{2,6})')
+_SAVE_ACTION_PATTERN = re.compile(r'(战斗|探索|对话|交易|学习|解谜|逃跑|拯救|寻找)')
+_SAVE_ITEM_PATTERN = re.compile(r'(?:获得|得到|发现)([A-Za-z\u4e00-\u9fa5]{2,6})')
+_NON_NAME_CHARS = re.compile(r'[^\u4e00-\u9fa5A-Za-z0-9]')
+_CJK_WORD_PATTERN = re.compile(r'[\u4e00-\u9fa5]{2,4}')
+
 class LLMCore:
     """统一的大模型调用核心类"""
     
@@ -14,6 +43,10 @@ class LLMCore:
         self.config_manager = config_manager
         # 初始化客户端字典，支持多个提供商
         self.clients = {}
+        # 不支持 n 参数（一次请求多个候选）的提供商，之后改为并行请求
+        self._n_unsupported = set()
+        # 各提供商每分钟请求数限制（config.toml 的 [rate_limits]），所有请求共用
+        self.rate_limiter = RateLimiter(self.config_manager.config.get('rate_limits', {}))
         self._init_clients()
     
     def _init_clients(self):
@@ -38,21 +71,27 @@ class LLMCore:
             raise ValueError(f"未初始化的提供商客户端: {provider}")
         return self.clients[provider]
     
-    def _make_request(self, messages, model_type, max_retries=3):
-        """通用的大模型请求方法"""
+    def _make_request(self, messages, model_type, max_retries=3, temperature=None):
+        """通用的大模型请求方法（temperature 为空时使用配置值）"""
         model_config = self.config_manager.get_model_config(model_type)
         client = self._get_client(model_config['provider'])
+        # 统计本次请求与最近请求可复用的前缀比例（重试不重复统计）
+        prompt_assembler.record(model_type, messages)
         
         for attempt in range(max_retries):
             try:
+                self.rate_limiter.acquire(model_config['provider'])
+                start = time.perf_counter()
                 response = client.chat.completions.create(
                     model=model_config['model_name'],
                     messages=messages,
-                    temperature=model_config['temperature'],
+                    temperature=model_config['temperature'] if temperature is None else temperature,
                     max_tokens=model_config['max_tokens'],
                     timeout=model_config['timeout']
                 )
-                return response.choices[0].message.content
+                content = response.choices[0].message.content
+                self._record_usage(model_type, messages, response, content, time.perf_counter() - start)
+                return content
             except Exception as e:
                 if attempt == max_retries - 1:
                     error_handler.handle_llm_error(e)
@@ -60,14 +99,128 @@ class LLMCore:
                 continue
         return None
     
-    def generate_world(self, background="地理、历史、文化、魔法体系"):
-        """生成世界观"""
-        messages = [
-            {"role": "system", "content": "你是一个世界构建大师，擅长生成完整的世界观设定"},
-            {"role": "user", "content": f"请生成一个包含{background}的完整世界观，使用中文输出"}
-        ]
-        return self._make_request(messages, model_type='world_generation')
-    
+    def _record_usage(self, model_type, messages, response, content, seconds):
+        """记录调用的token用量，提供商未返回usage时按文本长度估算"""
+        usage = getattr(response, "usage", None)
+        prompt_tokens = getattr(usage, "prompt_tokens", None)
+        completion_tokens = getattr(usage, "completion_tokens", None)
+        if prompt_tokens is None:
+            prompt_tokens = sum(estimate_tokens(msg.get("content", "")) for msg in messages)
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens(content)
+        telemetry.record_llm_call(model_type, prompt_tokens, completion_tokens, seconds)
+
+    def _request_candidates(self, messages, model_type, n):
+        """一次请求生成 n 个候选回复；提供商不支持 n 参数（报错或只返回一个）时改为并行请求补足"""
+        model_config = self.config_manager.get_model_config(model_type)
+        provider = model_config['provider']
+        contents = []
+        if provider not in self._n_unsupported:
+            prompt_assembler.record(model_type, messages)
+            try:
+                self.rate_limiter.acquire(provider)
+                start = time.perf_counter()
+                response = self._get_client(provider).chat.completions.create(
+                    model=model_config['model_name'],
+                    messages=messages,
+                    temperature=model_config['temperature'],
+                    max_tokens=model_config['max_tokens'],
+                    timeout=model_config['timeout'],
+                    n=n
+                )
+                contents = [choice.message.content for choice in response.choices if choice.message.content]
+                self._record_usage(model_type, messages, response, "".join(contents), time.perf_counter() - start)
+                if len(response.choices) < min(n, 2):
+                    # 请求成功但只返回一个候选：提供商忽略了 n 参数
+                    self._n_unsupported.add(provider)
+            except openai.BadRequestError as e:
+                # 明确拒绝 n 参数时不再尝试；其他错误（超时、限流、网络）下次仍使用 n 参数
+                if re.search(r"\bn\b", str(e)):
+                    self._n_unsupported.add(provider)
+                contents = []
+            except Exception:
+                contents = []
+        missing = n - len(contents)
+        if missing > 0:
+            with ThreadPoolExecutor(max_workers=missing) as pool:
+                extra = pool.map(lambda _: self._make_request(messages, model_type), range(missing))
+                contents.extend(content for content in extra if content)
+        return contents[:n]
+
+    def _stream_request(self, messages, model_type, on_delta, temperature=None):
+        """流式请求：每收到一段内容即以累计文本调用 on_delta，返回 (完整内容, 首token延迟秒数)
+
+        流式请求失败时（含提供商不支持流式）返回 (None, None)，由调用方回退为普通请求。
+        """
+        model_config = self.config_manager.get_model_config(model_type)
+        prompt_assembler.record(model_type, messages)
+        start = time.perf_counter()
+        first_token = None
+        parts = []
+        last_chunk = None
+        try:
+            self.rate_limiter.acquire(model_config['provider'])
+            stream = self._get_client(model_config['provider']).chat.completions.create(
+                model=model_config['model_name'],
+                messages=messages,
+                temperature=model_config['temperature'] if temperature is None else temperature,
+                max_tokens=model_config['max_tokens'],
+                timeout=model_config['timeout'],
+                stream=True
+            )
+            for chunk in stream:
+                last_chunk = chunk
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                parts.append(delta)
+                on_delta("".join(parts))
+        except Exception:
+            return None, None
+        content = "".join(parts)
+        if not content:
+            return None, None
+        self._record_usage(model_type, messages, last_chunk, content, time.perf_counter() - start)
+        return content, first_token
+
+    def generate_world(self, background="地理、历史、文化、魔法体系", temperature=None, on_delta=None):
+        """生成世界观
+
+        :param temperature: 并行生成多个候选时用于拉开差异
+        :param on_delta: 提供时使用流式输出，每收到一段内容即以累计文本回调，便于逐步显示
+        """
+        messages = prompt_assembler.build(
+            "你是一个世界构建大师，擅长生成完整的世界观设定",
+            request=f"请生成一个包含{background}的完整世界观，使用中文输出"
+        )
+        start = time.perf_counter()
+        result = None
+        if on_delta:
+            result, first_token = self._stream_request(messages, 'world_generation', on_delta, temperature)
+            if result:
+                telemetry.record_timing("世界观首token延迟", first_token)
+            else:
+                telemetry.increment("世界观流式输出回退")
+        if not result:
+            result = self._make_request(messages, model_type='world_generation', temperature=temperature)
+        if result:
+            telemetry.record_timing("世界观生成总耗时", time.perf_counter() - start)
+        return result
+    
+    def generate_world_digest(self, world_description, max_chars=600):
+        """将世界观压缩为每回合提示词使用的要点摘要（世界观接受后只调用一次）"""
+        messages = prompt_assembler.build(
+            f"请将用户给出的世界观压缩为不超过{max_chars}字的要点，供角色扮演时参考。"
+            "按“关键地点、主要势力、世界规则（如魔法或科技体系）、整体基调”分行列出，"
+            "保留专有名词，删去细节描写，只输出要点本身。",
+            request=world_description
+        )
+        return self._make_request(messages, model_type='smart_summary')
+
     def generate_character(self, world_description, prompt):
         """生成角色设定"""
         system_prompt = (
@@ -81,8 +234,6 @@ class LLMCore:
             "=====\n"
             "人物具体介绍:\n"
             "关系:\n"
-            "请务必让角色的设定、背景、能力等与以下世界观保持一致：\n"
-            f"{world_description}\n"
             "【示例】\n"
             "姓名: 李明\n"
             "职业: 魔法师\n"
@@ -92,45 +243,59 @@ class LLMCore:
             "=====\n"
             "人物具体介绍: 李明出生于魔法世家，性格坚毅，善于思考。\n"
             "关系: 与导师关系密切，曾与主角有过合作。\n"
-            "请严格按照上述格式输出，不要输出任何解释或多余内容。"
+            "请严格按照上述格式输出，不要输出任何解释或多余内容。\n"
+            "请务必让角色的设定、背景、能力等与以下世界观保持一致："
         )
-        messages = [
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": prompt}
-        ]
+        messages = prompt_assembler.build(system_prompt, world=world_description, request=prompt)
         return self._make_request(messages, model_type='character_generation')
     
     def generate_save_name(self, summary_text):
         """根据摘要生成存档名"""
-        messages = [
-            {"role": "system", "content": "请根据以下剧情摘要为本次存档起一个简洁有趣的中文标题（不超过10字）："},
-            {"role": "user", "content": summary_text}
-        ]
+        messages = prompt_assembler.build(
+            "请根据以下剧情摘要为本次存档起一个简洁有趣的中文标题（不超过10字）：",
+            request=summary_text
+        )
         return self._make_request(messages, model_type='save_name')
     
     def summarize_conversation(self, messages):
         """生成对话摘要"""
-        messages_content = [
-            {"role": "system", "content": "请对以下对话历史进行总结，提取剧情和用户的状态，身份和物品档："},
-            {"role": "user", "content": "\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])}
-        ]
+        messages_content = prompt_assembler.build(
+            "请对以下对话历史进行总结，提取剧情和用户的状态，身份和物品档：",
+            request="\n".join([f"{msg['role']}: {msg['content']}" for msg in messages])
+        )
         return self._make_request(messages_content, model_type='save_summary')
     
     def role_play_response(self, messages, temperature=0.7):
-        """角色扮演回复"""
+        """角色扮演回复（messages 应由 prompt_assembler.build 组装）"""
         return self._make_request(messages, model_type='role_play')
-    
+
+    def role_play_candidates(self, messages, n=1):
+        """生成 n 个角色扮演候选回复，返回非空回复列表"""
+        if n <= 1:
+            reply = self.role_play_response(messages)
+            return [reply] if reply else []
+        return self._request_candidates(messages, 'role_play', n)
+    
+    def complete_reply_sections(self, reply, sections):
+        """只补全回复中缺失的部分（如选项），比重新生成整回合便宜得多"""
+        messages = prompt_assembler.build(
+            "你是角色扮演游戏的格式助手。根据用户给出的本回合内容，只输出其中缺失的部分，不要重复已有内容，不要输出解释。\n"
+            "各部分格式：\n"
+            "用户身份：\n时间:\n地点:\n用户状态:\n用户物品栏:\n"
+            "用户接下来的选择(使用数字标记):\n1. 选项一 2. 选项二 3. 选项三",
+            request=f"本回合内容：\n{reply}\n\n缺失的部分：{'、'.join(sections)}"
+        )
+        return self._make_request(messages, model_type='role_play')
+
     def select_music_mood(self, scenario, available_moods):
         """选择音乐基调"""
         mood_options = "\n".join([f"- {name}" for name in available_moods])
-        messages = [
-            {"role": "user", "content": (
-                "请根据以下情景，从下列基调中选择一个最合适的基调，只能选择并输出下列基调名称之一：\n"
-                f"情景：{scenario}\n"
-                f"{mood_options}\n"
-                "【重要】只能输出上面列表中的一个基调名称，不能输出编号、标点、解释、换行或任何其他内容。直接输出名称本身。"
-            )}
-        ]
+        messages = prompt_assembler.build(
+            "请根据用户给出的情景，从下列基调中选择一个最合适的基调，只能选择并输出下列基调名称之一：\n"
+            f"{mood_options}\n"
+            "【重要】只能输出上面列表中的一个基调名称，不能输出编号、标点、解释、换行或任何其他内容。直接输出名称本身。",
+            request=f"情景：{scenario}"
+        )
         result = self._make_request(messages, model_type='music_mood')
         if result:
             return result.strip()
@@ -138,13 +303,10 @@ class LLMCore:
     
     def should_change_music(self, scenario, current_mood):
         """判断是否需要更换音乐"""
-        messages = [
-            {"role": "user", "content": (
-                "根据当前情景和音乐基调，判断是否需要更换音乐。只输出'是'或'否'，不要添加其他内容。\n"
-                f"情景：{scenario}\n"
-                f"当前基调：{current_mood}\n"
-            )}
-        ]
+        messages = prompt_assembler.build(
+            "根据当前情景和音乐基调，判断是否需要更换音乐。只输出'是'或'否'，不要添加其他内容。",
+            request=f"当前基调：{current_mood}\n情景：{scenario}"
+        )
         result = self._make_request(messages, model_type='music_mood')
         if result:
             return result.strip() == '是'
@@ -174,15 +336,12 @@ class LLMCore:
         if not recent_content:
             return previous_summary
         
-        # 构建增量更新提示
-        prompt = (
-            f"基于以下摘要和最新进展，更新摘要内容（控制在{max_tokens//5}字以内）：\n"
-            f"【原摘要】{previous_summary[:400]}\n"
-            f"【最新进展】{recent_content}\n"
-            "请合并信息，保持连贯性，突出重要变化："
+        # 构建增量更新提示：固定指令在前，原摘要其次，最新进展在最后
+        messages_to_send = prompt_assembler.build(
+            f"基于剧情摘要和最新进展，更新摘要内容（控制在{max_tokens//5}字以内）。请合并信息，保持连贯性，突出重要变化。",
+            summary=previous_summary,
+            request=f"【最新进展】{recent_content}"
         )
-        
-        messages_to_send = [{"role": "user", "content": prompt}]
         return self._make_request(messages_to_send, model_type='save_summary')
     
     def _generate_comprehensive_summary(self, messages, max_tokens):
@@ -193,50 +352,74 @@ class LLMCore:
         if not key_elements:
             return "暂无重要情节"
         
-        prompt = (
-            f"根据以下关键要素生成故事摘要（控制在{max_tokens//5}字以内）：\n"
-            f"{key_elements}\n"
-            "要求：1）突出主要情节线 2）保留重要角色和事件 3）语言简洁流畅"
+        messages_to_send = prompt_assembler.build(
+            f"根据用户给出的关键要素生成故事摘要（控制在{max_tokens//5}字以内）。"
+            "要求：1）突出主要情节线 2）保留重要角色和事件 3）语言简洁流畅",
+            request=key_elements
         )
-        
-        messages_to_send = [{"role": "user", "content": prompt}]
         return self._make_request(messages_to_send, model_type='save_summary')
     
     def _generate_traditional_summary(self, messages, previous_summary):
         """传统摘要生成方式（兼容性保留）"""
         if previous_summary:
             recent_content = self._extract_key_content(messages[-6:])
-            prompt = f"之前摘要：{previous_summary[:300]}\n最新进展：{recent_content}\n请更新摘要(限200字)："
+            messages_to_send = prompt_assembler.build(
+                "请根据剧情摘要和最新进展更新摘要(限200字)。",
+                summary=previous_summary[:300],
+                request=f"最新进展：{recent_content}"
+            )
         else:
             key_content = self._extract_key_content(messages)
-            prompt = f"对话内容：{key_content}\n请生成简洁摘要(限200字)："
+            messages_to_send = prompt_assembler.build("请为以下对话内容生成简洁摘要(限200字)。", request=f"对话内容：{key_content}")
         
-        messages_to_send = [{"role": "user", "content": prompt}]
         return self._make_request(messages_to_send, model_type='save_summary')
     
+    def extract_batch(self, messages):
+        """一次扫描处理一批消息，提取摘要所需的全部信息
+
+        所有消息拼接后只经过关键词自动机一次，再按行分配命中结果；
+        各字段与单独调用对应的 _extract_* 方法结果一致。
+        """
+        contents = [msg.get("content", "") for msg in messages]
+        line_groups = _KEYWORDS.groups_by_line("\n".join(contents))
+        results = []
+        position = 0
+        for msg, content in zip(messages, contents):
+            lines = content.split('\n')
+            groups = line_groups[position:position + len(lines)]
+            position += len(lines)
+            matched = set().union(*groups)
+            role = msg.get("role", "")
+            results.append({
+                "role": role,
+                "content": content,
+                "is_system": "system" in matched,
+                "is_noise": "noise" in matched,
+                "user_action": self._extract_user_action(content) if role == "user" else None,
+                "important_result": self._extract_important_result(content, lines, groups) if role == "assistant" else None,
+                "plot_event": self._extract_plot_event(content, lines, groups) if role == "assistant" else None,
+                "scenario_info": self._extract_scenario_info(content, lines, groups) if role == "assistant" else None,
+            })
+        return results
+
     def _extract_recent_key_events(self, recent_messages):
         """从最近的对话中提取关键事件"""
         key_events = []
         
-        for i, msg in enumerate(recent_messages):
-            content = msg.get("content", "")
-            role = msg.get("role", "")
-            
+        for item in self.extract_batch(recent_messages):
             # 跳过系统性消息
-            if self._is_system_message(content):
+            if item["is_system"]:
                 continue
             
             # 提取用户行动
-            if role == "user":
-                action = self._extract_user_action(content)
-                if action:
-                    key_events.append(f"玩家行动：{action}")
+            if item["role"] == "user":
+                if item["user_action"]:
+                    key_events.append(f"玩家行动：{item['user_action']}")
             
             # 提取重要结果
-            elif role == "assistant":
-                result = self._extract_important_result(content)
-                if result:
-                    key_events.append(f"结果：{result}")
+            elif item["role"] == "assistant":
+                if item["important_result"]:
+                    key_events.append(f"结果：{item['important_result']}")
         
         return " | ".join(key_events[-5:])  # 保留最近5个关键事件
     
@@ -250,11 +433,10 @@ class LLMCore:
             "relationships": []
         }
         
-        for msg in messages:
-            content = msg.get("content", "")
-            
-            if self._is_system_message(content):
+        for item in self.extract_batch(messages):
+            if item["is_system"]:
                 continue
+            content = item["content"]
             
             # 提取角色名称
             self._extract_characters(content, elements["characters"])
@@ -263,10 +445,8 @@ class LLMCore:
             self._extract_locations(content, elements["locations"])
             
             # 提取重要事件
-            if msg.get("role") == "assistant":
-                event = self._extract_plot_event(content)
-                if event:
-                    elements["events"].append(event)
+            if item["plot_event"]:
+                elements["events"].append(item["plot_event"])
             
             # 提取物品
             self._extract_items(content, elements["items"])
@@ -275,8 +455,7 @@ class LLMCore:
     
     def _is_system_message(self, content):
         """判断是否为系统性消息"""
-        system_keywords = ["正在播放", "摘要生成", "存档", "加载", "音乐", "保存"]
-        return any(keyword in content for keyword in system_keywords)
+        return "system" in _KEYWORDS.groups_in(content)
     
     def _extract_user_action(self, content):
         """提取用户行动的核心内容"""
@@ -289,63 +468,56 @@ class LLMCore:
                 return action_line.strip()
         return None
     
-    def _extract_important_result(self, content):
+    def _extract_important_result(self, content, lines=None, line_groups=None):
         """从AI回复中提取重要结果"""
-        lines = content.split('\n')
+        if lines is None:
+            lines = content.split('\n')
+            line_groups = _KEYWORDS.groups_by_line(content)
         important_info = []
         
-        for line in lines:
+        for line, groups in zip(lines, line_groups):
             line = line.strip()
             if not line or line.startswith('='):
                 continue
             
             # 关键信息标识
-            if any(keyword in line for keyword in ['发现', '获得', '遇到', '到达', '死亡', '成功', '失败']):
+            if "result" in groups:
                 if len(line) <= 100:  # 避免过长描述
                     important_info.append(line)
             
             # 状态变化
-            elif '：' in line and any(keyword in line for keyword in ['生命', '魔法', '经验', '金币', '物品']):
+            elif '：' in line and "stat" in groups:
                 important_info.append(line)
         
         return ' '.join(important_info[:2])  # 最多保留2条重要信息
     
     def _extract_characters(self, content, characters_set):
         """提取角色名称"""
-        # 简单的角色名提取逻辑（可根据需要改进）
-        import re
         # 匹配中文姓名模式
-        names = re.findall(r'([A-Za-z\u4e00-\u9fa5]{2,4})(?=说|道|告诉|回答)', content)
-        for name in names:
+        for name in _CHARACTER_PATTERN.findall(content):
             if len(name) >= 2:
                 characters_set.add(name)
     
     def _extract_locations(self, content, locations_set):
         """提取地点信息"""
-        import re
-        # 匹配地点模式
-        locations = re.findall(r'(?:到达|前往|来到|进入)([A-Za-z\u4e00-\u9fa5]{2,8})', content)
-        for location in locations:
-            locations_set.add(location)
+        locations_set.update(_LOCATION_PATTERN.findall(content))
     
-    def _extract_plot_event(self, content):
+    def _extract_plot_event(self, content, lines=None, line_groups=None):
         """提取情节事件"""
-        lines = content.split('\n')
-        for line in lines:
-            line = line.strip()
+        if lines is None:
+            lines = content.split('\n')
+            line_groups = _KEYWORDS.groups_by_line(content)
+        for line, groups in zip(lines, line_groups):
             # 寻找包含动作动词的重要事件
-            if any(verb in line for verb in ['战斗', '对话', '探索', '解谜', '交易', '学习']):
+            if "plot" in groups:
+                line = line.strip()
                 if 20 <= len(line) <= 80:  # 合适长度的事件描述
                     return line
         return None
     
     def _extract_items(self, content, items_set):
         """提取物品信息"""
-        import re
-        # 匹配物品模式
-        items = re.findall(r'(?:获得|得到|拿到|发现)([A-Za-z\u4e00-\u9fa5]{2,8})', content)
-        for item in items:
-            items_set.add(item)
+        items_set.update(_ITEM_PATTERN.findall(content))
     
     def _format_story_elements(self, elements):
         """格式化故事要素为摘要用的文本"""
@@ -372,35 +544,35 @@ class LLMCore:
     def _extract_key_content(self, messages):
         """提取对话的关键内容，移除冗余信息"""
         key_parts = []
-        for msg in messages:
-            content = msg.get("content", "")
-            
+        for item in self.extract_batch(messages):
             # 移除系统性信息
-            if "正在播放" in content or "摘要生成" in content:
+            if item["is_noise"]:
                 continue
+            content = item["content"]
             
             # 提取核心动作和结果
-            if msg.get("role") == "user" and content.startswith("我的行动："):
+            if item["role"] == "user" and content.startswith("我的行动："):
                 action = content[5:].strip()
                 key_parts.append(f"行动：{action}")
-            elif msg.get("role") == "assistant":
+            elif item["role"] == "assistant":
                 # 提取关键场景信息
-                scenario = self._extract_scenario_info(content)
-                if scenario:
-                    key_parts.append(f"结果：{scenario}")
+                if item["scenario_info"]:
+                    key_parts.append(f"结果：{item['scenario_info']}")
         
         return " | ".join(key_parts[-8:])  # 只保留最近8个关键点
     
-    def _extract_scenario_info(self, content):
+    def _extract_scenario_info(self, content, lines=None, line_groups=None):
         """从AI回复中提取关键场景信息"""
-        lines = content.split('\n')
+        if lines is None:
+            lines = content.split('\n')
+            line_groups = _KEYWORDS.groups_by_line(content)
         important_lines = []
         
-        for line in lines:
+        for line, groups in zip(lines, line_groups):
             line = line.strip()
             if line and not line.startswith('=') and '：' in line:
                 # 保留包含关键信息的行
-                if any(keyword in line for keyword in ['情景', '地点', '状态', '物品', '选择']):
+                if "scenario" in groups:
                     important_lines.append(line)
         
         return ' '.join(important_lines[:3])  # 最多保留3行关键信息
@@ -412,13 +584,11 @@ class LLMCore:
         
         # 构建优化的提示
         if context_info:
-            prompt = f"基于以下信息生成4-6字的存档标题：\n摘要：{summary[:80]}\n背景：{context_info[:50]}\n关键词：{key_points}"
+            prompt = f"摘要：{summary[:80]}\n背景：{context_info[:50]}\n关键词：{key_points}"
         else:
-            prompt = f"为以下内容生成4-6字的精炼标题：\n{summary[:100]}\n关键词：{key_points}"
+            prompt = f"{summary[:100]}\n关键词：{key_points}"
         
-        messages = [
-            {"role": "user", "content": prompt}
-        ]
+        messages = prompt_assembler.build("请根据用户给出的信息生成4-6字的精炼存档标题，只输出标题。", request=prompt)
         
         result = self._make_request(messages, model_type='save_name')
         
@@ -431,34 +601,24 @@ class LLMCore:
     
     def _extract_save_name_keywords(self, summary):
         """从摘要中提取用于生成存档名的关键词"""
-        import re
-        
         # 提取重要名词和动词
         keywords = []
         
         # 地点关键词
-        location_pattern = r'(?:到达|前往|来到|在)([A-Za-z\u4e00-\u9fa5]{2,6})'
-        locations = re.findall(location_pattern, summary)
-        keywords.extend(locations[:2])
+        keywords.extend(_SAVE_LOCATION_PATTERN.findall(summary)[:2])
         
         # 行动关键词
-        action_pattern = r'(战斗|探索|对话|交易|学习|解谜|逃跑|拯救|寻找)'
-        actions = re.findall(action_pattern, summary)
-        keywords.extend(actions[:2])
+        keywords.extend(_SAVE_ACTION_PATTERN.findall(summary)[:2])
         
         # 物品关键词
-        item_pattern = r'(?:获得|得到|发现)([A-Za-z\u4e00-\u9fa5]{2,6})'
-        items = re.findall(item_pattern, summary)
-        keywords.extend(items[:1])
+        keywords.extend(_SAVE_ITEM_PATTERN.findall(summary)[:1])
         
         return ' '.join(keywords[:4]) if keywords else "冒险"
     
     def _clean_save_name(self, name):
         """清理存档名，移除不合适的字符"""
-        import re
-        
         # 移除标点符号和特殊字符
-        cleaned = re.sub(r'[^\u4e00-\u9fa5A-Za-z0-9]', '', name)
+        cleaned = _NON_NAME_CHARS.sub('', name)
         
         # 确保长度合适
         if 2 <= len(cleaned) <= 8:
@@ -470,11 +630,10 @@ class LLMCore:
     
     def _generate_fallback_name(self, summary):
         """生成备用存档名"""
-        import re
         from datetime import datetime
         
         # 尝试从摘要中提取第一个有意义的词
-        words = re.findall(r'[\u4e00-\u9fa5]{2,4}', summary)
+        words = _CJK_WORD_PATTERN.findall(summary)
         if words:
             return words[0][:4]
         
@@ -482,6 +641,148 @@ class LLMCore:
         now = datetime.now()
         return f"存档{now.strftime('%m%d')}"
     
+    def generate_checkpoint(self, messages, previous_summary="", session_context="", context_info=""):
+        """一次结构化调用同时生成本次检查点的摘要、存档标题和提取的状态
+
+        :param messages: 上次检查点之后的新对话
+        :param previous_summary: 之前的剧情摘要，仅作为背景，返回的摘要只概括新对话中的事件
+        :return: {"summary", "save_name", "state"}，模型不可用或输出无法解析时返回None
+        """
+        if previous_summary:
+            story_part = f"【新增事件】{self._extract_recent_key_events(messages)}"
+        else:
+            story_part = f"【故事要素】\n{self._extract_story_elements(messages)}"
+        latest_reply = next((msg.get("content", "") for msg in reversed(messages) if msg.get("role") == "assistant"), "")
+
+        # 固定的格式说明与会话背景在前，当前摘要其次，本次新增内容在最后
+        instructions = (
+            "作为故事摘要专家，请根据用户给出的最新信息生成冒险存档，只输出一个JSON对象，不要输出任何其他内容。\n"
+            "剧情摘要仅作为背景，summary 只概括本次新增的事件，不要复述剧情摘要中已有的内容。\n"
+            "JSON格式：\n"
+            '{"summary": "200字以内的新增剧情摘要，保留关键角色、地点、物品", '
+            '"save_name": "4-6字的存档标题", '
+            '"state": {"location": "当前地点", "status": "用户状态", "inventory": "用户物品栏", "characters": ["重要角色"]}}\n'
+            f"【会话背景】{session_context}"
+        )
+        request = (
+            f"{story_part}\n"
+            f"【最新场景】{self._extract_scenario_info(latest_reply)}\n"
+            f"【存档信息】{context_info}"
+        )
+        messages_to_send = prompt_assembler.build(instructions, summary=previous_summary, request=request)
+        result = self._make_request(messages_to_send, model_type='smart_summary')
+        return self._parse_checkpoint_response(result)
+
+    def _parse_checkpoint_response(self, text, max_summary_chars=600):
+        """本地校验结构化存档结果，修正可恢复的问题"""
+        if not text:
+            return None
+        start, end = text.find("{"), text.rfind("}")
+        if start == -1 or end <= start:
+            return None
+        try:
+            data = json.loads(text[start:end + 1])
+        except ValueError:
+            return None
+        if not isinstance(data, dict):
+            return None
+
+        summary = data.get("summary")
+        if not isinstance(summary, str) or not summary.strip():
+            return None
+        summary = summary.strip()[:max_summary_chars]
+
+        raw_name = data.get("save_name")
+        save_name = self._clean_save_name(raw_name) if isinstance(raw_name, str) else None
+
+        raw_state = data.get("state") if isinstance(data.get("state"), dict) else {}
+        state = {key: str(raw_state.get(key) or "") for key in ("location", "status", "inventory")}
+        characters = raw_state.get("characters")
+        state["characters"] = [str(c) for c in characters][:10] if isinstance(characters, list) else []
+
+        return {
+            "summary": summary,
+            "save_name": save_name or self._generate_fallback_name(summary),
+            "state": state,
+        }
+
+    def generate_extractive_summary(self, messages, max_chars=300):
+        """本地抽取式摘要：不调用模型，由现有提取器拼出有长度上限的摘要（毫秒级）"""
+        recent = messages[-20:]
+        latest_reply = next((msg.get("content", "") for msg in reversed(recent) if msg.get("role") == "assistant"), "")
+        parts = []
+        location = extract_block(latest_reply, ["地点"])
+        scene = extract_block(latest_reply, ["情景"])
+        if location:
+            parts.append(f"地点：{location}")
+        if scene:
+            parts.append(f"情景：{scene}")
+        elements = {"characters": set(), "locations": set(), "events": [], "items": set()}
+        actions = []
+        for item in self.extract_batch(recent):
+            if item["is_system"]:
+                continue
+            if item["user_action"]:
+                actions.append(item["user_action"])
+            self._extract_characters(item["content"], elements["characters"])
+            self._extract_locations(item["content"], elements["locations"])
+            self._extract_items(item["content"], elements["items"])
+        if actions:
+            parts.append(f"经过：{' → '.join(actions[-3:])}")
+        formatted = self._format_story_elements(elements)
+        if formatted:
+            parts.append(formatted.replace('\n', '；'))
+        summary = "；".join(parts)
+        return summary if len(summary) <= max_chars else summary[:max_chars - 1] + "…"
+
+    def generate_extractive_checkpoint(self, messages, max_chars=300):
+        """本地生成与 generate_checkpoint 结构相同的存档结果（摘要、存档标题、状态）"""
+        summary = self.generate_extractive_summary(messages, max_chars)
+        if not summary:
+            return None
+        latest_reply = next((msg.get("content", "") for msg in reversed(messages) if msg.get("role") == "assistant"), "")
+        characters = set()
+        self._extract_characters(latest_reply, characters)
+        keywords = self._extract_save_name_keywords(summary).replace(' ', '')
+        return {
+            "summary": summary,
+            "save_name": self._clean_save_name(keywords) or self._generate_fallback_name(summary),
+            "state": {
+                "location": extract_block(latest_reply, ["地点"]),
+                "status": extract_block(latest_reply, ["用户状态"]),
+                "inventory": extract_block(latest_reply, ["用户物品栏"]),
+                "characters": sorted(characters)[:10],
+            },
+        }
+
+    def merge_summaries(self, summaries, max_tokens, level="章节"):
+        """将多段按时间排列的摘要合并为一段更高层级的摘要"""
+        numbered = "\n".join(f"{i}. {text}" for i, text in enumerate(summaries, 1))
+        messages_to_send = prompt_assembler.build(
+            f"请将用户给出的按时间顺序排列的剧情摘要合并为一段{level}摘要（控制在{max_tokens}字以内）。"
+            "要求：保留主线因果、重要角色、地点、物品与承诺，删去细枝末节，只输出摘要本身。",
+            request=numbered
+        )
+        return self._make_request(messages_to_send, model_type='smart_summary')
+
+    def generate_leaf_summary(self, messages, previous_summary="", session_context=""):
+        """只概括上次检查点之后的新对话，之前的剧情摘要仅作为背景（用于摘要树的叶子）"""
+        if previous_summary:
+            events = f"【新增事件】{self._extract_recent_key_events(messages)}"
+        else:
+            events = f"【故事要素】\n{self._extract_story_elements(messages)}"
+        instructions = (
+            "作为故事摘要专家，请概括用户给出的本阶段新增剧情。\n"
+            "要求：\n"
+            "1. 只写本阶段发生的事件，剧情摘要仅作为背景，不要复述其中已有的内容\n"
+            "2. 突出重要变化和进展\n"
+            "3. 控制在200字以内\n"
+            "4. 保留关键角色、地点、物品信息\n"
+            f"【会话背景】{session_context}"
+        )
+        messages_to_send = prompt_assembler.build(instructions, summary=previous_summary, request=events)
+        return self._make_request(messages_to_send, model_type='smart_summary')
+
     def generate_enhanced_summary(self, messages, previous_summary="", session_context=""):
         """使用专门的智能摘要模型生成高质量摘要"""
         try:
@@ -501,37 +802,32 @@ class LLMCore:
         """使用智能摘要模型生成增量摘要"""
         recent_events = self._extract_recent_key_events(messages[-8:])
         
-        prompt = (
-            f"作为故事摘要专家，请更新以下摘要：\n"
-            f"【会话背景】{session_context}\n"
-            f"【当前摘要】{previous_summary[:400]}\n"
-            f"【新增事件】{recent_events}\n\n"
-            f"要求：\n"
-            f"1. 保持故事连贯性\n"
-            f"2. 突出重要变化和进展\n"
-            f"3. 控制在300字以内\n"
-            f"4. 保留关键角色、地点、物品信息"
+        instructions = (
+            "作为故事摘要专家，请根据新增事件更新剧情摘要。\n"
+            "要求：\n"
+            "1. 保持故事连贯性\n"
+            "2. 突出重要变化和进展\n"
+            "3. 控制在300字以内\n"
+            "4. 保留关键角色、地点、物品信息\n"
+            f"【会话背景】{session_context}"
         )
-        
-        messages_to_send = [{"role": "user", "content": prompt}]
+        messages_to_send = prompt_assembler.build(instructions, summary=previous_summary, request=f"【新增事件】{recent_events}")
         return self._make_request(messages_to_send, model_type='smart_summary')
     
     def _generate_comprehensive_summary_enhanced(self, messages, session_context):
         """使用智能摘要模型生成全面摘要"""
         story_elements = self._extract_story_elements(messages)
         
-        prompt = (
-            f"作为故事摘要专家，请为以下冒险生成摘要：\n"
-            f"【背景设定】{session_context}\n"
-            f"【故事要素】\n{story_elements}\n\n"
-            f"要求：\n"
-            f"1. 构建完整的故事脉络\n"
-            f"2. 突出主要情节和角色发展\n"
-            f"3. 控制在400字以内\n"
-            f"4. 语言生动，具有故事性"
+        instructions = (
+            "作为故事摘要专家，请根据故事要素为这段冒险生成摘要。\n"
+            "要求：\n"
+            "1. 构建完整的故事脉络\n"
+            "2. 突出主要情节和角色发展\n"
+            "3. 控制在400字以内\n"
+            "4. 语言生动，具有故事性\n"
+            f"【背景设定】{session_context}"
         )
-        
-        messages_to_send = [{"role": "user", "content": prompt}]
+        messages_to_send = prompt_assembler.build(instructions, request=f"【故事要素】\n{story_elements}")
         return self._make_request(messages_to_send, model_type='smart_summary')
 
 # 创建全局LLM实例
@@ -1,8 +1,12 @@
 import json
 import os
 import toml
+import time
 from src.summary import save_manager
 from src.error_handler import error_handler
+from src.turn_history import TurnHistory, list_branches, HISTORY_DIR
+from src.records import Character, World
+from src.game_state import GameState
 
 class SaveLoader:
     """智能存档加载器"""
@@ -68,8 +72,16 @@ class SaveLoader:
             print(f"[{idx+1:2d}] 📄 {save['filename']}")
             print(f"     📅 {self._format_time(save['last_updated'])}")
             print(f"     📖 {save['summary_preview']}")
+            if save.get("world_title") or save.get("character"):
+                character = Character.from_dict(save["character"]).short if save.get("character") else "未设定"
+                print(f"     🌍 {save.get('world_title') or '未知世界'}  👤 {character}")
             print()
         
+        if self.save_manager.corrupted_saves:
+            print(f"⚠️  有 {len(self.save_manager.corrupted_saves)} 个存档文件无法读取，"
+                  "可运行 python -m src.save_tool maintain 进行修复和隔离")
+            print()
+
         print("[0] ❌ 取消")
         print("命令: r/refresh (刷新列表)")
         print("="*60)
@@ -94,7 +106,7 @@ class SaveLoader:
         print(f"📖 摘要预览: {save_info['summary_preview']}")
         
         while True:
-            action = input("\n请选择操作 [1-载入 / 2-删除 / 0-返回]: ").strip()
+            action = input("\n请选择操作 [1-载入 / 2-删除 / 3-回合与分支 / 0-返回]: ").strip()
             
             if action == "0":
                 os.system('cls')
@@ -105,9 +117,12 @@ class SaveLoader:
             
             elif action == "2":
                 return self._delete_save(save_name, save_info)
+
+            elif action == "3":
+                return self._branch_save(save_name)
             
             else:
-                print("❌ 无效操作，请输入 1、2 或 0")
+                print("❌ 无效操作，请输入 1、2、3 或 0")
     
     def _load_save(self, save_name):
         """加载存档"""
@@ -122,9 +137,12 @@ class SaveLoader:
                 return "continue", None, None, None, None
             
             world_desc, summary, _, last_conv, role = result
+            data = self.save_manager.read_save(save_name)
+            world = World.from_dict(data.get("world_record"), world_desc)
+            character = Character.from_dict(data.get("character"), role)
             print("✅ 存档加载成功!")
-            print(f"🌍 世界观: {world_desc[:100]}{'...' if len(world_desc) > 100 else ''}")
-            print(f"👤 角色: {role[:50] if role else '未设定'}{'...' if role and len(role) > 50 else ''}")
+            print(f"🌍 世界观: {world.preview}")
+            print(f"👤 角色: {character.summary if character.text else '未设定'}")
             print(f"📜 剧情: {summary[:100]}{'...' if len(summary) > 100 else ''}")
             
             input("\n按回车键开始游戏...")
@@ -139,6 +157,93 @@ class SaveLoader:
             os.system('cls')
             return "continue", None, None, None, None
     
+    def _branch_save(self, save_name):
+        """列出存档的回合节点与分支，并从指定回合分出新的分支存档"""
+        data = self.save_manager.read_save(save_name)
+        history_id = data.get("history_id")
+        if not history_id or not os.path.exists(os.path.join(HISTORY_DIR, f"{history_id}.jsonl")):
+            print("❌ 该存档没有回合历史（旧版存档或尚未进行回合）")
+            input("按回车键继续...")
+            os.system('cls')
+            return "continue", None, None, None, None
+
+        history = TurnHistory(history_id)
+        saved_turn = data.get("history_turn")
+
+        print("\n" + "="*60)
+        print("🌿 分支信息")
+        print("="*60)
+        if history.parent:
+            print(f"↖️  本分支分自 {history.parent} 的第{history.fork_turn}回合")
+        children = [b for b in list_branches() if b.get("parent") == history_id]
+        for branch in children:
+            print(f"↘️  分支 {branch.get('id')}：自第{branch.get('fork_turn')}回合分出")
+        if not history.parent and not children:
+            print("（暂无其他分支）")
+
+        print("\n🕰️  回合节点")
+        # 同一回合被重新生成时只显示最新版本
+        turns = dict(history.list_turns())
+        for turn, label in turns.items():
+            marker = " ← 当前存档" if turn == saved_turn else ""
+            print(f"  [{turn:3d}] {label or '开局'}{marker}")
+
+        choice = input("\n输入回合号从该回合分出新分支存档（回车返回）: ").strip()
+        if not choice:
+            os.system('cls')
+            return "continue", None, None, None, None
+        try:
+            turn = int(choice)
+            if turn not in turns:
+                raise ValueError
+        except ValueError:
+            print("❌ 无效的回合号")
+            input("按回车键继续...")
+            os.system('cls')
+            return "continue", None, None, None, None
+
+        branch_name = self._fork_save(save_name, data, history, turn)
+        if not branch_name:
+            print("❌ 创建分支存档失败")
+            input("按回车键继续...")
+            os.system('cls')
+            return "continue", None, None, None, None
+
+        print(f"✅ 已创建分支存档: {branch_name}")
+        return self._load_save(branch_name)
+
+    def _fork_save(self, save_name, data, history, turn):
+        """从历史的指定回合分出新分支并写入分支存档，返回分支存档名
+
+        游戏状态与摘要树恢复为该回合时的样子，角色与世界观记录沿用原存档，读档后与原存档在该回合时一致。
+        """
+        branch = history.fork(turn)
+        state = branch.reconstruct(turn)
+        # 对话中保存的是展开后的完整回复，依次应用即得到该回合的本地游戏状态
+        game_state = GameState()
+        for msg in state["messages"]:
+            if msg["role"] == "assistant":
+                game_state.apply_reply(msg["content"])
+        extra = {"history_id": branch.history_id, "history_turn": turn, "game_state": game_state.to_dict()}
+        if state.get("tree") is not None:
+            # 旧版历史没有记录摘要树，读档时以该回合的摘要作为第一个叶子
+            extra["summary_tree"] = state["tree"]
+        for key in ("character", "world_record"):
+            if data.get(key):
+                extra[key] = data[key]
+
+        world = data.get("world", data.get("world_description", ""))
+        base_name = save_name.rsplit("_", 1)[0] if "_" in save_name else save_name
+        _, branch_name = self.save_manager.save_game_state(
+            messages=state["messages"],
+            world_description=world,
+            save_name=f"{base_name}_分支T{turn}_{int(time.time())}",
+            role=data.get("role"),
+            summary=state["summary"] or data.get("summary", data.get("latest_summary", "")) or "（分支存档）",
+            extra=extra
+        )
+        return branch_name
+
     def _delete_save(self, save_name, save_info):
         """删除存档"""
         print(f"\n⚠️  危险操作：删除存档")
@@ -0,0 +1,74 @@
+import queue
+import logging
+import threading
+from src.llm_core import llm_core
+
+
+class MusicDirector:
+    """在后台线程中根据回合内容选择音乐基调并切换播放，不阻塞回复显示
+
+    第零回合选择基调并开始播放，之后每三回合判断是否需要更换。
+    任务按提交顺序在单个工作线程中执行，结果以状态信息的形式放入队列，由界面在状态区显示，
+    不写入回复内容。
+    """
+
+    def __init__(self, player, max_retries=3):
+        self.player = player
+        self.library = player.library  # 与播放器共用音乐库索引
+        self.max_retries = max_retries
+        self.mood = None  # 当前音乐基调
+        self._tasks = queue.Queue()
+        self._statuses = queue.Queue()
+        self._worker = None
+
+    def submit(self, reply, turn_count):
+        """提交一个回合的音乐评估任务，立即返回"""
+        if turn_count != 0 and turn_count % 3 != 0:
+            return
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, daemon=True)
+            self._worker.start()
+        self._tasks.put((reply, turn_count))
+
+    def poll_status(self):
+        """取出最新的音乐状态信息（没有新状态时返回None）"""
+        status = None
+        while not self._statuses.empty():
+            status = self._statuses.get()
+        return status
+
+    def _run(self):
+        while True:
+            reply, turn_count = self._tasks.get()
+            try:
+                self._evaluate(reply, turn_count)
+            except Exception as e:
+                # 音乐失败不影响游戏
+                logging.warning(f"音乐评估失败: {e}")
+            finally:
+                self._tasks.task_done()
+
+    def _select_mood(self, reply, available_moods):
+        """请求模型选择基调，输出不在可选列表中时静默重试"""
+        mood = llm_core.select_music_mood(reply, available_moods)
+        retry_count = 0
+        while mood not in available_moods and retry_count < self.max_retries:
+            mood = llm_core.select_music_mood(reply, available_moods)
+            retry_count += 1
+        return mood if mood in available_moods else None
+
+    def _evaluate(self, reply, turn_count):
+        if turn_count != 0 and not llm_core.should_change_music(reply, self.mood):
+            return
+        available_moods = self.library.moods()
+        if not available_moods:
+            return
+        new_mood = self._select_mood(reply, available_moods)
+        if not new_mood:
+            return
+        self.mood = new_mood
+        self.player.play_music_by_mood(new_mood)
+        if turn_count == 0:
+            self._statuses.put(f"{new_mood}基调音乐已开始播放")
+        else:
+            self._statuses.put(f"音乐已切换至{new_mood}基调")
@@ -0,0 +1,275 @@
+import os
+import json
+import time
+import random
+import logging
+import threading
+
+# 音乐文件夹路径：每个子文件夹为一种基调
+MUSIC_FOLDER = "game_music"
+# 音乐索引缓存（记录每个文件的大小、修改时间与解析结果，启动时只重新解析变化过的文件）；
+# 放在存档目录的子目录中，不会出现在存档列表里
+INDEX_PATH = "data/library/music_index.json"
+
+# MPEG Layer III 比特率（kbps）与采样率，按版本区分：MPEG1 / MPEG2、2.5
+_MP3_BITRATES = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_MP3_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+class Track:
+    """音乐文件记录：所属基调、格式、大小、时长；无法播放的文件 error 不为空"""
+
+    __slots__ = ("path", "mood", "name", "format", "size", "mtime", "duration", "error")
+
+    def __init__(self, path, mood, size, mtime, duration=None, error=None):
+        self.path = path
+        self.mood = mood
+        self.name = os.path.basename(path)
+        self.format = os.path.splitext(path)[1].lower().lstrip(".")
+        self.size = size
+        self.mtime = mtime
+        self.duration = duration
+        self.error = error
+
+    @property
+    def playable(self):
+        return self.error is None
+
+
+def _probe_mp3(f, size):
+    """跳过 ID3 标签找到第一个 Layer III 帧，按 Xing/Info 帧数（VBR）或比特率（CBR）计算时长"""
+    head = f.read(10)
+    start = 0
+    if head[:3] == b"ID3" and len(head) == 10:
+        start = 10 + ((head[6] & 0x7f) << 21 | (head[7] & 0x7f) << 14 | (head[8] & 0x7f) << 7 | head[9] & 0x7f)
+    f.seek(start)
+    data = f.read(65536)
+    for i in range(len(data) - 4):
+        if data[i] != 0xFF or data[i + 1] & 0xE6 != 0xE2:  # 帧同步且为 Layer III
+            continue
+        version = (data[i + 1] >> 3) & 3
+        bitrate_index, rate_index = data[i + 2] >> 4, (data[i + 2] >> 2) & 3
+        if version == 1 or bitrate_index in (0, 15) or rate_index == 3:
+            continue
+        bitrate = _MP3_BITRATES[1 if version == 3 else 2][bitrate_index]
+        sample_rate = _MP3_SAMPLE_RATES[version][rate_index]
+        samples = 1152 if version == 3 else 576
+        # 下一帧也应以帧同步开头，排除数据中偶然出现的同步字节
+        following = i + (144 if version == 3 else 72) * bitrate * 1000 // sample_rate + ((data[i + 2] >> 1) & 1)
+        if following + 1 < len(data) and (data[following] != 0xFF or data[following + 1] & 0xE6 != 0xE2):
+            continue
+        mono = (data[i + 3] >> 6) == 3
+        side_info = (17 if mono else 32) if version == 3 else (9 if mono else 17)
+        xing = i + 4 + side_info
+        if data[xing:xing + 4] in (b"Xing", b"Info") and len(data) >= xing + 12 and data[xing + 7] & 1:
+            frames = int.from_bytes(data[xing + 8:xing + 12], "big")
+            return frames * samples / sample_rate
+        return (size - start - i) * 8 / (bitrate * 1000)
+    raise ValueError("未找到MP3音频帧")
+
+
+def _probe_wav(f, size):
+    """读取 RIFF 块：fmt 中的每秒字节数与 data 块大小"""
+    head = f.read(12)
+    if head[:4] != b"RIFF" or head[8:12] != b"WAVE":
+        raise ValueError("不是有效的WAV文件")
+    byte_rate = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise ValueError("WAV文件缺少音频数据")
+        chunk_id, chunk_size = chunk[:4], int.from_bytes(chunk[4:], "little")
+        if chunk_id == b"fmt ":
+            fmt = f.read(chunk_size)
+            byte_rate = int.from_bytes(fmt[8:12], "little")
+            continue
+        if chunk_id == b"data":
+            if not byte_rate:
+                raise ValueError("WAV文件缺少格式信息")
+            return min(chunk_size, size - f.tell()) / byte_rate
+        f.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+
+
+def _probe_ogg(f, size):
+    """读取首页的 Vorbis/Opus 头得到采样率，最后一页的 granule position 即总采样数"""
+    head = f.read(4096)
+    if head[:4] != b"OggS":
+        raise ValueError("不是有效的OGG文件")
+    packet = 27 + head[26]
+    if head[packet:packet + 7] == b"\x01vorbis":
+        sample_rate, pre_skip = int.from_bytes(head[packet + 12:packet + 16], "little"), 0
+    elif head[packet:packet + 8] == b"OpusHead":
+        sample_rate, pre_skip = 48000, int.from_bytes(head[packet + 10:packet + 12], "little")
+    else:
+        raise ValueError("不支持的OGG编码")
+    f.seek(max(0, size - 65536))
+    tail = f.read()
+    last = tail.rfind(b"OggS")
+    if last < 0 or not sample_rate:
+        raise ValueError("OGG文件不完整")
+    granule = int.from_bytes(tail[last + 6:last + 14], "little")
+    return max(0, granule - pre_skip) / sample_rate
+
+
+# 支持的格式及其文件头解析函数
+_PROBES = {"mp3": _probe_mp3, "wav": _probe_wav, "ogg": _probe_ogg}
+
+
+def probe(track):
+    """解析文件头得到时长；格式不支持或文件损坏时记录原因"""
+    if track.format not in _PROBES:
+        track.error = "不支持的格式"
+    elif track.size == 0:
+        track.error = "文件为空"
+    else:
+        try:
+            with open(track.path, "rb") as f:
+                track.duration = _PROBES[track.format](f, track.size)
+        except (OSError, ValueError, IndexError) as e:
+            track.error = str(e) or "无法解析"
+    return track
+
+
+class MusicLibrary:
+    """音乐库索引：启动时扫描一次音乐文件夹（基调、文件、格式、时长、大小），并标记无法播放的文件
+
+    之后只在根目录或基调文件夹的修改时间变化时重新扫描对应文件夹，且最多每 check_interval 秒检查一次，
+    回合中选择基调和播放音乐不再访问文件系统。解析结果按文件大小与修改时间缓存到 INDEX_PATH。
+    """
+
+    def __init__(self, folder=MUSIC_FOLDER, index_path=INDEX_PATH, check_interval=5.0):
+        self.folder = folder
+        self.index_path = index_path
+        self.check_interval = check_interval
+        self._folders = {}  # 基调 -> (文件夹修改时间, [Track])
+        self._root_mtime = None
+        self._checked = 0.0
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    def _load_cache(self):
+        """读取上次保存的解析结果：相对路径 -> [大小, 修改时间, 时长, 错误]"""
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _cache_entries(self):
+        return {os.path.join(track.mood, track.name): [track.size, track.mtime, track.duration, track.error]
+                for _, tracks in self._folders.values() for track in tracks}
+
+    def _save_cache(self):
+        cache = self._cache_entries()
+        try:
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(cache, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logging.warning(f"保存音乐索引失败: {e}")
+
+    def _scan_folder(self, mood, mtime, cache):
+        """扫描一个基调文件夹；大小与修改时间未变的文件沿用缓存的解析结果"""
+        folder = os.path.join(self.folder, mood)
+        tracks = []
+        for entry in os.scandir(folder):
+            if not entry.is_file() or entry.name.startswith("."):
+                continue
+            stat = entry.stat()
+            cached = cache.get(os.path.join(mood, entry.name))
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                tracks.append(Track(entry.path, mood, stat.st_size, stat.st_mtime_ns, cached[2], cached[3]))
+            else:
+                tracks.append(probe(Track(entry.path, mood, stat.st_size, stat.st_mtime_ns)))
+        tracks.sort(key=lambda track: track.name)
+        self._folders[mood] = (mtime, tracks)
+
+    def refresh(self, force=False):
+        """检查目录修改时间，只重新扫描变化过的基调文件夹；返回索引是否有变化"""
+        with self._lock:
+            now = time.monotonic()
+            if self._loaded and not force and now - self._checked < self.check_interval:
+                return False
+            self._checked = now
+            cache = None if self._loaded else self._load_cache()
+            self._loaded = True
+            try:
+                root_mtime = os.stat(self.folder).st_mtime_ns
+            except OSError:
+                changed = bool(self._folders)
+                self._folders, self._root_mtime = {}, None
+                return changed
+            if root_mtime != self._root_mtime:
+                # 根目录变化：基调文件夹有增删
+                self._root_mtime = root_mtime
+                moods = {entry.name: entry.stat().st_mtime_ns for entry in os.scandir(self.folder) if entry.is_dir()}
+                removed = set(self._folders) - set(moods)
+                for mood in removed:
+                    del self._folders[mood]
+            else:
+                removed = ()
+                moods = {}
+                for mood in self._folders:
+                    try:
+                        moods[mood] = os.stat(os.path.join(self.folder, mood)).st_mtime_ns
+                    except OSError:
+                        moods[mood] = None
+            changed = bool(removed)
+            for mood, mtime in moods.items():
+                if mtime is None:
+                    del self._folders[mood]
+                    changed = True
+                elif mood not in self._folders or self._folders[mood][0] != mtime:
+                    if cache is None:
+                        cache = self._cache_entries()
+                    self._scan_folder(mood, mtime, cache)
+                    changed = True
+            if changed:
+                self._save_cache()
+            return changed
+
+    def moods(self):
+        """有可播放音乐的基调列表"""
+        self.refresh()
+        with self._lock:
+            return sorted(mood for mood, (_, tracks) in self._folders.items() if any(t.playable for t in tracks))
+
+    def tracks(self, mood):
+        """基调下可播放的音乐"""
+        self.refresh()
+        with self._lock:
+            _, tracks = self._folders.get(mood, (None, []))
+            return [track for track in tracks if track.playable]
+
+    def invalid(self):
+        """无法播放的文件（格式不支持或已损坏）"""
+        self.refresh()
+        with self._lock:
+            return [track for _, tracks in self._folders.values() for track in tracks if not track.playable]
+
+    def pick(self, mood):
+        """随机选择基调下的一首音乐，基调不存在时随机换一个基调；没有可播放的音乐时返回None"""
+        moods = self.moods()
+        if not moods:
+            return None
+        if mood not in moods:
+            mood = random.choice(moods)
+        return random.choice(self.tracks(mood))
+
+    def summary(self):
+        """音乐库概况，供启动时显示"""
+        moods = self.moods()
+        tracks = [track for mood in moods for track in self.tracks(mood)]
+        minutes = sum(track.duration or 0 for track in tracks) / 60
+        length = f"{minutes / 60:.1f}小时" if minutes >= 60 else f"{minutes:.0f}分钟"
+        size_mb = sum(track.size for track in tracks) / 1024 / 1024
+        return f"{len(moods)}种基调，{len(tracks)}首音乐，共{length}（{size_mb:.1f}MB）"
+
+
+# 全局音乐库实例（MusicPlayer 与 MusicDirector 共用）
+music_library = MusicLibrary()
@@ -0,0 +1,76 @@
+import threading
+from src.telemetry import telemetry, estimate_tokens
+
+
+def _serialize(messages):
+    """按消息顺序展开为提供商实际看到的前缀文本（角色 + 内容）"""
+    return [f"<{msg.get('role', '')}>{msg.get('content', '')}" for msg in messages]
+
+
+def _common_prefix_length(a, b):
+    """两个字符串的公共前缀长度（二分比较切片，比较在C层完成）"""
+    low, high = 0, min(len(a), len(b))
+    while low < high:
+        mid = (low + high + 1) // 2
+        if a[:mid] == b[:mid]:
+            low = mid
+        else:
+            high = mid - 1
+    return low
+
+
+class PromptAssembler:
+    """按稳定性从高到低组装提示词，并统计相邻请求之间可被提供商前缀缓存复用的比例
+
+    顺序固定为：格式/指令 → 世界观 → 角色 → 剧情摘要 → 对话历史 → 本次请求，
+    同一会话内前几段不变，字节完全相同，变化只发生在提示词末尾。
+    """
+
+    def __init__(self, history_size=8):
+        self.history_size = history_size
+        self._recent = {}  # model_type -> 最近几次请求的序列化消息
+        self._lock = threading.Lock()
+
+    def build(self, instructions, world=None, role=None, summary=None, history=None, request=None):
+        """组装消息列表；空字段不输出，分隔符固定，保证相同输入得到相同字节"""
+        system = instructions.strip()
+        if world:
+            system += f"\n【世界观】\n{world.strip()}"
+        if role:
+            system += f"\n【角色】\n{role.strip()}"
+        messages = [{"role": "system", "content": system}]
+        if summary:
+            messages.append({"role": "system", "content": f"【剧情摘要】{summary.strip()}"})
+        if history:
+            messages.extend(history)
+        if request:
+            messages.append({"role": "user", "content": request})
+        return messages
+
+    def record(self, model_type, messages):
+        """记录一次请求，返回与最近请求相比可复用的前缀比例（按估算token计）"""
+        current = _serialize(messages)
+        with self._lock:
+            recent = self._recent.setdefault(model_type, [])
+            reused_chars = max((self._reusable_chars(previous, current) for previous in recent), default=0)
+            recent.append(current)
+            del recent[:-self.history_size]
+        text = "".join(current)
+        reused = estimate_tokens(text[:reused_chars])
+        total = estimate_tokens(text)
+        telemetry.record_ratio(f"前缀复用率({model_type})", reused, total)
+        return reused / total if total else 0.0
+
+    def _reusable_chars(self, previous, current):
+        """逐条比较消息，完全相同的消息整体计入，第一条不同的消息只计公共前缀"""
+        reused = 0
+        for old, new in zip(previous, current):
+            if old == new:
+                reused += len(new)
+                continue
+            return reused + _common_prefix_length(old, new)
+        return reused
+
+
+# 全局提示词组装器实例
+prompt_assembler = PromptAssembler()
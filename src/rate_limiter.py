@@ -0,0 +1,42 @@
+import time
+import threading
+from collections import deque
+
+
+class RateLimiter:
+    """按提供商限制每分钟发起的请求数（滑动窗口），未配置或为0时不限制"""
+
+    def __init__(self, limits=None, window=60.0):
+        self.limits = dict(limits or {})  # provider -> 每分钟请求数
+        self.window = window
+        self._starts = {}  # provider -> 最近一个窗口内的请求开始时间
+        self._lock = threading.Lock()
+
+    def _prune(self, provider, now):
+        starts = self._starts.setdefault(provider, deque())
+        while starts and now - starts[0] >= self.window:
+            starts.popleft()
+        return starts
+
+    def available(self, provider):
+        """当前窗口内还能发起的请求数（不限制时为无穷大）"""
+        limit = self.limits.get(provider, 0)
+        if not limit:
+            return float("inf")
+        with self._lock:
+            return limit - len(self._prune(provider, time.monotonic()))
+
+    def acquire(self, provider):
+        """占用一次请求额度，超出限制时等待到窗口内最早的请求过期"""
+        limit = self.limits.get(provider, 0)
+        if not limit:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                starts = self._prune(provider, now)
+                if len(starts) < limit:
+                    starts.append(now)
+                    return
+                delay = self.window - (now - starts[0])
+            time.sleep(max(delay, 0.01))
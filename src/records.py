@@ -0,0 +1,143 @@
+import re
+from src.world_digest import split_sections, world_hash
+
+# 角色设定字段：(格式中的字段名, 属性名)，顺序与 LLMCore.generate_character 的输出格式一致
+CHARACTER_FIELDS = (
+    ("姓名", "name"),
+    ("职业", "profession"),
+    ("性别", "gender"),
+    ("年龄", "age"),
+    ("能力", "abilities"),
+    ("人物具体介绍", "introduction"),
+    ("关系", "relationships"),
+)
+# 基本信息与详细介绍之间的分隔线
+CHARACTER_SEPARATOR = "====="
+
+_CHARACTER_LINE = re.compile(
+    r'^[#>*\-\s]*\**\s*(' + '|'.join(label for label, _ in CHARACTER_FIELDS) + r')\s*\**\s*[:：]\s*\**\s*(.*)$'
+)
+_MARKUP = re.compile(r'[*_`#]+')
+
+
+def _clip(text, limit):
+    return text if len(text) <= limit else text[:limit] + "..."
+
+
+class Character:
+    """角色设定记录：从生成的角色文本解析一次，之后各处直接使用字段与预先计算的简短形式
+
+    short 用于菜单与列表，summary 用于摘要等提示词中的简短上下文，prompt_text 为按固定格式规范化后的完整设定。
+    """
+
+    __slots__ = ("text", "name", "profession", "gender", "age", "abilities", "introduction", "relationships",
+                 "short", "summary", "prompt_text")
+
+    def __init__(self, text="", **fields):
+        self.text = (text or "").strip()
+        for _, attr in CHARACTER_FIELDS:
+            setattr(self, attr, (fields.get(attr) or "").strip())
+        self._precompute()
+
+    def _precompute(self):
+        details = "，".join(value for value in (self.profession, self.gender, self.age) if value)
+        name = self.name or "未命名角色"
+        self.short = f"{name}（{details}）" if details else name
+        summary = self.short + (f"，能力：{self.abilities}" if self.abilities else "")
+        self.summary = _clip(summary, 100)
+        if not any(getattr(self, attr) for _, attr in CHARACTER_FIELDS):
+            # 无法识别格式时，提示词中保留原文
+            self.prompt_text = self.text
+            return
+        lines = [f"{label}: {getattr(self, attr)}" for label, attr in CHARACTER_FIELDS[:5] if getattr(self, attr)]
+        details = [f"{label}: {getattr(self, attr)}" for label, attr in CHARACTER_FIELDS[5:] if getattr(self, attr)]
+        if details:
+            lines.append(CHARACTER_SEPARATOR)
+            lines.extend(details)
+        self.prompt_text = "\n".join(lines)
+
+    @classmethod
+    def parse(cls, text):
+        """解析 姓名/职业/性别/年龄/能力/=====/人物具体介绍/关系 格式的角色文本（容忍Markdown标记与全半角冒号）"""
+        fields = {}
+        current = None
+        for raw in (text or "").split('\n'):
+            line = raw.strip()
+            if not line or line.startswith(CHARACTER_SEPARATOR):
+                continue
+            match = _CHARACTER_LINE.match(line)
+            if match:
+                current = dict(CHARACTER_FIELDS)[match.group(1)]
+                fields.setdefault(current, _MARKUP.sub('', match.group(2)).strip())
+            elif current:
+                # 字段内容换行时并入当前字段
+                fields[current] = f"{fields[current]} {_MARKUP.sub('', line).strip()}".strip()
+        return cls(text, **fields)
+
+    def missing(self):
+        """缺失的字段名列表（本地校验）"""
+        return [label for label, attr in CHARACTER_FIELDS if not getattr(self, attr)]
+
+    def is_valid(self):
+        """至少包含姓名才视为有效的角色设定"""
+        return bool(self.name)
+
+    def to_dict(self):
+        data = {attr: getattr(self, attr) for _, attr in CHARACTER_FIELDS if getattr(self, attr)}
+        data["text"] = self.text
+        return data
+
+    @classmethod
+    def from_dict(cls, data, fallback_text=""):
+        """从存档恢复；旧存档没有角色记录时解析原始角色文本"""
+        if data:
+            return cls(data.get("text", ""), **{attr: data.get(attr) for _, attr in CHARACTER_FIELDS})
+        return cls.parse(fallback_text)
+
+
+class World:
+    """世界观记录：保存全文并预先计算标题、预览与内容哈希，供菜单、存档列表与提示词使用"""
+
+    __slots__ = ("text", "hash", "title", "preview", "_sections")
+
+    def __init__(self, text, title=None, preview=None, content_hash=None):
+        self.text = (text or "").strip()
+        self.hash = content_hash or world_hash(self.text)
+        self._sections = None
+        if title is None or preview is None:
+            flat = " ".join(f"{heading} {body}".strip() for heading, body in self.sections)
+            title = title or _clip(self._first_title() or flat, 20)
+            preview = preview or _clip(flat, 200)
+        self.title = title
+        self.preview = preview
+
+    @property
+    def sections(self):
+        """按标题与空行切分的段落 [(标题, 正文)]，首次使用时解析"""
+        if self._sections is None:
+            self._sections = split_sections(self.text)
+        return self._sections
+
+    def _first_title(self):
+        """标题：第一个非空行（通常是世界观的总标题）"""
+        first_line = next((line for line in self.text.split('\n') if line.strip()), "")
+        return _MARKUP.sub('', first_line).strip(" ：:")
+
+    @classmethod
+    def parse(cls, text):
+        return cls(text)
+
+    def is_valid(self):
+        """世界观至少包含一段正文"""
+        return bool(self.sections)
+
+    def to_dict(self):
+        """存档中的世界观记录（全文另存于 world 字段）"""
+        return {"hash": self.hash, "title": self.title, "preview": self.preview}
+
+    @classmethod
+    def from_dict(cls, data, text):
+        """从存档恢复；记录与全文不一致（或旧存档没有记录）时重新解析"""
+        if data and data.get("hash") == world_hash((text or "").strip()):
+            return cls(text, data.get("title"), data.get("preview"), data["hash"])
+        return cls.parse(text)
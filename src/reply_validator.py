@@ -0,0 +1,157 @@
+import re
+from src.turn_history import extract_block
+
+SEPARATOR = "==============="
+CHOICE_HEADER = "用户接下来的选择(使用数字标记):"
+# 场景字段与状态字段（增量模式下状态字段带“变化”后缀）
+SCENE_FIELDS = ("用户身份", "时间", "地点", "情景")
+STATE_FIELDS = ("用户状态", "用户物品栏")
+REQUIRED_SECTIONS = SCENE_FIELDS + STATE_FIELDS + ("用户接下来的选择",)
+
+_FIELD_LINE = re.compile(
+    r'^[#>*\-\s]*\**\s*(用户身份|时间|地点|情景|用户状态变化|用户状态|用户物品栏变化|用户物品栏)\s*\**\s*[:：]\s*\**\s*(.*)$'
+)
+_CHOICE_HEADER_LINE = re.compile(r'^[#>*\-\s]*\**\s*(?:用户)?接下来的选择[^:：]*[:：]\s*\**\s*(.*)$|^[#>*\-\s]*\**\s*选择\s*\**\s*[:：]\s*(.*)$')
+_SEPARATOR_LINE = re.compile(r'^\s*[=\-—_*~]{3,}\s*$')
+# 选项编号：1. / 1、 / 1） / (1) / ①，位于行首、空白或冒号之后
+_CHOICE_MARK = re.compile(r'(?:^|(?<=[\s:：]))(?:\(?(\d+)[\.、．)）]|([①-⑨]))\s*')
+
+
+def _field_line(name, value):
+    """按固定格式输出字段行（用户身份使用全角冒号，其余使用半角冒号加空格）"""
+    return f"{name}：{value}" if name == "用户身份" else f"{name}: {value}"
+
+
+def _split_choices(text):
+    """将一行中的多个编号选项拆分为 [(编号, 内容)]"""
+    marks = list(_CHOICE_MARK.finditer(text))
+    choices = []
+    for i, mark in enumerate(marks):
+        end = marks[i + 1].start() if i + 1 < len(marks) else len(text)
+        content = text[mark.end():end].strip()
+        if content:
+            number = mark.group(1) or str("①②③④⑤⑥⑦⑧⑨".index(mark.group(2)) + 1)
+            choices.append((number, content))
+    return choices
+
+
+def _field_prefixes(name):
+    """字段行允许的开头（用户身份只接受全角冒号，与界面渲染一致）"""
+    if name == "用户身份":
+        return ("用户身份：",)
+    prefixes = (f"{name}:", f"{name}：")
+    if name in STATE_FIELDS:
+        prefixes += (f"{name}变化:", f"{name}变化：")
+    return prefixes
+
+
+def is_valid(reply):
+    """回复是否已符合固定格式（字段齐全、分隔线齐全、选项使用数字编号）"""
+    lines = [line.strip() for line in (reply or "").split('\n') if line.strip()]
+    present = set()
+    for i, line in enumerate(lines):
+        previous = lines[i - 1] if i else ""
+        for name in SCENE_FIELDS + STATE_FIELDS:
+            if line.startswith(_field_prefixes(name)):
+                if name in STATE_FIELDS and previous != SEPARATOR:
+                    return False
+                present.add(name)
+        if line == CHOICE_HEADER:
+            if previous != SEPARATOR or i + 1 >= len(lines) or not re.match(r'^\d+\.', lines[i + 1]):
+                return False
+            present.add("用户接下来的选择")
+    return present.issuperset(REQUIRED_SECTIONS)
+
+
+def parse_reply(reply):
+    """宽松解析回复：识别各字段（容忍Markdown标记、全半角冒号）、选项与未标注的叙述行"""
+    fields = {}
+    narrative = []
+    choices = []
+    in_choices = False
+    for raw in (reply or "").split('\n'):
+        line = raw.strip()
+        if not line or _SEPARATOR_LINE.match(line):
+            continue
+        header = _CHOICE_HEADER_LINE.match(line)
+        if header:
+            in_choices = True
+            choices.extend(_split_choices(header.group(1) or header.group(2) or ""))
+            continue
+        field = _FIELD_LINE.match(line)
+        if field:
+            fields.setdefault(field.group(1), field.group(2).strip().rstrip('*').strip())
+            in_choices = False
+            continue
+        mark = _CHOICE_MARK.search(line)
+        line_choices = _split_choices(line[mark.start():]) if mark else []
+        lead = line[:mark.start()].strip() if line_choices else ""
+        if lead and not in_choices and not lead.endswith((':', '：')) and len(line_choices) < 2:
+            # 叙述句中偶然出现的单个编号不视为选项
+            line_choices, lead = [], ""
+        if lead:
+            # 同一行中选项之前的文字：选项中途换行时并入上一个选项，否则作为叙述或引导语
+            if in_choices and choices:
+                number, content = choices[-1]
+                choices[-1] = (number, f"{content} {lead}")
+            else:
+                narrative.append(lead)
+        if line_choices and narrative and not in_choices and narrative[-1].endswith((':', '：')):
+            # “接下来你可以：”之类的引导语视为选项标题
+            narrative.pop()
+            in_choices = True
+        if line_choices and (in_choices or not narrative or len(line_choices) > 1):
+            in_choices = True
+            choices.extend(line_choices)
+        elif in_choices and choices:
+            # 选项内容换行时并入上一个选项
+            number, content = choices[-1]
+            choices[-1] = (number, f"{content} {line}")
+        else:
+            narrative.append(line)
+    return fields, narrative, choices
+
+
+def render_reply(fields, narrative, choices):
+    """按固定格式输出回复"""
+    lines = [_field_line(name, fields[name]) for name in SCENE_FIELDS if name in fields]
+    lines.extend(narrative)
+    for name in STATE_FIELDS:
+        key = name if name in fields else f"{name}变化"
+        if key in fields:
+            lines.append(SEPARATOR)
+            lines.append(_field_line(key, fields[key]))
+    if choices:
+        lines.append(SEPARATOR)
+        lines.append(CHOICE_HEADER)
+        lines.extend(f"{i}. {content}" for i, (_, content) in enumerate(choices, 1))
+    return "\n".join(lines)
+
+
+def repair_reply(reply, previous_reply="", state=None):
+    """本地修复回复格式
+
+    :param previous_reply: 上一回合的回复，缺失的用户身份、时间、地点沿用其中的值
+    :param state: 本地游戏状态 {"status", "inventory"}，缺失的用户状态、物品栏沿用当前值
+    :return: (修复后的回复, 是否做了修改, 仍缺失且无法本地修复的部分列表)
+    """
+    if is_valid(reply):
+        return reply, False, []
+    fields, narrative, choices = parse_reply(reply)
+    if "情景" not in fields and narrative:
+        # 未标注的叙述内容视为情景
+        fields["情景"] = narrative.pop(0)
+    for name in ("用户身份", "时间", "地点"):
+        if name not in fields:
+            value = extract_block(previous_reply, [name])
+            if value:
+                fields[name] = value
+    state = state or {}
+    for name, key in zip(STATE_FIELDS, ("status", "inventory")):
+        if name not in fields and f"{name}变化" not in fields and state.get(key):
+            fields[name] = "，".join(state[key])
+    missing = [name for name in SCENE_FIELDS + STATE_FIELDS
+               if name not in fields and f"{name}变化" not in fields]
+    if not choices:
+        missing.append("用户接下来的选择")
+    return render_reply(fields, narrative, choices), True, missing
@@ -0,0 +1,152 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+
+# 回合记忆文件目录（与回合历史同级，按历史编号存放）
+MEMORY_DIR = "data/memory"
+
+_CJK_RUN = re.compile(r'[\u4e00-\u9fff]+')
+_WORD = re.compile(r'[A-Za-z0-9]+')
+
+
+def tokenize(text):
+    """分词：中文连续片段切为二元组（单字片段保留单字），英文与数字按单词小写"""
+    tokens = []
+    for run in _CJK_RUN.findall(text or ""):
+        if len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    tokens.extend(word.lower() for word in _WORD.findall(text or ""))
+    return tokens
+
+
+class BM25Index:
+    """增量构建的 BM25 倒排索引（纯本地计算）"""
+
+    def __init__(self, k1=1.5, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}  # term -> {doc_id: tf}
+        self.doc_lengths = []
+        self.total_length = 0
+
+    def add(self, text):
+        """加入一篇文档，返回其编号"""
+        doc_id = len(self.doc_lengths)
+        counts = Counter(tokenize(text))
+        for term, tf in counts.items():
+            self.postings.setdefault(term, {})[doc_id] = tf
+        length = sum(counts.values())
+        self.doc_lengths.append(length)
+        self.total_length += length
+        return doc_id
+
+    def pop(self, text):
+        """移除最后加入的文档（text 为其原文）"""
+        doc_id = len(self.doc_lengths) - 1
+        for term in set(tokenize(text)):
+            posting = self.postings.get(term)
+            if posting is not None:
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[term]
+        self.total_length -= self.doc_lengths.pop()
+
+    def search(self, query, top_k=3, max_doc_id=None):
+        """检索与查询最相关的文档，返回 [(分数, 文档编号)]
+
+        :param max_doc_id: 只检索编号小于该值的文档（用于排除仍在上下文中的最近回合）
+        """
+        doc_count = len(self.doc_lengths) if max_doc_id is None else min(max_doc_id, len(self.doc_lengths))
+        if doc_count <= 0:
+            return []
+        avg_length = self.total_length / len(self.doc_lengths) or 1.0
+        scores = {}
+        for term in set(tokenize(query)):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (len(self.doc_lengths) - len(posting) + 0.5) / (len(posting) + 0.5))
+            for doc_id, tf in posting.items():
+                if doc_id >= doc_count:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_length)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [(score, doc_id) for doc_id, score in best]
+
+
+def make_passage(user_input, reply, max_chars=300):
+    """将一个回合压缩为检索段落：玩家行动 + 回复中的叙事内容（去掉分隔线与选项）"""
+    lines = []
+    for line in (reply or "").split('\n'):
+        line = line.strip()
+        if not line or line.startswith('=') or re.match(r'^\d+\.', line) or line.startswith('用户接下来的选择'):
+            continue
+        lines.append(line)
+    passage = f"行动：{user_input}\n" + " ".join(lines) if user_input else " ".join(lines)
+    return passage[:max_chars]
+
+
+class TurnMemory:
+    """存档的回合记忆：逐回合追加段落并持久化，检索相关的过往情节"""
+
+    def __init__(self, history_id, parent_id=None, fork_turn=None, memory_dir=MEMORY_DIR, max_turn=None):
+        """max_turn：只读取该回合及之前的记忆（从历史中间续接、尚未分出分支时）"""
+        self.file_path = os.path.join(memory_dir, f"{history_id}.jsonl")
+        self.index = BM25Index()
+        self.passages = []  # [(回合号, 段落)]
+        os.makedirs(memory_dir, exist_ok=True)
+        if os.path.exists(self.file_path):
+            self._load(self.file_path, max_turn=max_turn)
+        elif parent_id:
+            # 分支存档：继承父分支在分出回合之前的记忆
+            parent_path = os.path.join(memory_dir, f"{parent_id}.jsonl")
+            if os.path.exists(parent_path):
+                self._load(parent_path, max_turn=fork_turn)
+                with open(self.file_path, "w", encoding="utf-8") as f:
+                    for turn, passage in self.passages:
+                        f.write(json.dumps({"t": turn, "p": passage}, ensure_ascii=False) + "\n")
+
+    def _load(self, path, max_turn=None):
+        """读取记忆文件并重建索引"""
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                if max_turn is not None and record["t"] > max_turn:
+                    continue
+                self._add(record["t"], record["p"])
+
+    def _add(self, turn, passage):
+        """加入一个回合段落；与最后一个段落同一回合（重新生成）时替换之"""
+        if self.passages and self.passages[-1][0] == turn:
+            self.index.pop(self.passages.pop()[1])
+        self.passages.append((turn, passage))
+        self.index.add(passage)
+
+    def add_turn(self, turn, user_input, reply):
+        """记录一个回合；重新生成同一回合时替换之前的段落"""
+        passage = make_passage(user_input, reply)
+        if not passage:
+            return
+        self._add(turn, passage)
+        with open(self.file_path, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"t": turn, "p": passage}, ensure_ascii=False) + "\n")
+
+    def recall(self, query, top_k=3, skip_recent=5, min_score=1.0):
+        """检索与当前行动相关的过往段落，跳过仍在上下文中的最近几个回合"""
+        results = self.index.search(query, top_k, max_doc_id=len(self.passages) - skip_recent)
+        return [self.passages[doc_id] for score, doc_id in results if score >= min_score]
+
+
+def format_recall(passages):
+    """将检索结果格式化为注入提示词的文本"""
+    lines = ["【相关回忆】以下是可能与玩家当前行动有关的过往情节，请保持设定一致："]
+    for turn, passage in sorted(passages):
+        lines.append(f"- 第{turn}回合：{passage}")
+    return "\n".join(lines)
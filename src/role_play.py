@@ -1,11 +1,23 @@
 from src.llm_core import llm_core
 from src.summary import save_manager  # 使用新的存档管理器
-import os
 import threading
+import time
 from src import error_handler, summary
 from src.error_handler import error_handler
 from src.character_generator import generate_character
 from src.music_player import MusicPlayer  # 修正导入
+from src.music_director import MusicDirector
+from src.turn_history import TurnHistory, extract_block
+from src.telemetry import telemetry, estimate_tokens
+from src.summary_tree import SummaryTree
+from src.retrieval import TurnMemory, format_recall
+from src.checkpoint_policy import create_policy
+from src.history_sanitizer import sanitize_history, saved_tokens
+from src.game_state import GameState, DELTA_INSTRUCTIONS
+from src.prompt_assembler import prompt_assembler
+from src.reply_validator import repair_reply
+from src.world_digest import WorldDigest, format_world_passages
+from src.records import Character, World
 import queue
 from rich.console import Console
 from rich.panel import Panel
@@ -17,8 +29,35 @@ from rich import print as rich_print
 import re
 import toml
 
-# 定义音乐文件夹路径，可以从环境变量读取或设置默认值
-MUSIC_FOLDER = "game_music"
+# 角色扮演的固定格式说明：位于提示词最前，会话内字节不变，便于提供商复用前缀缓存
+ROLE_PLAY_FORMAT = (
+    "你是一个角色设定生成器和角色扮演大师。请严格按照如下格式输出每一轮内容，不要添加任何解释或多余内容：\n"
+    "用户身份：\n"
+    "时间:\n"
+    "地点:\n"
+    "情景:\n"
+    "===============\n"
+    "用户状态:\n"
+    "===============\n"
+    "用户物品栏:\n"
+    "===============\n"
+    "用户接下来的选择(使用数字标记):\n"
+    "【格式示例】\n"
+    "用户身份：艾琳·星语\n"
+    "时间: 晨曦初升\n"
+    "地点: 雾林边境\n"
+    "情景: 你正站在雾林边境，准备踏入未知的冒险。\n"
+    "===============\n"
+    "用户状态: 精神饱满，装备齐全\n"
+    "===============\n"
+    "用户物品栏: 魔法短杖，旅行斗篷，干粮\n"
+    "===============\n"
+    "用户接下来的选择(使用数字标记):\n1. 进入雾林 2. 检查装备 3. 休息片刻\n"
+    "请严格按照上述格式输出每一轮内容，不要输出任何解释或多余内容。\n"
+    "请根据下面的世界观进行角色扮演，以世界观的逻辑为主，不以扮演角色的逻辑为主；玩家扮演的角色见【角色】。"
+)
+# 开局请求：角色设定已在系统提示中，此处不再重复
+ROLE_PLAY_KICKOFF = "我扮演以上角色，请以该角色的身份和视角进行角色扮演，不要以旁观者或叙述者视角。请开始角色扮演游戏。"
 
 # 初始化Rich控制台
 console = Console(force_terminal=True)
@@ -82,155 +121,319 @@ def format_ai_reply(reply):
     
     return "\n\n".join(formatted_content)
 
-def start_role_play(world_description, summary_text, save_name=None, last_conversation=None,role=None):
+def start_role_play(world_description, summary_text, save_name=None, last_conversation=None,role=None,
+                    character_prefetcher=None):
+    character = None
     if not summary_text and not role:
-        role = generate_character(world_description)
-        if not role:
+        character = generate_character(world_description, character_prefetcher)
+        if not character:
             return
+        role = character.text
 
-    # 初始设定
-    def build_system_prompt(include_last_conversation=True):
-        prompt = (
-            "你是一个角色设定生成器和角色扮演大师。请严格按照如下格式输出每一轮内容，不要添加任何解释或多余内容：\n"
-            "用户身份：\n"
-            "时间:\n"
-            "地点:\n"
-            "情景:\n"
-            "===============\n"
-            "用户状态:\n"
-            "===============\n"
-            "用户物品栏:\n"
-            "===============\n"
-            "用户接下来的选择(使用数字标记):\n"
-            "请根据以下世界观进行角色扮演：\n"
-            f"{world_description}\n"
-            "【格式示例】\n"
-            "用户身份：艾琳·星语\n"
-            "时间: 晨曦初升\n"
-            "地点: 雾林边境\n"
-            "情景: 你正站在雾林边境，准备踏入未知的冒险。\n"
-            "===============\n"
-            "用户状态: 精神饱满，装备齐全\n"
-            "===============\n"
-            "用户物品栏: 魔法短杖，旅行斗篷，干粮\n"
-            "===============\n"
-            "用户接下来的选择(使用数字标记):\n1. 进入雾林 2. 检查装备 3. 休息片刻\n"
-            "请严格按照上述格式输出每一轮内容，不要输出任何解释或多余内容。"
-        )
-        if summary_text:
-            prompt += f"\n剧情摘要：{summary_text}\n"
-            if last_conversation:
-                prompt += f"\n上次对话：{last_conversation.get('content','')}\n,直接输出上次对话内容，不需要额外的提示。"
-        return prompt
-
-    # 初始化对话历史
-    def get_init_messages(include_last_conversation=True):
-        messages = [
-            {"role": "system", "content": build_system_prompt(include_last_conversation)}
-        ]
-        messages.append({"role": "user", "content": f"我扮演以下角色，请以该角色的身份和视角进行角色扮演，不要以旁观者或叙述者视角：\n{role}\n请开始角色扮演游戏。"})
-        return messages
-
-    # 首次AI回复，包含上次对话
-    messages = get_init_messages(include_last_conversation=True)
     summary_generated = False
     summary_save_name_queue = queue.Queue()  # 新增队列用于传递save_name
+    # full: 每轮输出完整状态与物品栏；delta: 只输出变化，由本地状态合并后展开为完整字段
+    state_protocol = toml.load('config.toml')['game'].get('state_protocol', 'full')
+    instructions = ROLE_PLAY_FORMAT + ("\n" + DELTA_INSTRUCTIONS if state_protocol == "delta" else "")
+
+    # 世界观摘要：按内容哈希缓存，每回合提示词只带摘要，完整世界观仍随存档保存
+    game_config = toml.load('config.toml')['game']
+    world_digest = WorldDigest.load(world_description, mode=game_config.get('world_digest', 'extractive'),
+                                    max_chars=game_config.get('world_digest_chars', 600),
+                                    generator=llm_core.generate_world_digest)
+    world_digest_saving = estimate_tokens(world_description) - estimate_tokens(world_digest.digest)
+
+    def build_request(conversation):
+        """按稳定性组装请求：格式说明 → 世界观摘要 → 角色 → 剧情摘要 → 对话历史"""
+        if world_digest_saving > 0:
+            telemetry.increment("世界观摘要节省tokens", world_digest_saving)
+        return prompt_assembler.build(instructions, world=world_digest.digest, role=character.prompt_text,
+                                      summary=prompt_summary, history=conversation)
+
+    def get_init_messages():
+        """初始化对话历史"""
+        return [{"role": "user", "content": ROLE_PLAY_KICKOFF}]
+
+    reply_validation = toml.load('config.toml')['game'].get('reply_validation', True)
+
+    def validate_reply(request, reply, previous_reply=""):
+        """校验回复格式：优先本地修复，其次只补全缺失部分，最后才重新生成整回合"""
+        if not reply or not reply_validation:
+            return reply
+        state = game_state.to_dict()
+        repaired, changed, missing = repair_reply(reply, previous_reply, state)
+        if not missing:
+            telemetry.increment("回复格式本地修复" if changed else "回复格式合格")
+            if changed:
+                telemetry.record_ratio("格式问题本地解决率", 1, 1)
+            return repaired
+        telemetry.record_ratio("格式问题本地解决率", 0, 1)
+        if "情景" not in missing:
+            completion = llm_core.complete_reply_sections(repaired, missing)
+            if completion:
+                completed, _, still_missing = repair_reply(f"{repaired}\n{completion}", previous_reply, state)
+                if not still_missing:
+                    telemetry.increment("回复格式补全缺失部分")
+                    return completed
+        telemetry.increment("回复格式重新生成")
+        retry = llm_core.role_play_response(request, temperature=0.7)
+        return repair_reply(retry, previous_reply, state)[0] if retry else repaired
+
+    # 读档时直接使用本地保存的对话，不再请求模型重新输出上次内容
+    saved_data = save_manager.read_save(save_name) if summary_text and save_name else {}
+    # 角色与世界观记录：读档时使用存档中的记录，新游戏只解析一次
+    character = character or Character.from_dict(saved_data.get("character"), role)
+    world = World.from_dict(saved_data.get("world_record"), world_description)
+    summary_tree = SummaryTree.from_dict(saved_data.get("summary_tree"), merger=llm_core.merge_summaries,
+                                         fallback_summary=summary_text)
+    # 提示词中的摘要只在检查点完成后更新，两次检查点之间提示词前缀保持不变
+    prompt_summary = summary_tree.render()
+    # 回合历史：续接存档对应的历史，存档回合落后于历史末尾时自动分出新分支
+    turn_history = TurnHistory.resume(saved_data.get("history_id"), saved_data.get("history_turn"))
+    history_turn = turn_history.latest_turn()
+    # 回合记忆：对过往回合建立本地检索索引，随历史编号持久化
+    turn_memory = TurnMemory(turn_history.history_id, turn_history.parent, turn_history.fork_turn,
+                             max_turn=history_turn)
+    # 本地游戏状态：对话中保存的是展开后的完整回复，续接时以最近一条回复为准
+    game_state = GameState.from_dict(saved_data.get("game_state"))
+    turn_start_state = game_state.to_dict()  # 本回合回复应用前的状态，用于重新生成时撤销
+    if history_turn is not None:
+        # 历史快照保存的是完整对话（仅不含系统提示），可直接续接
+        resumed_history = turn_history.reconstruct(history_turn)["messages"]
+    else:
+        history_turn = saved_data.get("history_turn") or 0
+        resumed_history = save_manager.expand_messages(saved_data.get("recent_context"))
+    if not resumed_history and summary_text and last_conversation and last_conversation.get('content'):
+        # 旧版存档只保存了最后一条对话
+        resumed_history = [{"role": "assistant", "content": last_conversation['content']}]
+
+    if resumed_history and resumed_history[-1]["role"] == "assistant":
+        # 重新生成续接的回合时应撤销到最后一条回复之前：依次应用之前的（已展开的）回复得到该状态
+        before_last = GameState()
+        for msg in resumed_history[:-1]:
+            if msg["role"] == "assistant":
+                before_last.apply_reply(msg["content"])
+        turn_start_state = before_last.to_dict()
+        assistant_reply = game_state.apply_reply(resumed_history[-1]["content"])
+        if turn_history.latest_turn() is not None:
+            messages = resumed_history
+        else:
+            messages = get_init_messages() + resumed_history
+        # 上次检查点时的对话长度，下次检查点的叶子摘要只概括其后的新对话；续接前的对话已包含在存档的摘要中
+        checkpoint_from = len(messages)
+    else:
+        # 首次AI回复
+        messages = get_init_messages()
+        request = build_request(messages)
+        assistant_reply = validate_reply(request, llm_core.role_play_response(request, temperature=0.7))
+        if assistant_reply is None:
+            return
+        assistant_reply = game_state.apply_reply(assistant_reply)
+        messages.append({"role": "assistant", "content": assistant_reply})
+        checkpoint_from = 0
 
-    # 首次回复
-    assistant_reply = llm_core.role_play_response(messages, temperature=0.7)
-    if assistant_reply is None:
-        return
-        
-    messages.append({"role": "assistant", "content": assistant_reply})
     console.clear()  # 使用Rich清屏
-    
+
     # 美化显示AI回复
     formatted_reply = format_ai_reply(assistant_reply)
     console.print(Panel(formatted_reply, title="[bold green]🎭 角色扮演游戏[/bold green]", border_style="green"))
 
-    # 首次回复后，去除上次对话内容，重建 system_prompt
-    messages = get_init_messages(include_last_conversation=False)
-    messages.append({"role": "user", "content": f"我扮演以下角色：{role}，请开始角色扮演游戏,请以世界观的逻辑为主，不以扮演角色的逻辑为主。"})
-    messages.append({"role": "assistant", "content": assistant_reply})
+    def record_history():
+        """记录当前回合的状态快照（新消息、状态、物品栏、摘要与摘要树）"""
+        nonlocal turn_memory
+        history_id = turn_history.history_id
+        try:
+            turn_history.record_turn(
+                history_turn, messages,
+                status=extract_block(assistant_reply, ["用户状态"]),
+                inventory=extract_block(assistant_reply, ["用户物品栏"]),
+                summary=current_summary,
+                summary_tree=summary_tree.to_dict()
+            )
+        except OSError as e:
+            import logging
+            logging.warning(f"记录回合历史失败: {e}")
+        if turn_history.history_id != history_id:
+            # 从历史中间续接后分出了新分支，回合记忆随之切换到新分支
+            turn_memory = TurnMemory(turn_history.history_id, turn_history.parent, turn_history.fork_turn)
 
     turn_count = 0
-    mood = None  # 初始化音乐基调变量
-    current_summary = summary_text or ""  # 当前摘要，用于增量更新
+    music_director = MusicDirector(music_player)  # 后台选择音乐基调并切换播放
+    if music_player.enable_music:
+        # 损坏或格式不支持的音乐文件在开始时提示，播放时不会被选中
+        invalid = music_player.library.invalid()
+        console.print(f"[dim]🎵 音乐库：{music_player.library.summary()}[/dim]")
+        if invalid:
+            listed = "、".join(f"{item.mood}/{item.name}（{item.error}）" for item in invalid[:5])
+            console.print(f"[yellow]⚠️ {len(invalid)} 个音乐文件无法播放，已跳过：{listed}{' 等' if len(invalid) > 5 else ''}[/yellow]")
+    current_summary = summary_tree.render()  # 当前摘要，用于增量更新
     config = toml.load('config.toml')
-    summary_interval = config['game']['summary_interval']  # 摘要生成的轮数间隔
+    checkpoint_policy = create_policy(config)  # 检查点触发策略：固定间隔或按内容增长自适应
+    checkpoint_mode = config['game'].get('checkpoint_mode', 'unified')  # unified: 单次结构化调用；legacy: 分步调用
+    memory_recall = config['game'].get('memory_recall', 3)  # 每回合注入的相关回忆条数，0为关闭
+    summarizer = config['game'].get('summarizer', 'hybrid')  # llm: 模型摘要；extractive: 仅本地抽取；hybrid: 先本地后模型
+    verbatim_turns = config['game'].get('verbatim_turns', 1)  # 发送给模型时保持原文的最近回复数，更早的回复压缩
+    reply_candidates = max(1, config['game'].get('reply_candidates', 1))  # 每回合生成的候选回复数，多余的供重新生成使用
+    # 本回合未使用的候选回复及其请求，重新生成时直接取用；玩家行动或重新开始后失效
+    candidate_cache = {"request": None, "previous_reply": "", "replies": []}
     summary_save_name_queue = queue.Queue()  # 用于线程间传递实际存档名
+    if turn_history.latest_turn() != history_turn:
+        record_history()
 
-    def generate_smart_summary_in_background(messages, world_description, save_name, previous_summary):
+    def request_reply(conversation):
+        """净化对话历史（移除界面提示、压缩较早回合）后请求角色扮演回复，并统计节省的token"""
+        sanitized = sanitize_history(conversation, verbatim_turns)
+        telemetry.increment("历史净化节省tokens", saved_tokens(conversation, sanitized))
+        request = build_request(sanitized)
+        previous_reply = next((msg["content"] for msg in reversed(conversation) if msg["role"] == "assistant"), "")
+        replies = llm_core.role_play_candidates(request, reply_candidates)
+        if not replies:
+            return None
+        spare = replies[1:]
+        candidate_cache.update(request=request, previous_reply=previous_reply, replies=spare)
+        if spare:
+            telemetry.increment("候选回复额外输出tokens", sum(estimate_tokens(reply) for reply in spare))
+        return validate_reply(request, replies[0], previous_reply)
+
+    def next_cached_candidate():
+        """取出一个缓存的候选回复（无缓存时返回None）"""
+        if not candidate_cache["replies"]:
+            return None
+        telemetry.increment("重新生成命中候选缓存")
+        reply = candidate_cache["replies"].pop(0)
+        return validate_reply(candidate_cache["request"], reply, candidate_cache["previous_reply"])
+
+    def generate_smart_summary_in_background(messages, new_messages, world_description, save_name, previous_summary,
+                                             history_extra=None):
+        """
+        增强型智能后台摘要生成 - 使用新的智能摘要系统，并统计本次存档的模型调用开销
         """
-        增强型智能后台摘要生成 - 使用新的智能摘要系统
+        with telemetry.track_calls() as usage:
+            result = run_checkpoint(messages, new_messages, world_description, save_name, previous_summary, history_extra)
+        telemetry.increment("存档检查点次数")
+        telemetry.increment(f"检查点模型调用({checkpoint_mode})", usage["calls"])
+        telemetry.increment(f"检查点tokens({checkpoint_mode})", usage["prompt_tokens"] + usage["completion_tokens"])
+        return result
+
+    def run_checkpoint(messages, new_messages, world_description, save_name, previous_summary, history_extra=None):
+        """生成摘要与存档名并保存；unified 模式下只发起一次结构化调用
+
+        摘要树的叶子只概括上次检查点之后的新对话（new_messages），之前的摘要仅作为背景；存档中的摘要为整棵树的渲染结果。
         """
         nonlocal summary_generated, current_summary
+        extra = dict(history_extra or {})
+        provisional_name = None
         try:
-            # 使用增强的智能摘要生成
-            if len(messages) > 10:
-                # 为长对话使用智能摘要系统
-                session_context = f"世界观：{world_description[:200]}，角色：{role[:100] if role else '未知'}"
-                new_summary = llm_core.generate_enhanced_summary(
-                    messages=messages,
+            session_context = f"世界观：{world.preview}，角色：{character.summary if character.text else '未知'}"
+            context_info = f"第{turn_count}轮，{music_director.mood or '未知'}基调"
+            if summarizer == "extractive":
+                return save_extractive_checkpoint(messages, new_messages, world_description, save_name, previous_summary,
+                                                  history_extra)
+            if summarizer == "hybrid":
+                # 先用本地抽取式摘要立即存一个临时存档，模型摘要到达后再替换
+                provisional = llm_core.generate_extractive_checkpoint(new_messages)
+                if provisional:
+                    summary_tree.set_pending(provisional["summary"])
+                    # 首个检查点还没有存档名：关键词存档名加时间戳，避免覆盖其他游戏的存档
+                    provisional_name = save_name or f"{provisional['save_name']}_{int(time.time())}"
+                    save_manager.save_game_state(
+                        messages, world_description, provisional_name, role, previous_summary,
+                        summary=summary_tree.render(),
+                        extra=dict(extra, summary_tree=summary_tree.to_dict(), extracted_state=provisional["state"])
+                    )
+            if checkpoint_mode == "unified":
+                # 摘要、存档标题、状态提取合并为一次结构化调用
+                checkpoint = llm_core.generate_checkpoint(
+                    messages=new_messages,
                     previous_summary=previous_summary,
-                    session_context=session_context
+                    session_context=session_context,
+                    context_info=context_info
                 )
+                new_summary = checkpoint["summary"] if checkpoint else None
+                new_save_name = checkpoint["save_name"] if checkpoint else None
+                if checkpoint:
+                    extra["extracted_state"] = checkpoint["state"]
             else:
-                # 较短对话使用标准智能摘要
-                new_summary = llm_core.generate_smart_summary(
-                    messages=messages,
+                # 只概括新对话，之前的摘要仅作为背景
+                new_summary = llm_core.generate_leaf_summary(
+                    messages=new_messages,
                     previous_summary=previous_summary,
-                    enable_optimization=True
+                    session_context=session_context
                 )
-            
-            if new_summary and new_summary.strip():
                 # 生成优化的存档名
-                context_info = f"第{turn_count}轮，{mood if mood else '未知'}基调"
                 new_save_name = llm_core.generate_compact_save_name(
                     summary=new_summary,
                     context_info=context_info
-                )
-                
-                # 使用存档管理器保存状态（已经包含了智能压缩）
+                ) if new_summary and new_summary.strip() else None
+
+            if new_summary and new_summary.strip():
+                # 新摘要作为叶子加入摘要树，凑满时才向上合并章节/篇章
+                summary_tree.add_leaf(new_summary)
+                extra["summary_tree"] = summary_tree.to_dict()
+                # 使用存档管理器保存状态；unified 模式直接使用已生成的摘要，不再重复摘要
+                if provisional_name and save_name:
+                    # 已有存档名时直接替换临时存档，不另建新文件
+                    new_save_name = save_name
                 final_summary, actual_save_name = save_manager.save_game_state(
                     messages=messages,
                     world_description=world_description,
                     save_name=new_save_name,
                     role=role,
-                    previous_summary=previous_summary
+                    previous_summary=previous_summary,
+                    summary=summary_tree.render() if checkpoint_mode == "unified" else None,
+                    extra=extra
                 )
                 
                 if final_summary:
+                    if provisional_name and provisional_name != actual_save_name:
+                        # 模型存档已写入新名称，删除首个检查点的临时存档
+                        save_manager.delete_save(provisional_name)
                     summary_generated = True
-                    current_summary = final_summary  # 更新当前摘要用于下次增量更新
+                    current_summary = summary_tree.render()  # 更新当前摘要用于下次增量更新
                     # 将实际保存的名称放入队列
                     summary_save_name_queue.put(actual_save_name or new_save_name)
                     return actual_save_name or new_save_name, final_summary
             
-            # 生成失败时的回退处理
-            fallback_summary, fallback_name = save_manager.save_game_state(
-                messages, world_description, save_name, role, previous_summary
-            )
-            summary_save_name_queue.put(fallback_name or save_name)
-            current_summary = fallback_summary or previous_summary
-            return fallback_name or save_name, fallback_summary or previous_summary
+            # 模型不可用时回退到本地抽取式摘要，不再重复调用模型（写入临时存档所用的名称）
+            telemetry.increment("抽取式摘要回退次数")
+            return save_extractive_checkpoint(messages, new_messages, world_description, provisional_name or save_name,
+                                              previous_summary, history_extra)
             
         except Exception as e:
             # 静默处理错误，避免打断用户输入
             import logging
             logging.warning(f"生成智能摘要时发生错误: {e}")
             
-            # 使用最基本的保存方式作为最后回退
+            # 使用本地抽取式摘要作为最后回退
             try:
-                backup_summary, backup_name = save_manager.save_game_state(
-                    messages, world_description, save_name, role, previous_summary
-                )
-                summary_save_name_queue.put(backup_name or save_name)
-                return backup_name or save_name, backup_summary or previous_summary
-            except:
+                telemetry.increment("抽取式摘要回退次数")
+                return save_extractive_checkpoint(messages, new_messages, world_description,
+                                                  provisional_name or save_name, previous_summary, history_extra)
+            except Exception:
                 summary_save_name_queue.put(save_name)
                 return save_name, previous_summary
 
+    def save_extractive_checkpoint(messages, new_messages, world_description, save_name, previous_summary,
+                                   history_extra=None):
+        """使用本地抽取式摘要完成存档（不调用模型）"""
+        nonlocal summary_generated, current_summary
+        extra = dict(history_extra or {})
+        checkpoint = llm_core.generate_extractive_checkpoint(new_messages)
+        if not checkpoint:
+            summary_save_name_queue.put(save_name)
+            return save_name, previous_summary
+        summary_tree.add_leaf(checkpoint["summary"])
+        extra["summary_tree"] = summary_tree.to_dict()
+        extra["extracted_state"] = checkpoint["state"]
+        final_summary, actual_save_name = save_manager.save_game_state(
+            messages, world_description, save_name or f"{checkpoint['save_name']}_{int(time.time())}", role,
+            previous_summary, summary=summary_tree.render(), extra=extra
+        )
+        summary_generated = bool(final_summary)
+        current_summary = summary_tree.render()
+        summary_save_name_queue.put(actual_save_name or save_name)
+        return actual_save_name or save_name, final_summary or previous_summary
+
     while True:
         # 检查摘要线程是否有新存档名和摘要更新
         new_save_name = None
@@ -238,17 +441,18 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
             new_save_name = summary_save_name_queue.get()
         if new_save_name:
             save_name = new_save_name
-            # 同时更新当前摘要（用于下次增量更新）
-            try:
-                save_data = save_manager.load_game_state(save_name)
-                if save_data[1]:  # 如果成功加载摘要
-                    current_summary = save_data[1]
-            except:
-                pass
+            # 同时更新当前摘要（用于下次增量更新），并让提示词使用最新的摘要树
+            current_summary = summary_tree.render()
+            prompt_summary = current_summary
+
+        # 状态区：显示后台音乐切换结果，不写入回复内容
+        music_status = music_director.poll_status()
+        if music_status:
+            console.print(f"[bold green]🎵 {music_status}[/bold green]")
 
         # 显示帮助信息
         help_text = (
-            "💡 [dim]可用命令: 退出、重新开始、重新生成本回合、查看摘要[/dim]"
+            "💡 [dim]可用命令: 退出、重新开始、重新生成本回合、查看摘要、查看统计[/dim]"
         )
         console.print(help_text)
         console.print()  # 空行
@@ -269,7 +473,7 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
             )
         if user_input == '退出':
             console.print(Panel(
-                "[bold red]🚪 游戏已退出，再见！[/bold red]",
+                f"[bold red]🚪 游戏已退出，再见！[/bold red]\n[dim]本次会话共存档 {telemetry.counters.get('存档检查点次数', 0)} 次[/dim]",
                 title="[red]退出游戏[/red]",
                 border_style="red"
             ))
@@ -281,9 +485,19 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
                 border_style="yellow"
             ))
             messages = get_init_messages()
-            assistant_reply = llm_core.role_play_response(messages, temperature=0.7)
+            checkpoint_from = 0
+            candidate_cache["replies"].clear()
+            assistant_reply = request_reply(messages)
             if assistant_reply:
+                game_state.restore({})
+                turn_start_state = game_state.to_dict()
+                assistant_reply = game_state.apply_reply(assistant_reply)
                 messages.append({"role": "assistant", "content": assistant_reply})
+                # 新的一局使用新的回合历史与回合记忆，检索不会再召回上一局的情节
+                turn_history = TurnHistory()
+                turn_memory = TurnMemory(turn_history.history_id)
+                history_turn = 0
+                record_history()
                 console.clear()
                 formatted_reply = format_ai_reply(assistant_reply)
                 console.print(Panel(
@@ -306,17 +520,36 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
                     border_style="yellow"
                 ))
             continue
-        elif user_input == '重新生成本回合':
+        elif user_input == '查看统计':
             console.print(Panel(
-                "[bold cyan]🎲 正在重新生成本回合内容，请稍候...[/bold cyan]",
-                title="[cyan]重新生成[/cyan]",
+                telemetry.report() or "[yellow]暂无统计数据[/yellow]",
+                title="[cyan]📊 本次会话统计[/cyan]",
                 border_style="cyan"
             ))
+            continue
+        elif user_input == '重新生成本回合':
             if len(messages) >= 2 and messages[-1]["role"] == "assistant" and messages[-2]["role"] == "user":
                 messages = messages[:-1]  # 移除最后一个assistant回复
-                assistant_reply = llm_core.role_play_response(messages, temperature=0.7)
+                checkpoint_from = min(checkpoint_from, len(messages))
+                # 撤销被替换回复的状态增量后再取用新回复
+                game_state.restore(turn_start_state)
+                # 优先使用本回合缓存的候选回复，无需等待模型
+                assistant_reply = next_cached_candidate()
+                if assistant_reply is None:
+                    console.print(Panel(
+                        "[bold cyan]🎲 正在重新生成本回合内容，请稍候...[/bold cyan]",
+                        title="[cyan]重新生成[/cyan]",
+                        border_style="cyan"
+                    ))
+                    assistant_reply = request_reply(messages)
                 if assistant_reply:
+                    assistant_reply = game_state.apply_reply(assistant_reply)
                     messages.append({"role": "assistant", "content": assistant_reply})
+                    record_history()  # 覆盖本回合的快照
+                    # 回合记忆中被替换的回复一并替换
+                    action = messages[-2]["content"]
+                    turn_memory.add_turn(history_turn, action[5:] if action.startswith("我的行动：") else action,
+                                         assistant_reply)
                     formatted_reply = format_ai_reply(assistant_reply)
                     console.print(Panel(
                         formatted_reply,
@@ -330,9 +563,24 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
         # 用户输入内嵌到提示中，并追加到对话历史
         action_prompt = f"我的行动：{user_input}"
         messages.append({"role": "user", "content": action_prompt})
-        assistant_reply = llm_core.role_play_response(messages, temperature=0.7)
+        candidate_cache["replies"].clear()  # 玩家已行动，上一回合的候选失效
+        request_messages = messages
+        recalled = turn_memory.recall(user_input, top_k=memory_recall) if memory_recall else []
+        # 行动提到世界观摘要未覆盖的内容时，从世界观原文中检索相关段落
+        world_passages = world_digest.lookup(user_input)
+        if world_passages:
+            telemetry.increment("世界观原文检索次数")
+        context = ([{"role": "system", "content": format_recall(recalled)}] if recalled else []) + \
+                  ([{"role": "system", "content": format_world_passages(world_passages)}] if world_passages else [])
+        if context:
+            # 相关回忆与世界观原文只注入本次请求，不写入对话历史
+            request_messages = messages[:-1] + context + [messages[-1]]
+        assistant_reply = request_reply(request_messages)
         if assistant_reply is None:
             continue
+        reply_arrived = time.monotonic()
+        turn_start_state = game_state.to_dict()
+        assistant_reply = game_state.apply_reply(assistant_reply)
 
         # 检查摘要生成队列，若有新save_name则添加到回复中
         if not summary_save_name_queue.empty():
@@ -344,48 +592,7 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
 
         messages.append({"role": "assistant", "content": assistant_reply})
 
-        # 检查音乐播放开关
-        config = toml.load('config.toml')
-        enable_music = config['game']['enable_music']
-
-        if enable_music and turn_count == 0:  # 第零回合自动播放音乐
-            available_moods = [name for name in os.listdir(MUSIC_FOLDER) if os.path.isdir(os.path.join(MUSIC_FOLDER, name))]
-            mood = llm_core.select_music_mood(assistant_reply, available_moods)
-
-            # 动态读取基调文件夹名称，静默重试
-            retry_count = 0
-            while mood not in available_moods and retry_count < 3:
-                mood = llm_core.select_music_mood(assistant_reply, available_moods)
-                retry_count += 1
-
-            if mood and mood in available_moods:
-                music_status = music_player.play_music_by_mood(mood)  # 修正为实例方法调用
-                # 只在AI回复中显示音乐信息，不单独打印
-                assistant_reply += f"\n\n🎵 {mood}基调音乐已开始播放"
-            else:
-                # 静默处理，不显示错误信息
-                pass
-        elif enable_music and (turn_count % 3 == 0 or turn_count == 0):  # 每三回合检查是否需要更换音乐
-            should_change = llm_core.should_change_music(assistant_reply, mood)
-            
-            if should_change:
-                # 调用AI生成基调并播放音乐
-                available_moods = [name for name in os.listdir(MUSIC_FOLDER) if os.path.isdir(os.path.join(MUSIC_FOLDER, name))]
-                new_mood = llm_core.select_music_mood(assistant_reply, available_moods)
-
-                # 静默重试，避免打印错误信息
-                retry_count = 0
-                while new_mood not in available_moods and retry_count < 3:
-                    new_mood = llm_core.select_music_mood(assistant_reply, available_moods)
-                    retry_count += 1
-
-                if new_mood and new_mood in available_moods:
-                    mood = new_mood  # 更新当前基调
-                    music_status = music_player.play_music_by_mood(mood)  # 修正为实例方法调用
-                    assistant_reply += f"\n\n🎵 音乐已切换至{mood}基调"
-                # 如果无法生成有效基调，静默处理，不添加错误信息
-
-        # 输出AI回复
+        # 先输出AI回复，音乐评估与切换在后台进行，结果显示在状态区
         console.clear()  # 使用Rich清屏
         formatted_reply = format_ai_reply(assistant_reply)
         console.print(Panel(
@@ -393,10 +600,23 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
             title="[bold green]🎭 角色扮演游戏[/bold green]",
             border_style="green"
         ))
+        telemetry.record_timing("回复到首屏耗时", time.monotonic() - reply_arrived)
+
+        # 检查音乐播放开关
+        if toml.load('config.toml')['game']['enable_music']:
+            music_director.submit(assistant_reply, turn_count)
 
         # 每x轮生成一次智能摘要，并在后台线程中执行
         turn_count += 1
-        if turn_count % summary_interval == 0:
+        history_turn += 1
+        record_history()
+        turn_memory.add_turn(history_turn, user_input, assistant_reply)
+        checkpoint_policy.observe(action_prompt, assistant_reply)
+        if checkpoint_policy.should_checkpoint():
+            telemetry.increment(f"检查点触发({checkpoint_policy.reason})")
+            checkpoint_policy.mark_checkpoint()
+            new_messages = [msg for msg in messages[checkpoint_from:] if msg["role"] != "system"]
+            checkpoint_from = len(messages)
             # 显示智能摘要生成状态
             progress_msg = f"\n\n💡 第{turn_count}轮：正在生成智能摘要和优化存档..."
             assistant_reply += progress_msg
@@ -413,28 +633,31 @@ def start_role_play(world_description, summary_text, save_name=None, last_conver
             # 启动增强型后台摘要生成
             summary_thread = threading.Thread(
                 target=generate_smart_summary_in_background,
-                args=(messages, world_description, save_name, current_summary),
+                args=(messages, new_messages, world_description, save_name, current_summary,
+                      {"history_id": turn_history.history_id, "history_turn": history_turn,
+                       "game_state": game_state.to_dict(), "character": character.to_dict(),
+                       "world_record": world.to_dict()}),
                 daemon=True  # 设为守护线程，主程序退出时自动结束
             )
             summary_thread.start()
         
         # 智能摘要优化：每2轮进行一次轻量级状态更新
         elif turn_count % 2 == 0 and turn_count > 0:
-            # 使用轻量级摘要更新，不保存文件
+            # 使用轻量级摘要更新，不保存文件；非 llm 模式直接本地抽取，不调用模型
             try:
-                recent_progress = llm_core.generate_smart_summary(
-                    messages=messages[-4:],  # 只分析最近4条消息
-                    previous_summary="",
-                    max_tokens=200,
-                    enable_optimization=True
-                )
+                if summarizer == "llm":
+                    recent_progress = llm_core.generate_smart_summary(
+                        messages=messages[-4:],  # 只分析最近4条消息
+                        previous_summary="",
+                        max_tokens=200,
+                        enable_optimization=True
+                    )
+                else:
+                    recent_progress = llm_core.generate_extractive_summary(messages[-4:], max_chars=150)
                 if recent_progress and len(recent_progress.strip()) > 10:
-                    # 更新内存中的当前摘要
-                    if current_summary:
-                        # 合并最新进展到当前摘要
-                        current_summary = f"{current_summary[:400]}...最新：{recent_progress[:100]}"
-                    else:
-                        current_summary = recent_progress
+                    # 最新进展暂存到摘要树，下一个检查点叶子到来时替换
+                    summary_tree.set_pending(recent_progress)
+                    current_summary = summary_tree.render()
             except:
                 pass  # 轻量级更新失败时忽略
 
@@ -0,0 +1,225 @@
+"""
+存档维护命令行工具
+
+用法（在项目根目录下运行，且游戏未运行时）：
+    python -m src.save_tool maintain [--data-dir data] [--workers 4] [--dry-run] [--restart]
+    python -m src.save_tool export saves.ndjson.gz [--since 2025-01-01] [--search 魔法]
+    python -m src.save_tool import saves.tar.gz [--on-conflict rename|skip|overwrite]
+
+归档格式由扩展名决定：.ndjson / .tar，追加 .gz 时启用压缩。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from src.summary import save_manager, SaveManager
+
+# 维护进度与锁文件（不以.json结尾，不会出现在存档列表中）
+STATE_FILE = ".maintenance.state"
+LOCK_FILE = ".maintenance.lock"
+
+
+def _quarantine_path(quarantine_dir, name):
+    """隔离目录中的目标路径；已有同名文件（之前隔离的同名存档）时追加序号，不覆盖"""
+    target = os.path.join(quarantine_dir, name)
+    stem, ext = os.path.splitext(name)
+    suffix = 1
+    while os.path.exists(target):
+        target = os.path.join(quarantine_dir, f"{stem}_{suffix}{ext}")
+        suffix += 1
+    return target
+
+
+def _maintain_file(task):
+    """处理单个存档：校验、升级、紧凑化；损坏文件移入隔离目录（在子进程中执行）"""
+    path, quarantine_dir, dry_run = task
+    name = os.path.basename(path)
+    result = {"name": name, "status": "ok", "before": 0, "after": 0, "reason": None}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            text = f.read()
+        result["before"] = len(text.encode("utf-8"))
+        data = json.loads(text)
+        if not isinstance(data, dict):
+            raise ValueError("存档内容不是JSON对象")
+        if save_manager.verify_checksum(data) is False:
+            raise ValueError("校验和不一致")
+    except Exception as e:
+        result["status"] = "quarantined"
+        result["reason"] = str(e) or type(e).__name__
+        if not dry_run:
+            os.makedirs(quarantine_dir, exist_ok=True)
+            os.replace(path, _quarantine_path(quarantine_dir, name))
+        return result
+
+    upgraded = save_manager.upgrade_save_data(data)
+    serialized = save_manager.serialize_save(upgraded)
+    result["after"] = len(serialized.encode("utf-8"))
+    if serialized == text:
+        result["after"] = result["before"]
+    else:
+        result["status"] = "upgraded" if data.get("version") != upgraded["version"] else "compacted"
+        if not dry_run:
+            temp_path = f"{path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                f.write(serialized)
+            os.replace(temp_path, path)
+
+    if not dry_run:
+        stat = os.stat(path)
+        result["stat"] = [stat.st_mtime_ns, stat.st_size]
+    return result
+
+
+def _load_state(data_dir):
+    """读取上次维护的进度记录（文件名 -> [mtime_ns, size]）"""
+    try:
+        with open(os.path.join(data_dir, STATE_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(data_dir, state):
+    """原子写入维护进度"""
+    path = os.path.join(data_dir, STATE_FILE)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f"{path}.tmp", path)
+
+
+def run_maintenance(data_dir="data", workers=None, quarantine_dir=None, dry_run=False, restart=False):
+    """并行扫描存档目录：升级到当前格式、紧凑化、校验完整性并隔离损坏文件"""
+    quarantine_dir = quarantine_dir or os.path.join(data_dir, "quarantine")
+    lock_path = os.path.join(data_dir, LOCK_FILE)
+    try:
+        lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        print(f"❌ 另一个维护任务正在运行（如确认没有，请删除 {lock_path}）")
+        return None
+
+    try:
+        state = {} if restart else _load_state(data_dir)
+        tasks = []
+        skipped = 0
+        with os.scandir(data_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                if state.get(entry.name) == [stat.st_mtime_ns, stat.st_size]:
+                    skipped += 1  # 上次已处理且未改动，断点续跑时跳过
+                    continue
+                tasks.append((entry.path, quarantine_dir, dry_run))
+
+        print(f"🔍 待处理存档 {len(tasks)} 个，已跳过 {skipped} 个未改动存档")
+        counts = {"ok": 0, "upgraded": 0, "compacted": 0, "quarantined": 0}
+        bytes_before = bytes_after = 0
+        quarantined = []
+        start = time.perf_counter()
+
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunksize = max(1, len(tasks) // ((workers or os.cpu_count() or 1) * 8))
+            for i, result in enumerate(executor.map(_maintain_file, tasks, chunksize=chunksize), 1):
+                counts[result["status"]] += 1
+                bytes_before += result["before"]
+                bytes_after += result["after"]
+                if result["status"] == "quarantined":
+                    quarantined.append((result["name"], result["reason"]))
+                elif "stat" in result:
+                    state[result["name"]] = result["stat"]
+                if not dry_run and i % 500 == 0:
+                    _save_state(data_dir, state)
+
+        if not dry_run:
+            _save_state(data_dir, state)
+        elapsed = time.perf_counter() - start
+
+        stats = {
+            "files": len(tasks),
+            "skipped": skipped,
+            "elapsed": elapsed,
+            "files_per_sec": len(tasks) / elapsed if elapsed > 0 else 0.0,
+            "mb_per_sec": bytes_before / 1024 / 1024 / elapsed if elapsed > 0 else 0.0,
+            "bytes_before": bytes_before,
+            "bytes_after": bytes_after,
+            **counts,
+        }
+        _print_stats(stats, quarantined, quarantine_dir, dry_run)
+        return stats
+    finally:
+        os.close(lock_fd)
+        os.remove(lock_path)
+
+
+def _print_stats(stats, quarantined, quarantine_dir, dry_run):
+    """打印维护结果与吞吐统计"""
+    print("=" * 60)
+    print("🧰 存档维护完成" + ("（试运行，未写入任何文件）" if dry_run else ""))
+    print("=" * 60)
+    print(f"✅ 无需改动: {stats['ok']}")
+    print(f"⬆️  已升级:   {stats['upgraded']}")
+    print(f"🗜️  已紧凑化: {stats['compacted']}")
+    print(f"🚫 已隔离:   {stats['quarantined']}")
+    for name, reason in quarantined[:20]:
+        print(f"     - {name}: {reason}")
+    if len(quarantined) > 20:
+        print(f"     ... 其余 {len(quarantined) - 20} 个见 {quarantine_dir}")
+    saved = stats["bytes_before"] - stats["bytes_after"]
+    print(f"💾 体积: {stats['bytes_before'] / 1024:.1f}KB -> {stats['bytes_after'] / 1024:.1f}KB（节省 {saved / 1024:.1f}KB）")
+    print(f"⏱️  耗时 {stats['elapsed']:.2f}s，{stats['files_per_sec']:.0f} 个/秒，{stats['mb_per_sec']:.2f} MB/秒")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m src.save_tool", description="WGARP 存档维护工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    maintain = subparsers.add_parser("maintain", help="升级、紧凑化并校验存档，隔离损坏文件")
+    maintain.add_argument("--data-dir", default=save_manager.data_dir, help="存档目录")
+    maintain.add_argument("--workers", type=int, default=None, help="进程数（默认CPU核数）")
+    maintain.add_argument("--quarantine", default=None, help="损坏存档隔离目录（默认 <data-dir>/quarantine）")
+    maintain.add_argument("--dry-run", action="store_true", help="只检查不写入")
+    maintain.add_argument("--restart", action="store_true", help="忽略上次进度，重新处理全部存档")
+
+    export = subparsers.add_parser("export", help="将存档导出为单个归档文件")
+    export.add_argument("archive", help="归档路径（.ndjson / .ndjson.gz / .tar / .tar.gz）")
+    export.add_argument("--data-dir", default=save_manager.data_dir, help="存档目录")
+    export.add_argument("--since", default=None, help="只导出该日期之后更新的存档（ISO格式）")
+    export.add_argument("--search", default=None, help="只导出存档名或摘要包含该关键词的存档")
+
+    import_ = subparsers.add_parser("import", help="从归档文件导入存档")
+    import_.add_argument("archive", help="归档路径")
+    import_.add_argument("--data-dir", default=save_manager.data_dir, help="存档目录")
+    import_.add_argument("--on-conflict", choices=["rename", "skip", "overwrite"], default="rename",
+                         help="存档名冲突时的处理方式（默认自动改名）")
+
+    args = parser.parse_args(argv)
+    if args.command == "maintain":
+        stats = run_maintenance(args.data_dir, args.workers, args.quarantine, args.dry_run, args.restart)
+        return 0 if stats is not None else 1
+    elif args.command == "export":
+        start = time.perf_counter()
+        manager = SaveManager(args.data_dir)
+        count = manager.export_saves(args.archive, args.since, args.search)
+        elapsed = time.perf_counter() - start
+        print(f"📦 已导出 {count} 个存档到 {args.archive}（{elapsed:.2f}s）")
+        if manager.corrupted_saves:
+            print(f"⚠️  {len(manager.corrupted_saves)} 个文件无法读取，未导出（可运行 maintain 检查并隔离）：")
+            for name in manager.corrupted_saves:
+                print(f"     - {name}")
+            return 1
+        return 0
+    elif args.command == "import":
+        start = time.perf_counter()
+        counts = SaveManager(args.data_dir).import_saves(args.archive, args.on_conflict)
+        elapsed = time.perf_counter() - start
+        print(f"📥 已导入 {counts['imported']} 个存档（改名 {counts['renamed']}，覆盖 {counts['overwritten']}，"
+              f"跳过 {counts['skipped']}，失败 {counts['failed']}，{elapsed:.2f}s）")
+        return 0 if not counts["failed"] else 1
+    return 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,19 +3,33 @@ from src.error_handler import error_handler
 import os
 import json
 import time
+import io
+import gzip
+import hashlib
+import tarfile
 from datetime import datetime
 
+# 当前存档格式版本
+SAVE_VERSION = "2.0"
+# 旧版(1.0)存档字段，升级后不再保留
+LEGACY_FIELDS = ("world_description", "latest_summary", "last_conversation")
+
 class SaveManager:
     """智能存档管理器"""
     
-    def __init__(self):
-        self.data_dir = "data"
+    def __init__(self, data_dir="data"):
+        self.data_dir = data_dir
+        # 最近一次扫描存档列表时发现的损坏文件
+        self.corrupted_saves = []
         os.makedirs(self.data_dir, exist_ok=True)
     
     def _compress_messages(self, messages):
         """压缩消息格式，移除冗余信息"""
         compressed = []
-        for msg in messages[-10:]:  # 只保留最近10条消息
+        recent = messages[-10:]  # 只保留最近10条消息
+        # 最后一条回复原样保存：没有回合历史的存档续接时需要完整显示这一回合
+        last_reply = max((i for i, msg in enumerate(recent) if msg["role"] == "assistant"), default=None)
+        for i, msg in enumerate(recent):
             if msg["role"] == "user":
                 # 提取用户行动的核心内容
                 content = msg["content"]
@@ -24,7 +38,7 @@ class SaveManager:
                 compressed.append({"r": "u", "c": content})
             elif msg["role"] == "assistant":
                 # 只保留核心场景信息，去除格式化内容
-                content = self._extract_core_scenario(msg["content"])
+                content = msg["content"] if i == last_reply else self._extract_core_scenario(msg["content"])
                 compressed.append({"r": "a", "c": content})
         return compressed
     
@@ -59,11 +73,16 @@ class SaveManager:
         
         return llm_core.summarize_conversation([{"role": "user", "content": prompt}])
     
-    def save_game_state(self, messages, world_description, save_name=None, role=None, previous_summary=""):
-        """保存游戏状态（智能增量保存）"""
+    def save_game_state(self, messages, world_description, save_name=None, role=None, previous_summary="",
+                        summary=None, extra=None):
+        """保存游戏状态（智能增量保存）
+
+        :param summary: 已生成的摘要，提供时不再调用模型重新摘要
+        :param extra: 需要一并写入存档的附加字段（如回合历史编号）
+        """
         try:
             # 生成增量摘要
-            current_summary = self.generate_smart_summary(messages, previous_summary)
+            current_summary = summary or self.generate_smart_summary(messages, previous_summary)
             if not current_summary:
                 return "", None
             
@@ -81,13 +100,13 @@ class SaveManager:
                 "role": role,
                 "recent_context": compressed_messages,
                 "last_updated": datetime.now().isoformat(),
-                "version": "2.0"  # 新版本标识
+                "version": SAVE_VERSION  # 新版本标识
             }
+            if extra:
+                save_data.update(extra)
             
             # 保存到文件
-            file_path = f"{self.data_dir}/{save_name}.json"
-            with open(file_path, "w", encoding="utf-8") as f:
-                json.dump(save_data, f, ensure_ascii=False, indent=2)
+            self.write_save_file(f"{self.data_dir}/{save_name}.json", save_data)
             
             return current_summary, save_name
             
@@ -95,6 +114,55 @@ class SaveManager:
             error_handler.handle_llm_error(e)
             return "", None
     
+    def compute_checksum(self, data):
+        """计算存档内容的校验和（不含checksum字段本身）"""
+        payload = {k: v for k, v in data.items() if k != "checksum"}
+        canonical = json.dumps(payload, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def verify_checksum(self, data):
+        """校验存档完整性：无校验和返回None，否则返回是否一致"""
+        if "checksum" not in data:
+            return None
+        return data["checksum"] == self.compute_checksum(data)
+
+    def serialize_save(self, data):
+        """将存档数据序列化为紧凑JSON（附带校验和）"""
+        data = {k: v for k, v in data.items() if k != "checksum"}
+        data["checksum"] = self.compute_checksum(data)
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+
+    def write_save_file(self, file_path, data):
+        """原子写入存档文件，避免写入中断导致存档损坏"""
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.serialize_save(data))
+        os.replace(temp_path, file_path)
+
+    def upgrade_save_data(self, data):
+        """将任意版本的存档数据升级为当前格式，并移除重复的旧字段"""
+        if data.get("version") != SAVE_VERSION:
+            last_conversation = data.get("last_conversation")
+            upgraded = {
+                "summary": data.get("summary", data.get("latest_summary", "")),
+                "world": data.get("world", data.get("world_description", "")),
+                "role": data.get("role"),
+                "recent_context": data.get("recent_context") or (
+                    self._compress_messages([last_conversation]) if last_conversation else []
+                ),
+            }
+            if "last_updated" in data:
+                upgraded["last_updated"] = data["last_updated"]
+            # 保留其他附加字段
+            for key, value in data.items():
+                if key not in upgraded and key not in LEGACY_FIELDS:
+                    upgraded[key] = value
+            data = upgraded
+        else:
+            data = {k: v for k, v in data.items() if k not in LEGACY_FIELDS}
+        data["version"] = SAVE_VERSION
+        return data
+
     def _generate_save_name(self, summary):
         """生成存档名"""
         # 使用更简短的提示
@@ -119,7 +187,7 @@ class SaveManager:
             
             # 检查版本兼容性
             version = data.get("version", "1.0")
-            if version == "2.0":
+            if version == SAVE_VERSION:
                 return self._load_v2_format(data)
             else:
                 return self._load_v1_format(data)
@@ -152,6 +220,26 @@ class SaveManager:
             data.get("role", "")
         )
     
+    def expand_messages(self, compressed):
+        """将压缩的 r/c 消息格式展开为标准对话消息"""
+        messages = []
+        for msg in compressed or []:
+            content = msg.get("c", "")
+            if msg.get("r") == "u":
+                messages.append({"role": "user", "content": f"我的行动：{content}"})
+            elif msg.get("r") == "a":
+                messages.append({"role": "assistant", "content": content})
+        return messages
+
+    def read_save(self, save_name):
+        """读取存档原始数据，失败时返回空字典"""
+        file_path = f"{self.data_dir}/{save_name}.json"
+        try:
+            with open(file_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            return {}
+
     def _load_v1_format(self, data):
         """加载旧版本格式的存档（向后兼容）"""
         return (
@@ -168,6 +256,7 @@ class SaveManager:
             return []
         
         files = []
+        self.corrupted_saves = []
         for f in os.listdir(self.data_dir):
             if f.endswith('.json'):
                 try:
@@ -180,11 +269,15 @@ class SaveManager:
                     save_info = {
                         "filename": f[:-5],  # 去除.json后缀
                         "last_updated": data.get("last_updated", "未知"),
-                        "summary_preview": self._get_summary_preview(data)
+                        "summary_preview": self._get_summary_preview(data),
+                        # 新存档保存了解析后的世界观与角色记录，列表中直接使用其简短形式
+                        "world_title": (data.get("world_record") or {}).get("title", ""),
+                        "character": data.get("character")
                     }
                     files.append(save_info)
-                except:
-                    # 如果文件损坏，跳过
+                except Exception:
+                    # 如果文件损坏，跳过并记录，可使用存档维护工具隔离
+                    self.corrupted_saves.append(f)
                     continue
         
         # 按更新时间排序
@@ -207,6 +300,137 @@ class SaveManager:
         except:
             return False
 
+    # ---------- 批量导出/导入 ----------
+
+    def iter_saves(self, since=None, search=None):
+        """逐个读取存档并产出 (存档名, 数据)，不会一次性载入全部存档
+
+        :param since: 只包含该时间（ISO格式，如 2025-01-01）之后更新的存档
+        :param search: 只包含存档名或摘要中含有该关键词的存档
+        无法读取的文件被跳过，并记录在 corrupted_saves 中
+        """
+        for name, _, data in self._iter_save_files(since, search):
+            yield name, data
+
+    def _iter_save_files(self, since=None, search=None):
+        """逐个读取存档并产出 (存档名, 文件原始内容, 数据)"""
+        self.corrupted_saves = []
+        with os.scandir(self.data_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith(".json") or not entry.is_file():
+                    continue
+                name = entry.name[:-5]
+                try:
+                    with open(entry.path, "rb") as f:
+                        raw = f.read()
+                    data = json.loads(raw.decode("utf-8"))
+                except Exception:
+                    self.corrupted_saves.append(entry.name)
+                    continue
+                if since:
+                    updated = data.get("last_updated") or datetime.fromtimestamp(entry.stat().st_mtime).isoformat()
+                    if updated < since:
+                        continue
+                if search and search not in name and search not in data.get("summary", data.get("latest_summary", "")):
+                    continue
+                yield name, raw, data
+
+    def _archive_format(self, archive_path):
+        """根据扩展名判断归档格式：返回 (是否tar, 是否压缩)"""
+        path = archive_path.lower()
+        compressed = path.endswith(".gz") or path.endswith(".tgz")
+        is_tar = path.endswith((".tar", ".tar.gz", ".tgz"))
+        return is_tar, compressed
+
+    def export_saves(self, archive_path, since=None, search=None):
+        """将存档流式导出为单个NDJSON或tar归档（扩展名.gz时压缩），返回导出数量
+
+        两种格式都导出存档的原始内容（含原校验和），损坏的存档导入时仍会被识别；
+        无法读取而未导出的文件记录在 corrupted_saves 中。
+        """
+        is_tar, compressed = self._archive_format(archive_path)
+        count = 0
+        if is_tar:
+            with tarfile.open(archive_path, "w|gz" if compressed else "w|") as tar:
+                for name, payload, _ in self._iter_save_files(since, search):
+                    info = tarfile.TarInfo(f"{name}.json")
+                    info.size = len(payload)
+                    info.mtime = int(time.time())
+                    tar.addfile(info, io.BytesIO(payload))
+                    count += 1
+        else:
+            opener = gzip.open if compressed else open
+            with opener(archive_path, "wt", encoding="utf-8") as f:
+                for name, _, data in self._iter_save_files(since, search):
+                    f.write(json.dumps({"name": name, "data": data}, ensure_ascii=False, separators=(',', ':')))
+                    f.write("\n")
+                    count += 1
+        return count
+
+    def _iter_archive(self, archive_path):
+        """流式读取归档中的存档 (存档名, 数据)；无法解析的记录产出 (存档名或"", None)，归档截断时停止读取"""
+        is_tar, compressed = self._archive_format(archive_path)
+        try:
+            if is_tar:
+                with tarfile.open(archive_path, "r|*") as tar:
+                    for member in tar:
+                        if not member.isfile() or not member.name.endswith(".json"):
+                            continue
+                        name = os.path.basename(member.name)[:-5]
+                        with tar.extractfile(member) as f:
+                            raw = f.read()
+                        try:
+                            yield name, json.loads(raw.decode("utf-8"))
+                        except ValueError:
+                            yield name, None
+            else:
+                opener = gzip.open if compressed else open
+                with opener(archive_path, "rt", encoding="utf-8") as f:
+                    for line in f:
+                        if not line.strip():
+                            continue
+                        try:
+                            record = json.loads(line)
+                            yield record["name"], record["data"]
+                        except (ValueError, TypeError, KeyError):
+                            yield "", None
+        except (tarfile.TarError, EOFError, OSError, UnicodeDecodeError):
+            # 归档本身被截断或损坏：已读出的存档照常导入，剩余部分计为失败一次
+            yield "", None
+
+    def import_saves(self, archive_path, on_conflict="rename"):
+        """从归档流式导入存档
+
+        :param on_conflict: 存档名冲突时的处理方式：rename（自动改名）、skip（跳过）、overwrite（覆盖）
+        :return: 各处理结果的计数
+        """
+        counts = {"imported": 0, "renamed": 0, "skipped": 0, "overwritten": 0, "failed": 0}
+        for name, data in self._iter_archive(archive_path):
+            # 清理存档名，防止路径穿越
+            name = os.path.basename(name.replace("\\", "/")) if isinstance(name, str) else ""
+            if not name or name.startswith(".") or not isinstance(data, dict) or self.verify_checksum(data) is False:
+                counts["failed"] += 1
+                continue
+            file_path = f"{self.data_dir}/{name}.json"
+            if os.path.exists(file_path):
+                if on_conflict == "skip":
+                    counts["skipped"] += 1
+                    continue
+                elif on_conflict == "overwrite":
+                    counts["overwritten"] += 1
+                else:
+                    suffix = 1
+                    while os.path.exists(f"{self.data_dir}/{name}_导入{suffix}.json"):
+                        suffix += 1
+                    file_path = f"{self.data_dir}/{name}_导入{suffix}.json"
+                    counts["renamed"] += 1
+            try:
+                self.write_save_file(file_path, self.upgrade_save_data(data))
+                counts["imported"] += 1
+            except Exception:
+                counts["failed"] += 1
+        return counts
+
 # 创建全局存档管理器实例
 save_manager = SaveManager()
 
@@ -0,0 +1,129 @@
+import threading
+from src.telemetry import estimate_tokens
+
+
+def truncate_tokens(text, max_tokens):
+    """将文本截断到估算token数不超过上限"""
+    text = (text or "").strip()
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(text[:mid]) + 1 <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return text[:low] + "…"
+
+
+def _local_merge(summaries, max_tokens):
+    """本地合并：按比例截取每段摘要的开头（模型不可用时的回退）"""
+    share = max(20, max_tokens // max(1, len(summaries)))
+    return truncate_tokens(" ".join(truncate_tokens(s, share) for s in summaries if s), max_tokens)
+
+
+class SummaryTree:
+    """分层滚动摘要：检查点叶子摘要 → 章节摘要 → 篇章摘要
+
+    每一层都有token上限，只有子节点变化（叶子凑满一章、章节超过上限）时才重新合并，
+    因此提示词中的摘要大小与游戏时长无关。
+    """
+
+    def __init__(self, merger=None, leaves_per_chapter=4, chapters_per_arc=3,
+                 leaf_tokens=200, chapter_tokens=300, arc_tokens=400):
+        """
+        :param merger: 合并函数 merger(summaries, max_tokens, level) -> str，返回空值时使用本地合并
+        """
+        self.merger = merger
+        self.leaves_per_chapter = leaves_per_chapter
+        self.chapters_per_arc = chapters_per_arc
+        self.leaf_tokens = leaf_tokens
+        self.chapter_tokens = chapter_tokens
+        self.arc_tokens = arc_tokens
+        self.arc = ""        # 最早剧情的滚动合并
+        self.chapters = []   # 已封闭、尚未并入篇章的章节
+        self.leaves = []     # 当前章节的检查点摘要
+        self.pending = ""    # 两次检查点之间的临时进展（下一个叶子到来时丢弃）
+        self._lock = threading.Lock()
+
+    def _merge(self, summaries, max_tokens, level):
+        """调用合并函数，失败时回退到本地合并"""
+        merged = None
+        if self.merger:
+            try:
+                merged = self.merger(summaries, max_tokens, level)
+            except Exception:
+                merged = None
+        return truncate_tokens(merged, max_tokens) if merged else _local_merge(summaries, max_tokens)
+
+    def add_leaf(self, summary):
+        """加入一个检查点摘要，必要时向上合并为章节和篇章"""
+        summary = truncate_tokens(summary, self.leaf_tokens)
+        if not summary:
+            return
+        with self._lock:
+            self.leaves.append(summary)
+            self.pending = ""
+            leaves = list(self.leaves) if len(self.leaves) >= self.leaves_per_chapter else None
+        if leaves is None:
+            return
+
+        chapter = self._merge(leaves, self.chapter_tokens, "章节")
+        with self._lock:
+            self.leaves = self.leaves[len(leaves):]
+            self.chapters.append(chapter)
+            overflow = self.chapters[:-self.chapters_per_arc] if len(self.chapters) > self.chapters_per_arc else None
+            arc = self.arc
+        if overflow is None:
+            return
+
+        new_arc = self._merge(([arc] if arc else []) + overflow, self.arc_tokens, "篇章")
+        with self._lock:
+            self.arc = new_arc
+            self.chapters = self.chapters[len(overflow):]
+
+    def set_pending(self, progress):
+        """记录两次检查点之间的最新进展"""
+        with self._lock:
+            self.pending = truncate_tokens(progress, self.leaf_tokens // 2)
+
+    def is_empty(self):
+        return not (self.arc or self.chapters or self.leaves or self.pending)
+
+    def render(self):
+        """生成用于提示词的摘要：篇章 + 章节 + 当前章节的叶子（大小有固定上限）"""
+        with self._lock:
+            parts = []
+            if self.arc:
+                parts.append(f"【前情】{self.arc}")
+            for i, chapter in enumerate(self.chapters, 1):
+                parts.append(f"【章节{i}】{chapter}")
+            if self.leaves:
+                parts.append(f"【近况】{' '.join(self.leaves)}")
+            if self.pending:
+                parts.append(f"【最新】{self.pending}")
+            return "\n".join(parts)
+
+    def latest_leaf(self):
+        """最近一个检查点摘要"""
+        with self._lock:
+            if self.leaves:
+                return self.leaves[-1]
+            return self.chapters[-1] if self.chapters else self.arc
+
+    def to_dict(self):
+        with self._lock:
+            return {"arc": self.arc, "chapters": list(self.chapters), "leaves": list(self.leaves)}
+
+    @classmethod
+    def from_dict(cls, data, merger=None, fallback_summary=""):
+        """从存档恢复；旧存档没有摘要树时，以存档摘要作为第一个叶子"""
+        tree = cls(merger=merger)
+        if data:
+            tree.arc = data.get("arc", "")
+            tree.chapters = list(data.get("chapters", []))
+            tree.leaves = list(data.get("leaves", []))
+        elif fallback_summary:
+            tree.add_leaf(fallback_summary)
+        return tree
@@ -0,0 +1,95 @@
+import re
+import threading
+from contextlib import contextmanager
+
+_CJK_PATTERN = re.compile(r'[\u3000-\u303f\u4e00-\u9fff\uff00-\uffef]')
+
+
+def estimate_tokens(text):
+    """粗略估算文本的token数：中日韩字符约1个token，其他字符约4个一个token"""
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class Telemetry:
+    """会话遥测：统计大模型调用次数、token用量、耗时及各类计数（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.llm_usage = {}  # model_type -> {"calls", "prompt_tokens", "completion_tokens", "seconds"}
+        self.counters = {}
+        self.timings = {}  # name -> [次数, 总秒数, 最大秒数]
+        self.ratios = {}  # name -> [命中量, 总量]
+
+    def record_llm_call(self, model_type, prompt_tokens, completion_tokens, seconds):
+        """记录一次大模型调用"""
+        with self._lock:
+            usage = self.llm_usage.setdefault(
+                model_type, {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "seconds": 0.0}
+            )
+            usage["calls"] += 1
+            usage["prompt_tokens"] += prompt_tokens
+            usage["completion_tokens"] += completion_tokens
+            usage["seconds"] += seconds
+        for collector in getattr(self._local, "collectors", []):
+            collector["calls"] += 1
+            collector["prompt_tokens"] += prompt_tokens
+            collector["completion_tokens"] += completion_tokens
+
+    @contextmanager
+    def track_calls(self):
+        """统计当前线程在 with 块内发起的大模型调用"""
+        collector = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        collectors = getattr(self._local, "collectors", None)
+        if collectors is None:
+            collectors = self._local.collectors = []
+        collectors.append(collector)
+        try:
+            yield collector
+        finally:
+            collectors.remove(collector)
+
+    def increment(self, name, amount=1):
+        """累加计数器"""
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def record_timing(self, name, seconds):
+        """记录一次耗时"""
+        with self._lock:
+            timing = self.timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def record_ratio(self, name, part, total):
+        """累加比例统计（如前缀复用率）"""
+        with self._lock:
+            ratio = self.ratios.setdefault(name, [0, 0])
+            ratio[0] += part
+            ratio[1] += total
+
+    def report(self):
+        """生成可读的统计报告"""
+        lines = []
+        with self._lock:
+            for model_type, usage in sorted(self.llm_usage.items()):
+                lines.append(
+                    f"{model_type}: {usage['calls']}次调用，输入{usage['prompt_tokens']} / "
+                    f"输出{usage['completion_tokens']} tokens，{usage['seconds']:.1f}s"
+                )
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"{name}: {value}")
+            for name, (count, total, peak) in sorted(self.timings.items()):
+                lines.append(f"{name}: 平均{total / count * 1000:.0f}ms，最大{peak * 1000:.0f}ms（{count}次）")
+            for name, (part, total) in sorted(self.ratios.items()):
+                if total:
+                    lines.append(f"{name}: {part / total:.0%}（{part} / {total}）")
+        return "\n".join(lines)
+
+
+# 全局遥测实例
+telemetry = Telemetry()
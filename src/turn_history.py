@@ -0,0 +1,271 @@
+import os
+import json
+import time
+import uuid
+
+# 回合历史文件目录（位于存档目录下的子目录，不会出现在存档列表中）
+HISTORY_DIR = "data/history"
+# 两个关键帧之间间隔的回合数。关键帧只保存上一个关键帧之后变动的消息窗口，
+# 更早的消息沿关键帧链回溯得到，文件总大小与对话长度成线性关系
+KEYFRAME_INTERVAL = 10
+
+
+def extract_block(reply, names):
+    """从AI回复中提取指定字段（如用户状态、用户物品栏）的内容"""
+    for line in (reply or "").split('\n'):
+        line = line.strip()
+        for name in names:
+            if line.startswith(f"{name}:") or line.startswith(f"{name}："):
+                return line[len(name) + 1:].strip()
+    return ""
+
+
+def _summary_diff(old, new):
+    """计算摘要差异：[公共前缀长度, 新后缀]"""
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    return [prefix, new[prefix:]]
+
+
+def _messages_diff(old, new):
+    """计算消息差异：返回 (需从尾部移除的条数, 新增消息列表)"""
+    prefix = 0
+    limit = min(len(old), len(new))
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    return len(old) - prefix, new[prefix:]
+
+
+class TurnHistory:
+    """回合快照历史：周期性关键帧 + 相对上一回合的增量记录，支持回溯与分支
+
+    从历史中间的回合续接时不会立即分出新分支，直到该回合之后真正记录了新的回合。
+    """
+
+    def __init__(self, history_id=None, parent=None, fork_turn=None, history_dir=HISTORY_DIR,
+                 keyframe_interval=KEYFRAME_INTERVAL):
+        self.history_id = history_id or f"h{int(time.time())}_{uuid.uuid4().hex[:6]}"
+        self.parent = parent
+        self.fork_turn = fork_turn
+        self.history_dir = history_dir
+        self.keyframe_interval = keyframe_interval
+        self.file_path = os.path.join(history_dir, f"{self.history_id}.jsonl")
+        # 索引：[(回合号, 文件偏移, 是否关键帧, 行动标签)]
+        self._index = []
+        self._last_state = None
+        self._last_keyframe_turn = None
+        self._stable = 0  # 最近一个关键帧之后未被改动过的消息前缀长度
+        self._head = None  # 从历史中间续接时的回合号，记录新回合时才分出分支
+        os.makedirs(history_dir, exist_ok=True)
+        if os.path.exists(self.file_path):
+            self._build_index()
+        else:
+            self._append({"meta": {"id": self.history_id, "parent": parent, "fork_turn": fork_turn,
+                                   "created": int(time.time())}})
+
+    @classmethod
+    def resume(cls, history_id, turn, history_dir=HISTORY_DIR):
+        """续接已有历史；若存档回合不是历史末尾，则在之后记录新回合时从该回合分出新分支"""
+        if not history_id or not os.path.exists(os.path.join(history_dir, f"{history_id}.jsonl")):
+            return cls(history_dir=history_dir)
+        history = cls(history_id, history_dir=history_dir)
+        if turn is None or history.latest_turn() in (None, turn):
+            return history
+        if not history.has_turn(turn):
+            # 历史文件中缺少存档回合（如写入中断被截断），改为新建历史
+            return cls(history_dir=history_dir)
+        history._head = turn
+        return history
+
+    # ---------- 写入 ----------
+
+    def _append(self, record):
+        """追加一条记录，返回文件偏移"""
+        line = (json.dumps(record, ensure_ascii=False, separators=(',', ':')) + "\n").encode("utf-8")
+        with open(self.file_path, "ab") as f:
+            offset = f.tell()
+            f.write(line)
+        return offset
+
+    def _adopt(self, branch):
+        """切换为写入另一个分支"""
+        self.history_id, self.parent, self.fork_turn = branch.history_id, branch.parent, branch.fork_turn
+        self.file_path = branch.file_path
+        self._index, self._last_state = branch._index, branch._last_state
+        self._last_keyframe_turn, self._stable = branch._last_keyframe_turn, branch._stable
+
+    def record_turn(self, turn, messages, status="", inventory="", summary="", summary_tree=None):
+        """记录一个回合的完整游戏状态（内部自动转为增量或关键帧）
+
+        :param summary_tree: 摘要树（SummaryTree.to_dict()），只在检查点后发生变化，从该回合分支时原样恢复
+        """
+        if self._head is not None:
+            # 从历史中间续接后第一次记录：先从续接的回合分出新分支
+            head, self._head = self._head, None
+            self._adopt(self.fork(head))
+        state = {
+            "messages": [msg for msg in messages if msg.get("role") != "system"],
+            "status": status,
+            "inventory": inventory,
+            "summary": summary or "",
+            "tree": summary_tree,
+        }
+        label = self._action_label(state["messages"])
+        is_keyframe = (self._last_state is None or self._last_keyframe_turn is None
+                       or turn - self._last_keyframe_turn >= self.keyframe_interval)
+
+        if is_keyframe:
+            # 关键帧只保存上一个关键帧之后变动的消息，"b" 为沿用上一个关键帧的消息前缀长度
+            base = self._stable if self._last_state is not None else 0
+            record = {"t": turn, "k": 1, "a": label, "b": base,
+                      "s": {**state, "messages": state["messages"][base:]}}
+            self._last_keyframe_turn = turn
+            self._stable = len(state["messages"])
+        else:
+            prev = self._last_state
+            cut, added = _messages_diff(prev["messages"], state["messages"])
+            record = {"t": turn, "a": label, "m": added}
+            if cut:
+                record["cut"] = cut
+                self._stable = min(self._stable, len(prev["messages"]) - cut)
+            if status != prev["status"]:
+                record["st"] = status
+            if inventory != prev["inventory"]:
+                record["inv"] = inventory
+            if state["summary"] != prev["summary"]:
+                record["sd"] = _summary_diff(prev["summary"], state["summary"])
+            if summary_tree != prev.get("tree"):
+                record["tr"] = summary_tree
+
+        offset = self._append(record)
+        self._index.append((turn, offset, is_keyframe, label))
+        self._last_state = state
+
+    def _action_label(self, messages):
+        """取最近一次玩家行动作为回合标签"""
+        for msg in reversed(messages):
+            if msg.get("role") == "user":
+                content = msg.get("content", "")
+                if content.startswith("我的行动："):
+                    content = content[5:]
+                return content[:20]
+        return ""
+
+    # ---------- 读取 ----------
+
+    def _build_index(self):
+        """扫描历史文件建立回合索引，并恢复最后一回合的状态"""
+        offset = 0
+        with open(self.file_path, "rb+") as f:
+            for raw in f:
+                try:
+                    record = json.loads(raw) if raw.endswith(b"\n") else None
+                except ValueError:
+                    record = None
+                if record is None:
+                    # 写入中断留下的残行：截掉，之后的增量记录无法再应用
+                    f.truncate(offset)
+                    break
+                if "meta" in record:
+                    self.parent = record["meta"].get("parent")
+                    self.fork_turn = record["meta"].get("fork_turn")
+                else:
+                    is_keyframe = bool(record.get("k"))
+                    self._index.append((record["t"], offset, is_keyframe, record.get("a", "")))
+                    if is_keyframe:
+                        self._last_keyframe_turn = record["t"]
+                offset += len(raw)
+        if offset == 0:
+            # 连元信息行都未写完整
+            self._append({"meta": {"id": self.history_id, "parent": self.parent, "fork_turn": self.fork_turn,
+                                   "created": int(time.time())}})
+        if self._index:
+            self._last_state, self._stable = self._replay(len(self._index) - 1)
+
+    def latest_turn(self):
+        """最后记录的回合号（从历史中间续接时为续接的回合号）"""
+        if self._head is not None:
+            return self._head
+        return self._index[-1][0] if self._index else None
+
+    def has_turn(self, turn):
+        """历史中是否记录了指定回合"""
+        return any(entry[0] == turn for entry in self._index)
+
+    def list_turns(self):
+        """列出所有回合节点 [(回合号, 行动标签)]"""
+        return [(turn, label) for turn, _, _, label in self._index]
+
+    def reconstruct(self, turn):
+        """重建指定回合的完整状态"""
+        position = None
+        for i, entry in enumerate(self._index):
+            if entry[0] == turn:
+                position = i
+        if position is None:
+            raise ValueError(f"历史中不存在第{turn}回合")
+        return self._replay(position)[0]
+
+    def _replay(self, position):
+        """沿关键帧链拼出最近关键帧处的完整消息，再应用之后的增量直到索引中的第position条记录
+
+        返回 (状态, 最近关键帧之后未被改动过的消息前缀长度)
+        """
+        start = position
+        while not self._index[start][2]:
+            start -= 1
+
+        state = None
+        with open(self.file_path, "rb") as f:
+            for _, offset, is_keyframe, _ in self._index[:start + 1]:
+                if not is_keyframe:
+                    continue
+                f.seek(offset)
+                record = json.loads(f.readline())
+                messages = state["messages"][:record.get("b", 0)] if state else []
+                state = {**record["s"], "messages": messages + record["s"]["messages"]}
+            stable = len(state["messages"])
+            for _ in range(position - start):
+                record = json.loads(f.readline())
+                if record.get("cut"):
+                    del state["messages"][-record["cut"]:]
+                    stable = min(stable, len(state["messages"]))
+                state["messages"].extend(record.get("m", []))
+                if "st" in record:
+                    state["status"] = record["st"]
+                if "inv" in record:
+                    state["inventory"] = record["inv"]
+                if "sd" in record:
+                    prefix, suffix = record["sd"]
+                    state["summary"] = state["summary"][:prefix] + suffix
+                if "tr" in record:
+                    state["tree"] = record["tr"]
+        return state, stable
+
+    def fork(self, turn):
+        """从指定回合分出新分支，新分支以该回合的关键帧开始"""
+        state = self.reconstruct(turn)
+        branch = TurnHistory(parent=self.history_id, fork_turn=turn, history_dir=self.history_dir,
+                             keyframe_interval=self.keyframe_interval)
+        branch.record_turn(turn, state["messages"], state["status"], state["inventory"], state["summary"],
+                           state.get("tree"))
+        return branch
+
+
+def list_branches(history_dir=HISTORY_DIR):
+    """列出所有历史分支的元信息（只读取每个文件的首行）"""
+    branches = []
+    if not os.path.exists(history_dir):
+        return branches
+    for name in os.listdir(history_dir):
+        if not name.endswith(".jsonl"):
+            continue
+        try:
+            with open(os.path.join(history_dir, name), "r", encoding="utf-8") as f:
+                meta = json.loads(f.readline()).get("meta", {})
+            branches.append(meta)
+        except Exception:
+            continue
+    return branches
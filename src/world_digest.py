@@ -0,0 +1,136 @@
+import os
+import re
+import json
+import hashlib
+from src.retrieval import BM25Index, tokenize
+
+# 世界观摘要缓存目录（按世界观内容哈希存放，与存档共用数据目录）
+DIGEST_DIR = "data/world_digest"
+
+_HEADING = re.compile(r'^\s*(?:#{1,6}\s*|[一二三四五六七八九十]+[、.．]\s*|第[一二三四五六七八九十\d]+[章节部分]\s*)(.+?)\s*$')
+_MARKUP = re.compile(r'[*_`>#]+')
+_SENTENCE_END = re.compile(r'(?<=[。！？；!?;])')
+
+
+def world_hash(world):
+    """世界观内容哈希，用作摘要缓存的键"""
+    return hashlib.sha256((world or "").encode("utf-8")).hexdigest()[:16]
+
+
+def split_sections(world):
+    """按标题与空行将世界观切分为段落 [(标题, 正文)]"""
+    sections = []
+    title, body = "", []
+    for raw in (world or "").split('\n'):
+        line = raw.strip()
+        heading = _HEADING.match(line)
+        if heading or not line:
+            if body:
+                sections.append((title, " ".join(body)))
+                body = []
+            if heading:
+                title = _MARKUP.sub('', heading.group(1)).strip(" ：:")
+            continue
+        line = _MARKUP.sub('', line).lstrip("-•· ").strip()
+        if line:
+            body.append(line)
+    if body:
+        sections.append((title, " ".join(body)))
+    return sections
+
+
+def _lead(text, limit):
+    """取正文开头的完整句子，不超过 limit 字"""
+    lead = ""
+    for sentence in _SENTENCE_END.split(text):
+        if lead and len(lead) + len(sentence) > limit:
+            break
+        lead += sentence
+    return lead[:limit]
+
+
+def extract_digest(world, max_chars=600):
+    """本地抽取世界观摘要：每个段落保留标题与首句，按段落数平均分配字数"""
+    if len(world or "") <= max_chars:
+        return (world or "").strip()
+    sections = split_sections(world)
+    # 先为标题留出位置，剩余字数平均分给各段正文，保证每个段落都有代表
+    titles = sum(len(title) + 2 for title, _ in sections)
+    per_section = max(10, (max_chars - titles) // max(1, len(sections)))
+    lines = []
+    last_title = None
+    for title, body in sections:
+        lead = _lead(body, per_section)
+        if title and title != last_title:
+            lines.append(f"{title}：{lead}")
+        else:
+            lines.append(lead)
+        last_title = title
+    digest = "\n".join(lines)
+    return digest[:max_chars]
+
+
+class WorldDigest:
+    """世界观摘要：世界观被接受后只生成一次并按内容哈希缓存，每回合提示词使用摘要代替全文
+
+    玩家行动提到摘要中没有的世界观内容时，可从全文中检索相关段落临时注入。
+    """
+
+    def __init__(self, world, digest):
+        self.world = world or ""
+        self.digest = digest or self.world
+        self.sections = [f"{title}：{body}" if title else body for title, body in split_sections(self.world)]
+        self._index = None
+        self._world_terms = None
+        self._digest_terms = set(tokenize(self.digest))
+
+    @classmethod
+    def load(cls, world, mode="extractive", max_chars=600, generator=None, cache_dir=DIGEST_DIR):
+        """读取缓存的摘要，没有时生成并缓存
+
+        :param mode: extractive（本地抽取）、llm（模型生成，失败时回退到本地抽取）、off（使用全文）
+        :param generator: llm 模式下的生成函数 generator(world, max_chars)
+        """
+        if mode == "off" or len(world or "") <= max_chars:
+            return cls(world, world)
+        cache_path = os.path.join(cache_dir, f"{world_hash(world)}.json")
+        try:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            if cached.get("mode") == mode and cached.get("digest"):
+                return cls(world, cached["digest"])
+        except (OSError, ValueError):
+            pass
+        digest = generator(world, max_chars) if mode == "llm" and generator else None
+        if not digest or not digest.strip():
+            mode, digest = "extractive", extract_digest(world, max_chars)
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump({"mode": mode, "digest": digest.strip()}, f, ensure_ascii=False)
+        return cls(world, digest.strip())
+
+    def lookup(self, text, top_k=2, min_score=1.0):
+        """检索与文本中“摘要未覆盖的世界观内容”相关的原文段落；都已覆盖时返回空列表"""
+        if self.digest == self.world:
+            return []
+        if self._index is None:
+            self._index = BM25Index()
+            for section in self.sections:
+                self._index.add(section)
+            self._world_terms = set(self._index.postings)
+        # 只看较具体的词（出现在少数段落中），避免常用词频繁触发检索
+        specific = max(1, len(self.sections) // 3)
+        unfamiliar = [term for term in dict.fromkeys(tokenize(text))
+                      if term in self._world_terms and term not in self._digest_terms
+                      and len(self._index.postings[term]) <= specific]
+        if not unfamiliar:
+            return []
+        results = self._index.search(" ".join(unfamiliar), top_k)
+        return [self.sections[doc_id] for score, doc_id in results if score >= min_score]
+
+
+def format_world_passages(passages):
+    """将检索到的世界观原文格式化为注入提示词的文本"""
+    lines = ["【世界观原文参考】以下设定与玩家当前行动有关："]
+    lines.extend(f"- {passage}" for passage in passages)
+    return "\n".join(lines)
@@ -1,7 +1,111 @@
+import logging
+import threading
 from src.llm_core import llm_core
+from src.world_library import world_library
+from src.records import World
 
-def generate_world(background="地理、历史、文化、魔法体系"):
-    result = llm_core.generate_world(background)
+def generate_world(background="地理、历史、文化、魔法体系", on_delta=None):
+    result = llm_core.generate_world(background, on_delta=on_delta)
     if result is None:
         print(f"\n世界观生成失败\n")
     return result
+
+
+class WorldCandidatePool:
+    """并行生成多个世界观候选
+
+    同时最多 size 个生成任务，各任务使用不同温度以拉开差异；完成的候选按到达顺序排队等待查看，
+    被放弃的候选会补上新的生成任务。关闭后尚未查看的候选（包括之后才完成的）存入世界观库。
+    """
+
+    def __init__(self, background, size=3, temperature_spread=0.15, library=world_library):
+        self.background = background
+        self.size = max(1, size)
+        self.library = library
+        base = llm_core.config_manager.get_model_config('world_generation')['temperature']
+        offsets = [0.0, temperature_spread, -temperature_spread]
+        self.temperatures = [min(1.0, max(0.0, base + offsets[i % len(offsets)])) for i in range(self.size)]
+        self.ready = []  # 已完成、尚未被接受或放弃的候选 [{"world", "record", "temperature", "source"}]
+        self.pending = 0
+        self.failed = 0
+        self.closed = False
+        self._submitted = 0
+        self._changed = threading.Condition()
+        # 优先复用世界观库中相同背景的候选
+        while len(self.ready) < self.size:
+            world = library.take(background)
+            if not world:
+                break
+            self.ready.append({"world": world, "record": World(world), "temperature": None, "source": "library"})
+        with self._changed:
+            for _ in range(self.size - len(self.ready)):
+                self._submit()
+
+    def _submit(self):
+        """启动一个后台生成任务"""
+        temperature = self.temperatures[self._submitted % self.size]
+        self._submitted += 1
+        self.pending += 1
+        threading.Thread(target=self._generate, args=(temperature,), daemon=True).start()
+
+    def _generate(self, temperature):
+        world = None
+        try:
+            world = llm_core.generate_world(self.background, temperature=temperature)
+            with self._changed:
+                if not world:
+                    self.failed += 1
+                elif self.closed:
+                    self.library.add(self.background, world)
+                else:
+                    self.ready.append({"world": world, "record": World(world), "temperature": temperature,
+                                       "source": "generated"})
+        except Exception as e:
+            # 生成任务异常也计为失败，避免选择界面一直等待
+            logging.warning(f"世界观候选生成失败: {e}")
+            with self._changed:
+                self.failed += 1
+        finally:
+            with self._changed:
+                self.pending -= 1
+                self._changed.notify_all()
+
+    def wait(self, timeout=None):
+        """等待候选状态变化（新候选完成或生成失败）"""
+        with self._changed:
+            self._changed.wait(timeout)
+
+    def snapshot(self):
+        """当前已完成的候选与仍在生成的数量"""
+        with self._changed:
+            return list(self.ready), self.pending
+
+    def refill(self):
+        """补充生成任务，使已完成与生成中的候选合计保持 size 个"""
+        with self._changed:
+            while not self.closed and len(self.ready) + self.pending < self.size:
+                self._submit()
+
+    def discard(self, candidate, replace=True):
+        """放弃一个已查看的候选；replace 为真时补上一个新的生成任务"""
+        with self._changed:
+            if candidate in self.ready:
+                self.ready.remove(candidate)
+        if replace:
+            self.refill()
+
+    def accept(self, candidate):
+        """接受一个候选；新生成的候选作为已使用条目存入世界观库，之后可以选择复用"""
+        with self._changed:
+            if candidate in self.ready:
+                self.ready.remove(candidate)
+        if candidate["source"] != "library":
+            self.library.add(self.background, candidate["world"], used=True)
+
+    def close(self):
+        """停止补充新任务，未查看的候选存入世界观库（仍在生成的任务完成后也会存入）"""
+        with self._changed:
+            self.closed = True
+            for candidate in self.ready:
+                self.library.add(self.background, candidate["world"])
+            self.ready.clear()
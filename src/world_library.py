@@ -0,0 +1,195 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import threading
+from src.config_manager import config_manager
+from src.records import Character, World
+
+# 内容库目录（位于存档目录下的子目录，不会出现在存档列表中）
+LIBRARY_DIR = "data/library"
+
+
+def library_key(model_config, source, *context):
+    """条目键：生成提示（世界观背景或角色提示词）、影响结果的上下文与模型配置（提供商、模型、温度）的哈希"""
+    parts = [str(model_config.get("provider", "")), str(model_config.get("model", "")),
+             str(model_config.get("temperature", "")), " ".join((source or "").split()), *context]
+    return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()[:16]
+
+
+class ContentLibrary:
+    """内容库：保存生成过的世界观或角色，按 生成提示 + 模型配置 建立索引，供之后复用
+
+    数据文件为追加写入的 JSONL：{"id", "k", "src", "w", "ts"} 为新增条目（"u" 表示已被使用），
+    {"take": id} 表示条目被取用。旁边的 .idx 文件为每行数据记录键、标题与字节偏移，
+    启动时只读索引（数据文件中未被索引的尾部会补建索引），全文在需要时按偏移读取。
+    """
+
+    def __init__(self, file_path, model_type, describe=None):
+        self.file_path = file_path
+        self.index_path = os.path.splitext(file_path)[0] + ".idx"
+        self.model_type = model_type
+        self.describe = describe or (lambda text: text[:20])
+        self._entries = {}  # 条目编号 -> {"key", "title", "ts", "offset", "length", "used"}
+        self._by_key = {}  # 键 -> [条目编号]，按写入顺序
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    def key(self, source, *context):
+        """当前模型配置下 source 对应的键"""
+        return library_key(config_manager.config['models'].get(self.model_type, {}), source, *context)
+
+    def _apply(self, record, offset, length):
+        """将一条数据（或索引）记录应用到内存索引"""
+        if "take" in record:
+            entry = self._entries.get(record["take"])
+            if entry:
+                entry["used"] = True
+            return
+        self._entries[record["id"]] = {"key": record["k"], "title": record["t"], "ts": record["ts"],
+                                       "offset": offset, "length": length, "used": bool(record.get("u"))}
+        self._by_key.setdefault(record["k"], []).append(record["id"])
+
+    def _index_line(self, record, offset, length):
+        if "take" in record:
+            line = {"take": record["take"], "o": offset, "n": length}
+        else:
+            line = {"id": record["id"], "k": record["k"], "t": record["t"], "ts": record["ts"],
+                    "o": offset, "n": length}
+            if record.get("u"):
+                line["u"] = 1
+        return (json.dumps(line, ensure_ascii=False, separators=(',', ':')) + "\n").encode("utf-8")
+
+    def _load(self):
+        """首次使用时读取索引文件，并为数据文件中尚未索引的部分补建索引"""
+        if self._loaded:
+            return
+        self._loaded = True
+        if not os.path.exists(self.file_path):
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            return
+        covered = 0
+        good = 0  # 索引文件中最后一个完整行的结束位置
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "rb") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # 写入中断留下的残行
+                    self._apply(record, record["o"], record["n"])
+                    covered = record["o"] + record["n"]
+                    good += len(line)
+        if covered > os.path.getsize(self.file_path):
+            # 索引与数据文件不一致，整体重建
+            self._entries, self._by_key, covered, good = {}, {}, 0, 0
+        with open(self.index_path, "ab") as index:
+            index.truncate(good)
+            self._scan(covered, index)
+
+    def _scan(self, start, index):
+        """从数据文件的 start 处开始逐行建立索引"""
+        with open(self.file_path, "rb+") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if not line.endswith(b"\n"):
+                    # 写入中断留下的残行：截掉，避免与之后追加的记录连在一起
+                    f.truncate(offset)
+                    break
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    offset += len(line)
+                    continue
+                if "take" not in record:
+                    if "k" not in record:
+                        # 旧版世界观库条目：{"id", "bg", "w", "ts"}
+                        record = {"id": record["id"], "k": self.key(record["bg"]), "src": record["bg"],
+                                  "w": record["w"], "ts": record["ts"]}
+                    record["t"] = self.describe(record["w"])
+                self._apply(record, offset, len(line))
+                index.write(self._index_line(record, offset, len(line)))
+                offset += len(line)
+
+    def _append(self, record):
+        """追加一条记录到数据文件与索引文件"""
+        os.makedirs(os.path.dirname(self.file_path) or ".", exist_ok=True)
+        data = (json.dumps({k: v for k, v in record.items() if k != "t"}, ensure_ascii=False,
+                           separators=(',', ':')) + "\n").encode("utf-8")
+        with open(self.file_path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+        with open(self.index_path, "ab") as index:
+            index.write(self._index_line(record, offset, len(data)))
+        self._apply(record, offset, len(data))
+
+    def add(self, source, text, *context, used=False):
+        """存入一个生成结果；used 为真表示已被使用（仍可从库中选择复用，但不会被 take 取出）"""
+        if not text:
+            return None
+        entry_id = uuid.uuid4().hex[:12]
+        record = {"id": entry_id, "k": self.key(source, *context), "src": source, "w": text,
+                  "ts": int(time.time()), "t": self.describe(text)}
+        if used:
+            record["u"] = 1
+        with self._lock:
+            self._load()
+            self._append(record)
+        return entry_id
+
+    def take(self, source, *context):
+        """取出一个相同键、尚未使用的条目全文（先存先取），没有时返回None"""
+        with self._lock:
+            self._load()
+            for entry_id in self._by_key.get(self.key(source, *context), []):
+                if not self._entries[entry_id]["used"]:
+                    self._append({"take": entry_id})
+                    return self._read(entry_id)
+            return None
+
+    def count(self, source, *context):
+        """相同键下尚未使用的条目数量"""
+        with self._lock:
+            self._load()
+            return sum(1 for entry_id in self._by_key.get(self.key(source, *context), [])
+                       if not self._entries[entry_id]["used"])
+
+    def entries(self, source, *context, limit=None):
+        """相同键下的全部条目（包括已使用的），最新的在前：[{"id", "title", "ts", "used"}]"""
+        with self._lock:
+            self._load()
+            ids = self._by_key.get(self.key(source, *context), [])[::-1][:limit]
+            return [{"id": entry_id, "title": self._entries[entry_id]["title"], "ts": self._entries[entry_id]["ts"],
+                     "used": self._entries[entry_id]["used"]} for entry_id in ids]
+
+    def get(self, entry_id):
+        """按条目编号读取全文"""
+        with self._lock:
+            self._load()
+            return self._read(entry_id) if entry_id in self._entries else None
+
+    def use(self, entry_id):
+        """选择复用一个条目：标记为已使用并返回全文"""
+        with self._lock:
+            self._load()
+            if entry_id not in self._entries:
+                return None
+            if not self._entries[entry_id]["used"]:
+                self._append({"take": entry_id})
+            return self._read(entry_id)
+
+    def _read(self, entry_id):
+        entry = self._entries[entry_id]
+        with open(self.file_path, "rb") as f:
+            f.seek(entry["offset"])
+            return json.loads(f.read(entry["length"]))["w"]
+
+
+# 全局世界观库（按背景 + 世界观生成模型配置索引）与角色库（按角色提示词 + 世界观内容哈希 + 角色生成模型配置索引）
+world_library = ContentLibrary(os.path.join(LIBRARY_DIR, "worlds.jsonl"), "world_generation",
+                               lambda text: World(text).title)
+character_library = ContentLibrary(os.path.join(LIBRARY_DIR, "characters.jsonl"), "character_generation",
+                                   lambda text: Character.parse(text).short)